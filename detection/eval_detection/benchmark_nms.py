@@ -0,0 +1,265 @@
+import argparse
+import resource
+import time
+
+import numpy as np
+import torch
+
+import nms_1d_cpu
+
+from nms import batched_nms, seg_voting, SoftNMSop, NMSop
+
+
+parser = argparse.ArgumentParser(
+    description="Benchmark the batched 1D NMS against the per-class Python loop",
+    formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+)
+parser.add_argument(
+    "--num_segs",
+    type=int,
+    nargs='+',
+    default=[10000, 100000],
+    help="Number of proposals per video to benchmark"
+)
+parser.add_argument(
+    "--num_classes",
+    type=int,
+    default=3806,
+    help="Number of action classes"
+)
+parser.add_argument(
+    "--video_length",
+    type=float,
+    default=600.0,
+    help="Length of the synthetic video in seconds"
+)
+parser.add_argument(
+    "--nms",
+    type=str,
+    default='soft',
+    choices=['soft', 'hard'],
+    help="NMS variant to benchmark"
+)
+parser.add_argument(
+    "--scaling",
+    action='store_true',
+    help="Benchmark the sweep kernels against the quadratic kernels on a single class instead"
+)
+parser.add_argument(
+    "--voting",
+    action='store_true',
+    help="Benchmark the sparse segment voting against the dense N_nms x N_all version instead"
+)
+parser.add_argument(
+    "--max_quadratic",
+    type=int,
+    default=100000,
+    help="Largest number of proposals to run the quadratic kernels on in --scaling mode"
+)
+parser.add_argument(
+    "--repeats",
+    type=int,
+    default=3,
+    help="Number of timed runs, the fastest is reported"
+)
+
+
+def per_class_nms(
+            segs,
+            scores,
+            cls_idxs,
+            iou_threshold,
+            min_score,
+            sigma=0.5,
+            method=2,
+            nms='soft',
+            max_seg_num=2000000
+        ):
+    """Reference implementation: the original Python loop over classes."""
+    new_segs, new_scores, new_cls_idxs = [], [], []
+    for class_id in torch.unique(cls_idxs):
+        curr_indices = torch.where(cls_idxs == class_id)[0]
+        if nms == "soft":
+            sorted_segs, sorted_scores, sorted_cls_idxs = SoftNMSop.apply(
+                segs[curr_indices],
+                scores[curr_indices],
+                cls_idxs[curr_indices],
+                iou_threshold,
+                sigma,
+                min_score,
+                method
+            )
+        else:
+            sorted_segs, sorted_scores, sorted_cls_idxs = NMSop.apply(
+                segs[curr_indices],
+                scores[curr_indices],
+                cls_idxs[curr_indices],
+                iou_threshold,
+                min_score,
+                max_seg_num
+            )
+        new_segs.append(sorted_segs)
+        new_scores.append(sorted_scores)
+        new_cls_idxs.append(sorted_cls_idxs)
+
+    new_segs = torch.cat(new_segs)
+    new_scores = torch.cat(new_scores)
+    new_cls_idxs = torch.cat(new_cls_idxs)
+    _, idxs = new_scores.sort(descending=True)
+    return new_segs[idxs].numpy(), new_scores[idxs].numpy(), new_cls_idxs[idxs].numpy()
+
+
+def dense_seg_voting(nms_segs, all_segs, all_scores, iou_threshold):
+    """Reference implementation: the original dense N_nms x N_all voting."""
+    num_nms_segs, num_all_segs = nms_segs.shape[0], all_segs.shape[0]
+    ex_nms_segs = nms_segs[:, None].expand(num_nms_segs, num_all_segs, 2)
+    ex_all_segs = all_segs[None, :].expand(num_nms_segs, num_all_segs, 2)
+
+    left = torch.maximum(ex_nms_segs[:, :, 0], ex_all_segs[:, :, 0])
+    right = torch.minimum(ex_nms_segs[:, :, 1], ex_all_segs[:, :, 1])
+    inter = (right-left).clamp(min=0)
+
+    nms_seg_lens = ex_nms_segs[:, :, 1] - ex_nms_segs[:, :, 0]
+    all_seg_lens = ex_all_segs[:, :, 1] - ex_all_segs[:, :, 0]
+
+    iou = inter / (nms_seg_lens + all_seg_lens - inter)
+
+    seg_weights = (iou >= iou_threshold).to(all_scores.dtype) * all_scores[None, :] * iou
+    seg_weights /= torch.sum(seg_weights, dim=1, keepdim=True)
+    return seg_weights @ all_segs
+
+
+def same_voting(new, ref, all_segs, ulps=4):
+    """The sparse and dense voting round differently, as torch reduces the
+    weights in its own order. Their results should agree to within a few
+    float32 ulps of the largest segment boundary."""
+    atol = ulps * torch.finfo(torch.float32).eps * all_segs.abs().max().item()
+    return torch.allclose(new, ref, rtol=0.0, atol=atol, equal_nan=True)
+
+
+def make_proposals(num_segs, num_classes, video_length, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.uniform(0.0, video_length, num_segs)
+    lengths = rng.exponential(3.0, num_segs) + 0.1
+    segs = np.stack([centers - lengths / 2, centers + lengths / 2], axis=1)
+    scores = rng.uniform(0.0, 1.0, num_segs)
+    cls_idxs = rng.integers(0, num_classes, num_segs)
+    return (
+        torch.from_numpy(segs).float(),
+        torch.from_numpy(scores).float(),
+        torch.from_numpy(cls_idxs).long()
+    )
+
+
+def time_fn(fn, repeats):
+    best, out = float("inf"), None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, out
+
+
+def same_results(a, b):
+    # compare as sets of (class, start, end, score) since ties may be ordered differently
+    def as_rows(res):
+        segs, scores, cls_idxs = res
+        rows = np.concatenate([cls_idxs[:, None].astype(np.float64), segs, scores[:, None]], axis=1)
+        return rows[np.lexsort(rows.T[::-1])]
+    rows_a, rows_b = as_rows(a), as_rows(b)
+    return rows_a.shape == rows_b.shape and np.allclose(rows_a, rows_b, atol=1e-5)
+
+
+def run_kernel(segs, scores, nms, sweep, method=2):
+    """Single class NMS with either the sweep or the quadratic kernel."""
+    if nms == "soft":
+        dets = segs.new_empty((segs.size(0), 3))
+        inds = nms_1d_cpu.softnms(
+            segs, scores, dets, iou_threshold=0.1, sigma=0.25,
+            min_score=0.001, method=method, sweep=sweep
+        )
+        dets = dets[:len(inds)]
+        return dets[:, :2].numpy(), dets[:, -1].numpy(), inds.numpy()
+    inds = nms_1d_cpu.nms(segs, scores, iou_threshold=0.1, sweep=sweep)
+    return segs[inds].numpy(), scores[inds].numpy(), inds.numpy()
+
+
+def tied_scores(scores, levels=20):
+    """Scores quantised to a few levels, so many of them are exactly tied."""
+    return torch.round(scores * levels) / levels
+
+
+def kernels_match(segs, scores, nms, method=2):
+    """The sweep and quadratic kernels agree, with the scores as given and tied."""
+    return all(
+        same_results(run_kernel(segs, s, nms, False, method), run_kernel(segs, s, nms, True, method))
+        for s in (scores, tied_scores(scores))
+    )
+
+
+def scaling(args):
+    sizes = [1000, 10000, 100000, 1000000]
+    print(f"{'proposals':>10} {'quadratic (s)':>14} {'sweep (s)':>10} {'speedup':>8} {'match':>6}")
+    for num_segs in sizes:
+        # keep the proposal density of a one hour video at 1M proposals
+        video_length = 3600.0 * num_segs / 1000000
+        segs, scores, _ = make_proposals(num_segs, 1, video_length)
+        t_new, new = time_fn(lambda: run_kernel(segs, scores, args.nms, True), args.repeats)
+        if num_segs > args.max_quadratic:
+            print(f"{num_segs:>10} {'-':>14} {t_new:>10.4f} {'-':>8} {'-':>6}")
+            continue
+        t_ref, ref = time_fn(lambda: run_kernel(segs, scores, args.nms, False), args.repeats)
+        match = same_results(ref, new) and kernels_match(segs, tied_scores(scores), args.nms)
+        print(f"{num_segs:>10} {t_ref:>14.4f} {t_new:>10.4f} {t_ref / t_new:>7.1f}x {str(match):>6}")
+
+    # exact ties decide which segment is picked, and so the decay of the
+    # others, for every soft-NMS method
+    methods = [0, 1, 2] if args.nms == "soft" else [2]
+    for method in methods:
+        matches = 0
+        for seed in range(300):
+            segs, scores, _ = make_proposals(40, 1, 60.0, seed=seed)
+            matches += kernels_match(segs, tied_scores(scores, levels=4), args.nms, method)
+        variant = f"method {method}" if args.nms == "soft" else "hard NMS"
+        print(f"tied scores, 40 proposals, {variant}: {matches} / 300 match")
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def voting(args):
+    print(f"{'proposals':>10} {'kept':>6} {'dense (s)':>10} {'sparse (s)':>11} "
+          f"{'dense peak RSS (MB)':>20} {'sparse peak RSS (MB)':>21} {'max diff':>9} {'match':>6}")
+    for num_segs in args.num_segs:
+        segs, scores, cls_idxs = make_proposals(num_segs, 1, args.video_length)
+        nms_segs, _, _ = NMSop.apply(segs, scores, cls_idxs, 0.1, 0.001, 2000000)
+
+        # run sparse first as the peak RSS of the process only ever grows
+        base_rss = peak_rss_mb()
+        t_new, new = time_fn(lambda: seg_voting(nms_segs, segs, scores, 0.75), args.repeats)
+        new_rss = peak_rss_mb() - base_rss
+        t_ref, ref = time_fn(lambda: dense_seg_voting(nms_segs, segs, scores, 0.75), args.repeats)
+        ref_rss = peak_rss_mb() - base_rss
+        max_diff = (new - ref).abs().max().item()
+        print(f"{num_segs:>10} {nms_segs.shape[0]:>6} {t_ref:>10.4f} {t_new:>11.4f} "
+              f"{ref_rss:>20.1f} {new_rss:>21.1f} {max_diff:>9.2e} {str(same_voting(new, ref, segs)):>6}")
+
+
+def main(args):
+    if args.scaling:
+        return scaling(args)
+    if args.voting:
+        return voting(args)
+
+    kwargs = dict(iou_threshold=0.1, min_score=0.001, sigma=0.25, method=2, nms=args.nms)
+    print(f"{'proposals':>10} {'per-class (s)':>14} {'batched (s)':>12} {'speedup':>8} {'match':>6}")
+    for num_segs in args.num_segs:
+        segs, scores, cls_idxs = make_proposals(num_segs, args.num_classes, args.video_length)
+        t_ref, ref = time_fn(lambda: per_class_nms(segs, scores, cls_idxs, **kwargs), args.repeats)
+        t_new, new = time_fn(lambda: batched_nms(segs, scores, cls_idxs, **kwargs), args.repeats)
+        print(f"{num_segs:>10} {t_ref:>14.4f} {t_new:>12.4f} {t_ref / t_new:>7.1f}x {str(same_results(ref, new)):>6}")
+
+
+if __name__ == "__main__":
+    main(parser.parse_args())
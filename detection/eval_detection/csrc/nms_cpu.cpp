@@ -1,6 +1,13 @@
 #include <ATen/ATen.h>
 #include <torch/library.h>
 #include <torch/extension.h>
+#include <algorithm>
+#include <cmath>
+#include <memory>
+#include <limits>
+#include <numeric>
+#include <queue>
+#include <tuple>
 #include <vector>
 
 // 1D NMS (CPU) helper functions, ported from
@@ -16,26 +23,11 @@ using namespace at;
   CHECK_CPU(x);            \
   CHECK_CONTIGUOUS(x)
 
-Tensor nms_1d_cpu(Tensor segs, Tensor scores, float iou_threshold) {
-  if (segs.numel() == 0) {
-    return at::empty({0}, segs.options().dtype(at::kLong));
-  }
-  auto x1_t = segs.select(1, 0).contiguous();
-  auto x2_t = segs.select(1, 1).contiguous();
-
-  Tensor areas_t = x2_t - x1_t + 1e-6;
-
-  auto order_t = std::get<1>(scores.sort(0, /* descending=*/true));
-
-  auto nsegs = segs.size(0);
-  Tensor select_t = at::ones({nsegs}, segs.options().dtype(at::kBool));
-
-  auto select = select_t.data_ptr<bool>();
-  auto order = order_t.data_ptr<int64_t>();
-  auto x1 = x1_t.data_ptr<float>();
-  auto x2 = x2_t.data_ptr<float>();
-  auto areas = areas_t.data_ptr<float>();
-
+// Hard NMS over segments visited in `order` (descending score). Clears
+// select[_j] for every segment suppressed by a higher scoring one.
+static void nms_1d_kernel(const float* x1, const float* x2, const float* areas,
+                          const int64_t* order, bool* select, int64_t nsegs,
+                          float iou_threshold) {
   for (int64_t _i = 0; _i < nsegs; _i++) {
     if (select[_i] == false) continue;
     auto i = order[_i];
@@ -54,38 +46,15 @@ Tensor nms_1d_cpu(Tensor segs, Tensor scores, float iou_threshold) {
       if (ovr >= iou_threshold) select[_j] = false;
     }
   }
-  return order_t.masked_select(select_t);
 }
 
-Tensor nms_1d(Tensor segs, Tensor scores, float iou_threshold) {
-  CHECK_CPU_INPUT(segs);
-  CHECK_CPU_INPUT(scores);
-  return nms_1d_cpu(segs, scores, iou_threshold);
-
-}
-
-Tensor softnms_1d_cpu(Tensor segs, Tensor scores, Tensor dets, float iou_threshold,
-                      float sigma, float min_score, int method) {
-  if (segs.numel() == 0) {
-    return at::empty({0}, segs.options().dtype(at::kLong));
-  }
-
-  auto x1_t = segs.select(1, 0).contiguous();
-  auto x2_t = segs.select(1, 1).contiguous();
-  auto scores_t = scores.clone();
-
-  Tensor areas_t = x2_t - x1_t + 1e-6;
-
-  auto nsegs = segs.size(0);
-  auto x1 = x1_t.data_ptr<float>();
-  auto x2 = x2_t.data_ptr<float>();
-  auto sc = scores_t.data_ptr<float>();
-  auto areas = areas_t.data_ptr<float>();
-  auto de = dets.data_ptr<float>();
-
+// Soft NMS working in place on x1 / x2 / sc / areas / inds. Writes the
+// sorted (x1, x2, score) triplets into de and returns the number kept.
+static int64_t softnms_1d_kernel(float* x1, float* x2, float* sc, float* areas,
+                                 int64_t* inds, float* de, int64_t nsegs,
+                                 float iou_threshold, float sigma,
+                                 float min_score, int method) {
   int64_t pos = 0;
-  Tensor inds_t = at::arange(nsegs, segs.options().dtype(at::kLong));
-  auto inds = inds_t.data_ptr<int64_t>();
 
   for (int64_t i = 0; i < nsegs; i++) {
     auto max_score = sc[i];
@@ -156,27 +125,538 @@ Tensor softnms_1d_cpu(Tensor segs, Tensor scores, Tensor dets, float iou_thresho
       pos = pos + 1;
     }
   }
+  return nsegs;
+}
+
+// Segments sorted by start time with a max-end segment tree on top. Used to
+// enumerate the live segments overlapping a query interval in
+// O((k + 1) log n) instead of scanning every remaining segment.
+class SegmentSweep {
+ public:
+  SegmentSweep(const float* x1, const float* x2, int64_t nsegs)
+      : x1_(x1), nsegs_(nsegs), size_(1) {
+    while (size_ < nsegs) size_ <<= 1;
+    by_start_.resize(nsegs);
+    std::iota(by_start_.begin(), by_start_.end(), 0);
+    std::stable_sort(by_start_.begin(), by_start_.end(),
+                     [x1](int64_t a, int64_t b) { return x1[a] < x1[b]; });
+    rank_.resize(nsegs);
+    tree_.assign(2 * size_, -std::numeric_limits<float>::infinity());
+    for (int64_t r = 0; r < nsegs; r++) {
+      rank_[by_start_[r]] = r;
+      tree_[size_ + r] = x2[by_start_[r]];
+    }
+    for (int64_t node = size_ - 1; node > 0; node--) {
+      tree_[node] = std::max(tree_[2 * node], tree_[2 * node + 1]);
+    }
+  }
+
+  // mark segment i as no longer live
+  void remove(int64_t i) {
+    int64_t node = size_ + rank_[i];
+    tree_[node] = -std::numeric_limits<float>::infinity();
+    for (node >>= 1; node > 0; node >>= 1) {
+      tree_[node] = std::max(tree_[2 * node], tree_[2 * node + 1]);
+    }
+  }
+
+  // call fn(j) for every live segment j with x1[j] < qx2 and x2[j] > qx1
+  template <typename F>
+  void for_each_overlap(float qx1, float qx2, F&& fn) const {
+    // live segments starting before qx2 occupy ranks [0, hi)
+    int64_t lo = 0, hi = nsegs_;
+    while (lo < hi) {
+      int64_t mid = (lo + hi) / 2;
+      if (x1_[by_start_[mid]] < qx2) lo = mid + 1; else hi = mid;
+    }
+    if (hi > 0) visit(1, 0, size_, hi, qx1, fn);
+  }
+
+ private:
+  template <typename F>
+  void visit(int64_t node, int64_t node_lo, int64_t node_hi, int64_t hi,
+             float qx1, F& fn) const {
+    if (node_lo >= hi || !(tree_[node] > qx1)) return;
+    if (node >= size_) {
+      fn(by_start_[node - size_]);
+      return;
+    }
+    int64_t mid = (node_lo + node_hi) / 2;
+    visit(2 * node, node_lo, mid, hi, qx1, fn);
+    visit(2 * node + 1, mid, node_hi, hi, qx1, fn);
+  }
+
+  const float* x1_;
+  int64_t nsegs_;
+  int64_t size_;
+  std::vector<int64_t> by_start_;
+  std::vector<int64_t> rank_;
+  std::vector<float> tree_;
+};
+
+// Sort-and-sweep version of nms_1d_kernel. Only segments overlapping a kept
+// segment are visited, which gives the same selection whenever
+// iou_threshold > 0 (segments without overlap have an IoU of 0).
+static void nms_1d_sweep_kernel(const float* x1, const float* x2,
+                                const float* areas, const int64_t* order,
+                                bool* select, int64_t nsegs,
+                                float iou_threshold) {
+  std::vector<int64_t> order_pos(nsegs);
+  for (int64_t _i = 0; _i < nsegs; _i++) order_pos[order[_i]] = _i;
+
+  SegmentSweep sweep(x1, x2, nsegs);
+  for (int64_t _i = 0; _i < nsegs; _i++) {
+    if (select[_i] == false) continue;
+    auto i = order[_i];
+    auto ix1 = x1[i];
+    auto ix2 = x2[i];
+    auto iarea = areas[i];
+    sweep.remove(i);
+
+    sweep.for_each_overlap(ix1, ix2, [&](int64_t j) {
+      auto xx1 = std::max(ix1, x1[j]);
+      auto xx2 = std::min(ix2, x2[j]);
+
+      auto inter = std::max(0.f, xx2 - xx1);
+      auto ovr = inter / (iarea + areas[j] - inter);
+      if (ovr >= iou_threshold) {
+        select[order_pos[j]] = false;
+        sweep.remove(j);
+      }
+    });
+  }
+}
+
+// Sort-and-sweep version of softnms_1d_kernel. Only overlapping segments are
+// decayed, as every other weight is exactly 1. The segment with the highest
+// score is taken from a lazy max-heap: scores only ever decrease, so an
+// entry whose score went stale is re-pushed when it reaches the top rather
+// than on every decay. Exactly tied scores go to the segment the quadratic
+// kernel would pick, the first one in its array. That array is tracked as
+// positions: a pick swaps with the first unpicked slot, and a segment that
+// drops below min_score is replaced by the last one, visiting slots in
+// ascending order. Segments below min_score are dropped in the first pass,
+// as in the quadratic kernel. Valid for gaussian decay or iou_threshold > 0.
+static int64_t softnms_1d_sweep_kernel(float* x1, float* x2, float* sc,
+                                       float* areas, int64_t* inds, float* de,
+                                       int64_t nsegs, float iou_threshold,
+                                       float sigma, float min_score,
+                                       int method) {
+  std::vector<int64_t> src_inds(inds, inds + nsegs);
+  std::vector<bool> live(nsegs, true);
+  SegmentSweep sweep(x1, x2, nsegs);
+
+  // slot of every segment in the quadratic kernel's array and its inverse
+  std::vector<int64_t> pos(nsegs), at(nsegs);
+  std::iota(pos.begin(), pos.end(), 0);
+  std::iota(at.begin(), at.end(), 0);
+  int64_t nslots = nsegs;
+
+  // the first pick is always kept, even when it is below min_score
+  int64_t first = 0;
+  for (int64_t j = 1; j < nsegs; j++) {
+    if (sc[first] < sc[j]) first = j;
+  }
+
+  // highest score first, ties broken by the lowest slot. A heap entry is
+  // (score, slot, segment, version): the version of a segment is bumped
+  // whenever its slot changes, which outdates its earlier entries.
+  using Entry = std::tuple<float, int64_t, int64_t, int64_t>;
+  auto cmp = [](const Entry& a, const Entry& b) {
+    return std::get<0>(a) < std::get<0>(b) ||
+           (std::get<0>(a) == std::get<0>(b) && std::get<1>(a) > std::get<1>(b));
+  };
+  std::priority_queue<Entry, std::vector<Entry>, decltype(cmp)> heap(cmp);
+  std::vector<int64_t> version(nsegs, 0);
+  auto move_to = [&](int64_t j, int64_t slot) {
+    pos[j] = slot;
+    at[slot] = j;
+    heap.push(Entry(sc[j], slot, j, ++version[j]));
+  };
+
+  // segments dropped by the current pick, removed in slot order
+  std::vector<int64_t> dropped;
+  std::vector<bool> pending(nsegs, false);
+  for (int64_t j = 0; j < nsegs; j++) {
+    if (j != first && sc[j] < min_score) {
+      live[j] = false;
+      sweep.remove(j);
+      dropped.push_back(j);
+      pending[j] = true;
+    } else {
+      heap.push(Entry(sc[j], j, j, 0));
+    }
+  }
+
+  int64_t nkeep = 0;
+  while (!heap.empty()) {
+    auto top = heap.top();
+    heap.pop();
+    auto i = std::get<2>(top);
+    // skip dropped or outdated entries and re-queue the ones decayed since
+    // their push
+    if (!live[i] || std::get<3>(top) != version[i]) continue;
+    if (std::get<0>(top) != sc[i]) {
+      heap.push(Entry(sc[i], pos[i], i, version[i]));
+      continue;
+    }
+
+    auto ix1 = de[nkeep * 3 + 0] = x1[i];
+    auto ix2 = de[nkeep * 3 + 1] = x2[i];
+    de[nkeep * 3 + 2] = sc[i];
+    auto iarea = areas[i];
+    inds[nkeep] = src_inds[i];
+    live[i] = false;
+    sweep.remove(i);
+
+    // swap the pick with the first unpicked slot
+    auto displaced = at[nkeep];
+    if (displaced != i) move_to(displaced, pos[i]);
+    at[nkeep] = i;
+    nkeep++;
+
+    sweep.for_each_overlap(ix1, ix2, [&](int64_t j) {
+      auto xx1 = std::max(ix1, x1[j]);
+      auto xx2 = std::min(ix2, x2[j]);
+
+      auto inter = std::max(0.f, xx2 - xx1);
+      auto ovr = inter / (iarea + areas[j] - inter);
+
+      float weight = 1.;
+      if (method == 0) {
+        // vanilla nms
+        if (ovr >= iou_threshold) weight = 0;
+      } else if (method == 1) {
+        // linear
+        if (ovr >= iou_threshold) weight = 1 - ovr;
+      } else if (method == 2) {
+        // gaussian
+        weight = std::exp(-(ovr * ovr) / sigma);
+      }
+      sc[j] *= weight;
+
+      if (sc[j] < min_score) {
+        live[j] = false;
+        sweep.remove(j);
+        dropped.push_back(j);
+        pending[j] = true;
+      }
+    });
+
+    // each dropped slot takes the last segment, which is dropped in turn
+    // if it fell below min_score too
+    std::sort(dropped.begin(), dropped.end(),
+              [&pos](int64_t a, int64_t b) { return pos[a] < pos[b]; });
+    for (auto j : dropped) {
+      if (!pending[j]) continue;
+      auto slot = pos[j];
+      while (true) {
+        pending[j] = false;
+        auto last = at[--nslots];
+        if (last == j) break;
+        if (pending[last]) {
+          j = last;
+          pos[j] = slot;
+          continue;
+        }
+        move_to(last, slot);
+        break;
+      }
+    }
+    dropped.clear();
+  }
+  return nkeep;
+}
+
+static void nms_1d_select(const float* x1, const float* x2, const float* areas,
+                          const int64_t* order, bool* select, int64_t nsegs,
+                          float iou_threshold, bool sweep) {
+  if (sweep && iou_threshold > 0) {
+    nms_1d_sweep_kernel(x1, x2, areas, order, select, nsegs, iou_threshold);
+  } else {
+    nms_1d_kernel(x1, x2, areas, order, select, nsegs, iou_threshold);
+  }
+}
+
+static int64_t softnms_1d_select(float* x1, float* x2, float* sc, float* areas,
+                                 int64_t* inds, float* de, int64_t nsegs,
+                                 float iou_threshold, float sigma,
+                                 float min_score, int method, bool sweep) {
+  if (sweep && (method == 2 || iou_threshold > 0)) {
+    return softnms_1d_sweep_kernel(x1, x2, sc, areas, inds, de, nsegs,
+                                   iou_threshold, sigma, min_score, method);
+  }
+  return softnms_1d_kernel(x1, x2, sc, areas, inds, de, nsegs, iou_threshold,
+                           sigma, min_score, method);
+}
+
+Tensor nms_1d_cpu(Tensor segs, Tensor scores, float iou_threshold, bool sweep) {
+  if (segs.numel() == 0) {
+    return at::empty({0}, segs.options().dtype(at::kLong));
+  }
+  auto x1_t = segs.select(1, 0).contiguous();
+  auto x2_t = segs.select(1, 1).contiguous();
+
+  Tensor areas_t = x2_t - x1_t + 1e-6;
+
+  auto order_t = std::get<1>(scores.sort(0, /* descending=*/true));
+
+  auto nsegs = segs.size(0);
+  Tensor select_t = at::ones({nsegs}, segs.options().dtype(at::kBool));
+
+  nms_1d_select(
+    x1_t.data_ptr<float>(), x2_t.data_ptr<float>(), areas_t.data_ptr<float>(),
+    order_t.data_ptr<int64_t>(), select_t.data_ptr<bool>(), nsegs,
+    iou_threshold, sweep);
+  return order_t.masked_select(select_t);
+}
+
+Tensor nms_1d(Tensor segs, Tensor scores, float iou_threshold, bool sweep) {
+  CHECK_CPU_INPUT(segs);
+  CHECK_CPU_INPUT(scores);
+  return nms_1d_cpu(segs, scores, iou_threshold, sweep);
+
+}
+
+Tensor softnms_1d_cpu(Tensor segs, Tensor scores, Tensor dets, float iou_threshold,
+                      float sigma, float min_score, int method, bool sweep) {
+  if (segs.numel() == 0) {
+    return at::empty({0}, segs.options().dtype(at::kLong));
+  }
+
+  auto x1_t = segs.select(1, 0).contiguous();
+  auto x2_t = segs.select(1, 1).contiguous();
+  auto scores_t = scores.clone();
+
+  Tensor areas_t = x2_t - x1_t + 1e-6;
+
+  auto nsegs = segs.size(0);
+  Tensor inds_t = at::arange(nsegs, segs.options().dtype(at::kLong));
+
+  nsegs = softnms_1d_select(
+    x1_t.data_ptr<float>(), x2_t.data_ptr<float>(), scores_t.data_ptr<float>(),
+    areas_t.data_ptr<float>(), inds_t.data_ptr<int64_t>(),
+    dets.data_ptr<float>(), nsegs, iou_threshold, sigma, min_score, method,
+    sweep);
   return inds_t.slice(0, 0, nsegs);
 }
 
 Tensor softnms_1d(Tensor segs, Tensor scores, Tensor dets, float iou_threshold,
-                  float sigma, float min_score, int method) {
+                  float sigma, float min_score, int method, bool sweep) {
   // softnms is not implemented on GPU
   CHECK_CPU_INPUT(segs)
   CHECK_CPU_INPUT(scores)
   CHECK_CPU_INPUT(dets)
-  return softnms_1d_cpu(segs, scores, dets, iou_threshold, sigma, min_score, method);
+  return softnms_1d_cpu(segs, scores, dets, iou_threshold, sigma, min_score, method, sweep);
+}
+
+// Multi-class NMS in a single call. Segments are grouped by class id and
+// every class is suppressed independently (in parallel with OpenMP).
+// Returns {dets, inds}: dets is K x 3 (x1, x2, score) and inds holds the
+// positions of the kept segments in the input. Classes are emitted in
+// ascending id order, each sorted by descending (decayed) score.
+std::vector<Tensor> batched_nms_1d_cpu(Tensor segs, Tensor scores, Tensor cls_idxs,
+                                       float iou_threshold, float sigma,
+                                       float min_score, int method, bool soft,
+                                       int64_t max_num, bool sweep) {
+  auto nsegs = segs.size(0);
+  if (nsegs == 0) {
+    return {at::empty({0, 3}, segs.options()),
+            at::empty({0}, segs.options().dtype(at::kLong))};
+  }
+
+  auto x1_t = segs.select(1, 0).contiguous();
+  auto x2_t = segs.select(1, 1).contiguous();
+  auto cls_t = cls_idxs.to(at::kLong).contiguous();
+
+  auto x1 = x1_t.data_ptr<float>();
+  auto x2 = x2_t.data_ptr<float>();
+  auto sc = scores.data_ptr<float>();
+  auto cls = cls_t.data_ptr<int64_t>();
+
+  // group segments by class, keeping their original order within a class
+  std::vector<int64_t> perm(nsegs);
+  std::iota(perm.begin(), perm.end(), 0);
+  std::stable_sort(perm.begin(), perm.end(),
+                   [cls](int64_t a, int64_t b) { return cls[a] < cls[b]; });
+
+  std::vector<int64_t> bounds = {0};
+  for (int64_t k = 1; k < nsegs; k++) {
+    if (cls[perm[k]] != cls[perm[k - 1]]) bounds.push_back(k);
+  }
+  bounds.push_back(nsegs);
+  int64_t ngroups = bounds.size() - 1;
+
+  std::vector<std::vector<float>> group_dets(ngroups);
+  std::vector<std::vector<int64_t>> group_inds(ngroups);
+
+#pragma omp parallel for schedule(dynamic)
+  for (int64_t g = 0; g < ngroups; g++) {
+    std::vector<float> gx1, gx2, gsc, gareas;
+    std::vector<int64_t> ginds;
+    for (int64_t k = bounds[g]; k < bounds[g + 1]; k++) {
+      auto i = perm[k];
+      // vanilla nms does not change the score, so filter first
+      if (!soft && min_score > 0 && !(sc[i] > min_score)) continue;
+      gx1.push_back(x1[i]);
+      gx2.push_back(x2[i]);
+      gsc.push_back(sc[i]);
+      gareas.push_back(x2[i] - x1[i] + 1e-6f);
+      ginds.push_back(i);
+    }
+    int64_t n = ginds.size();
+    if (n == 0) continue;
+
+    auto& out_dets = group_dets[g];
+    auto& out_inds = group_inds[g];
+    if (soft) {
+      out_dets.resize(n * 3);
+      n = softnms_1d_select(gx1.data(), gx2.data(), gsc.data(), gareas.data(),
+                            ginds.data(), out_dets.data(), n, iou_threshold,
+                            sigma, min_score, method, sweep);
+      out_dets.resize(n * 3);
+      out_inds.assign(ginds.begin(), ginds.begin() + n);
+    } else {
+      std::vector<int64_t> order(n);
+      std::iota(order.begin(), order.end(), 0);
+      std::stable_sort(order.begin(), order.end(), [&gsc](int64_t a, int64_t b) {
+        return gsc[a] > gsc[b];
+      });
+      std::unique_ptr<bool[]> select(new bool[n]);
+      std::fill(select.get(), select.get() + n, true);
+      nms_1d_select(gx1.data(), gx2.data(), gareas.data(), order.data(),
+                    select.get(), n, iou_threshold, sweep);
+      for (int64_t _i = 0; _i < n; _i++) {
+        if (!select[_i]) continue;
+        if (max_num > 0 && (int64_t)out_inds.size() >= max_num) break;
+        auto i = order[_i];
+        out_dets.push_back(gx1[i]);
+        out_dets.push_back(gx2[i]);
+        out_dets.push_back(gsc[i]);
+        out_inds.push_back(ginds[i]);
+      }
+    }
+  }
+
+  // concatenate the per class results
+  int64_t total = 0;
+  std::vector<int64_t> offsets(ngroups);
+  for (int64_t g = 0; g < ngroups; g++) {
+    offsets[g] = total;
+    total += group_inds[g].size();
+  }
+  Tensor dets_t = at::empty({total, 3}, segs.options());
+  Tensor inds_t = at::empty({total}, segs.options().dtype(at::kLong));
+  auto de = dets_t.data_ptr<float>();
+  auto inds = inds_t.data_ptr<int64_t>();
+  for (int64_t g = 0; g < ngroups; g++) {
+    std::copy(group_dets[g].begin(), group_dets[g].end(), de + offsets[g] * 3);
+    std::copy(group_inds[g].begin(), group_inds[g].end(), inds + offsets[g]);
+  }
+  return {dets_t, inds_t};
+}
+
+std::vector<Tensor> batched_nms_1d(Tensor segs, Tensor scores, Tensor cls_idxs,
+                                   float iou_threshold, float sigma,
+                                   float min_score, int method, bool soft,
+                                   int64_t max_num, bool sweep) {
+  CHECK_CPU_INPUT(segs)
+  CHECK_CPU_INPUT(scores)
+  CHECK_CPU(cls_idxs);
+  return batched_nms_1d_cpu(segs, scores, cls_idxs, iou_threshold, sigma,
+                            min_score, method, soft, max_num, sweep);
+}
+
+// Bounding box voting: every kept segment is replaced by the average of the
+// segments overlapping it with IoU >= iou_threshold, weighted by score * IoU.
+// Neighbours are found with the sweep, so no N_nms x N_all matrix is built.
+Tensor seg_voting_1d_cpu(Tensor nms_segs, Tensor all_segs, Tensor all_scores,
+                         float iou_threshold) {
+  auto nnms = nms_segs.size(0);
+  auto nall = all_segs.size(0);
+  Tensor refined_t = at::empty({nnms, 2}, nms_segs.options());
+  if (nnms == 0) return refined_t;
+
+  auto x1_t = all_segs.select(1, 0).contiguous();
+  auto x2_t = all_segs.select(1, 1).contiguous();
+  auto x1 = x1_t.data_ptr<float>();
+  auto x2 = x2_t.data_ptr<float>();
+  auto sc = all_scores.data_ptr<float>();
+  auto segs = nms_segs.data_ptr<float>();
+  auto refined = refined_t.data_ptr<float>();
+
+  SegmentSweep sweep(x1, x2, nall);
+
+#pragma omp parallel for schedule(dynamic, 64)
+  for (int64_t i = 0; i < nnms; i++) {
+    auto ix1 = segs[i * 2 + 0];
+    auto ix2 = segs[i * 2 + 1];
+    auto ilen = ix2 - ix1;
+
+    std::vector<std::pair<int64_t, float>> neighbours;
+    sweep.for_each_overlap(ix1, ix2, [&](int64_t j) {
+      auto xx1 = std::max(ix1, x1[j]);
+      auto xx2 = std::min(ix2, x2[j]);
+
+      auto inter = std::max(0.f, xx2 - xx1);
+      auto ovr = inter / (ilen + (x2[j] - x1[j]) - inter);
+      if (ovr >= iou_threshold) {
+        neighbours.emplace_back(j, sc[j] * ovr);
+      }
+    });
+
+    // same float32 arithmetic as the dense formulation: the weights are
+    // summed and normalised, then averaged, all in segment order
+    std::sort(neighbours.begin(), neighbours.end());
+    float total = 0.f;
+    for (auto& n : neighbours) total += n.second;
+    float rx1 = 0.f, rx2 = 0.f;
+    for (auto& n : neighbours) {
+      auto weight = n.second / total;
+      rx1 += weight * x1[n.first];
+      rx2 += weight * x2[n.first];
+    }
+    if (neighbours.empty()) {
+      // matches the 0 / 0 of the dense formulation
+      rx1 = rx2 = std::numeric_limits<float>::quiet_NaN();
+    }
+    refined[i * 2 + 0] = rx1;
+    refined[i * 2 + 1] = rx2;
+  }
+  return refined_t;
+}
+
+Tensor seg_voting_1d(Tensor nms_segs, Tensor all_segs, Tensor all_scores,
+                     float iou_threshold) {
+  CHECK_CPU_INPUT(nms_segs)
+  CHECK_CPU_INPUT(all_segs)
+  CHECK_CPU_INPUT(all_scores)
+  return seg_voting_1d_cpu(nms_segs, all_segs, all_scores, iou_threshold);
 }
 
 // bind to torch interface
 PYBIND11_MODULE(TORCH_EXTENSION_NAME, m) {
   m.def(
     "nms", &nms_1d, "nms (CPU) ",
-    py::arg("segs"), py::arg("scores"), py::arg("iou_threshold")
+    py::arg("segs"), py::arg("scores"), py::arg("iou_threshold"),
+    py::arg("sweep") = true
   );
   m.def(
     "softnms", &softnms_1d, "softnms (CPU) ",
     py::arg("segs"), py::arg("scores"), py::arg("dets"), py::arg("iou_threshold"),
-    py::arg("sigma"), py::arg("min_score"), py::arg("method")
+    py::arg("sigma"), py::arg("min_score"), py::arg("method"),
+    py::arg("sweep") = true
+  );
+  m.def(
+    "batched_nms", &batched_nms_1d, "multi-class batched nms / softnms (CPU) ",
+    py::arg("segs"), py::arg("scores"), py::arg("cls_idxs"),
+    py::arg("iou_threshold"), py::arg("sigma"), py::arg("min_score"),
+    py::arg("method"), py::arg("soft"), py::arg("max_num"),
+    py::arg("sweep") = true
+  );
+  m.def(
+    "seg_voting", &seg_voting_1d, "segment voting (CPU) ",
+    py::arg("nms_segs"), py::arg("all_segs"), py::arg("all_scores"),
+    py::arg("iou_threshold")
   );
 }
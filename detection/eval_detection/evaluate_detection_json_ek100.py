@@ -1,12 +1,14 @@
 #!/usr/bin/env python3
 import argparse
 import logging
+import os
 import sys
+import tempfile
 from pathlib import Path
 import json
 import pandas as pd
 import numpy as np
-from joblib import Parallel, delayed
+from joblib import Parallel, cpu_count, delayed
 from typing import List
 from typing import Tuple
 from typing import Dict
@@ -85,15 +87,20 @@ class ANETdetection(object):
 
     def __init__(self, annotations, submission,
                  tiou_thresholds=np.linspace(0.1, 0.5, 5),
-                 label='action', num_nouns=300, filename=''):
+                 label='action', num_nouns=300, filename='',
+                 return_matches=False, prediction=None, n_jobs=None):
 
         self.tiou_thresholds = tiou_thresholds
         self.ap = None
+        self.return_matches = return_matches
+        self.n_jobs = n_jobs
         self.file_name = filename.replace(".json", "")
 
         # Import ground truth and predictions.
         self.ground_truth = load_gt_segmentations(annotations, label=label, num_nouns=num_nouns)
-        self.prediction = load_predicted_segmentations(submission, label=label, num_nouns=num_nouns)
+        if prediction is None:
+            prediction = load_predicted_segmentations(submission, label=label, num_nouns=num_nouns)
+        self.prediction = prediction
 
         # Remove predictions of non-existing labels
         self.prediction = self.prediction[self.prediction['label'].isin(self.ground_truth['label'].unique())]
@@ -104,37 +111,64 @@ class ANETdetection(object):
         self.ground_truth['label'] = self.ground_truth['label'].replace(self.activity_index)
         self.prediction['label'] = self.prediction['label'].replace(self.activity_index)
 
-    def _get_predictions_with_label(self, prediction_by_label, cidx):
-        """Get all predicitons of the given label. Return empty DataFrame if there
-        is no predcitions with the given label.
-        """
-        try:
-            res = prediction_by_label.get_group(cidx).reset_index(drop=True)
-            return res
-        except:
-            return pd.DataFrame()
-
     def wrapper_compute_average_precision(self, task):
         """Computes average precision for each class in the subset.
+        The ground truth and predictions are grouped by label once into
+        contiguous arrays, which are memory-mapped for the workers. Each job
+        only receives the index ranges of its label.
         """
-        ap = np.zeros((len(self.tiou_thresholds), len(self.activity_index)))
-
-        # Adaptation to query faster
-        ground_truth_by_label = self.ground_truth.groupby('label')
-        prediction_by_label = self.prediction.groupby('label')
-
-        results = Parallel(n_jobs=32)(
-            delayed(compute_average_precision_detection)(
-                ground_truth=ground_truth_by_label.get_group(cidx).reset_index(drop=True),
-                prediction=self._get_predictions_with_label(prediction_by_label, cidx),
-                tiou_thresholds=self.tiou_thresholds,
-            ) for label_name, cidx in self.activity_index.items())
-
-        self.correct_predictions = []
-        for i, cidx in enumerate(self.activity_index.values()):
-            ap[:, cidx], predictions = results[i]
-            self.correct_predictions.append(predictions)
-        self.correct_predictions = pd.concat(self.correct_predictions)
+        num_labels = len(self.activity_index)
+        ap = np.zeros((len(self.tiou_thresholds), num_labels))
+
+        gt_order, gt_bounds = group_by_label(self.ground_truth['label'].values, num_labels)
+        pred_order, pred_bounds = group_by_label(self.prediction['label'].values, num_labels)
+
+        # Integer video codes shared by ground truth and predictions, as
+        # object arrays of video ids cannot be memory-mapped.
+        num_gt = len(self.ground_truth)
+        _, video_codes = np.unique(
+                np.concatenate([self.ground_truth['video-id'].values, self.prediction['video-id'].values]),
+                return_inverse=True
+            )
+        arrays = {
+            'gt_videos': video_codes[:num_gt][gt_order],
+            'gt_segments': self.ground_truth[['t-start', 't-end']].values.astype(float)[gt_order],
+            'pred_videos': video_codes[num_gt:][pred_order],
+            'pred_segments': self.prediction[['t-start', 't-end']].values.astype(float)[pred_order],
+            'pred_scores': self.prediction['score'].values.astype(float)[pred_order],
+        }
+
+        n_jobs = resolve_n_jobs(self.n_jobs, num_labels)
+        with tempfile.TemporaryDirectory() as folder:
+            if n_jobs > 1:
+                arrays = share_arrays(arrays, folder)
+            results = Parallel(n_jobs=n_jobs)(
+                delayed(label_average_precision)(
+                    arrays,
+                    (gt_bounds[cidx], gt_bounds[cidx + 1]),
+                    (pred_bounds[cidx], pred_bounds[cidx + 1]),
+                    tiou_thresholds=self.tiou_thresholds,
+                    return_matches=self.return_matches,
+                ) for cidx in range(num_labels))
+
+        for cidx, (label_ap, _) in enumerate(results):
+            ap[:, cidx] = label_ap
+
+        self.correct_predictions = pd.DataFrame()
+        if self.return_matches:
+            pred_idx, matched_gt, matched_iou = (np.concatenate(m) for m in zip(*[r[1] for r in results]))
+            prediction = self.prediction.iloc[pred_order[pred_idx]]
+            narrations = self.ground_truth['narration'].values[gt_order]
+            self.correct_predictions = pd.DataFrame({
+                'video-id': prediction['video-id'].values,
+                'start': prediction['t-start'].values,
+                'end': prediction['t-end'].values,
+                'score': prediction['score'].values,
+                'verb': prediction['verb'].values,
+                'noun': prediction['noun'].values,
+                'matched_gt': [narrations[m] if m >= 0 else None for m in matched_gt],
+                'iou': matched_iou
+            })
 
         return ap
 
@@ -149,7 +183,7 @@ class ANETdetection(object):
 
         return self.mAP, self.average_mAP
 
-def compute_average_precision_detection(ground_truth, prediction, tiou_thresholds=np.linspace(0.1, 0.5, 5)):
+def compute_average_precision_detection(ground_truth, prediction, tiou_thresholds=np.linspace(0.1, 0.5, 5), return_matches=False):
     """Compute average precision (detection task) between ground truth and
     predictions data frames. If multiple predictions occurs for the same
     predicted segment, only the one with highest score is matches as
@@ -164,80 +198,121 @@ def compute_average_precision_detection(ground_truth, prediction, tiou_threshold
         Required fields: ['video-id, 't-start', 't-end', 'score']
     tiou_thresholds : 1darray, optional
         Temporal intersection over union threshold.
+    return_matches : bool, optional
+        Also build a data frame with the ground truth matched by each prediction.
     Outputs
     -------
     ap : float
         Average precision score.
     """
-    ap = np.zeros(len(tiou_thresholds))
     if prediction.empty:
+        return np.zeros(len(tiou_thresholds)), pd.DataFrame()
+
+    ap, sort_idx, matched_gt, matched_iou = average_precision_from_arrays(
+            ground_truth['video-id'].values,
+            ground_truth[['t-start', 't-end']].values,
+            prediction['video-id'].values,
+            prediction[['t-start', 't-end']].values,
+            prediction['score'].values,
+            tiou_thresholds=tiou_thresholds
+        )
+
+    if not return_matches:
         return ap, pd.DataFrame()
 
-    npos = float(len(ground_truth))
-    lock_gt = np.ones((len(tiou_thresholds), len(ground_truth))) * -1
+    prediction = prediction.iloc[sort_idx]
+    narrations = ground_truth['narration'].values
+    correct_preds = pd.DataFrame({
+            'video-id': prediction['video-id'].values,
+            'start': prediction['t-start'].values,
+            'end': prediction['t-end'].values,
+            'score': prediction['score'].values,
+            'verb': prediction['verb'].values,
+            'noun': prediction['noun'].values,
+            'matched_gt': [narrations[m] if m >= 0 else None for m in matched_gt],
+            'iou': matched_iou
+        })
+
+    return ap, correct_preds
+
+def average_precision_from_arrays(gt_videos, gt_segments, pred_videos, pred_segments, pred_scores, tiou_thresholds=np.linspace(0.1, 0.5, 5)):
+    """Array form of compute_average_precision_detection for the instances
+    of a single label. Video ids can be of any sortable type.
+    Outputs
+    -------
+    ap : 1darray
+        Average precision score at each tIoU threshold.
+    sort_idx : 1darray
+        Order of the predictions by decreasing score.
+    matched_gt : 1darray
+        Ground truth matched by each prediction in sort_idx order, -1 if none.
+    matched_iou : 1darray
+        tIoU of each prediction with its matched ground truth.
+    """
+    ap = np.zeros(len(tiou_thresholds))
+    num_preds = len(pred_scores)
+    npos = float(len(gt_videos))
 
     # Sort predictions by decreasing score order.
-    sort_idx = prediction['score'].values.argsort()[::-1]
-    prediction = prediction.loc[sort_idx].reset_index(drop=True)
+    sort_idx = np.asarray(pred_scores).argsort()[::-1]
+    pred_segments = np.asarray(pred_segments, dtype=float)[sort_idx]
+    pred_videos = np.asarray(pred_videos)[sort_idx]
+
+    matched_gt = np.full(num_preds, -1, dtype=np.int64)
+    matched_iou = np.zeros(num_preds)
+    if num_preds == 0:
+        return ap, sort_idx, matched_gt, matched_iou
+
+    # Pack the ground truth into contiguous per-video arrays, keeping the
+    # original order within each video.
+    gt_order = np.argsort(gt_videos, kind='stable')
+    gt_segments = np.asarray(gt_segments, dtype=float)[gt_order]
+    gt_videos = np.asarray(gt_videos)[gt_order]
+    video_ids, video_starts = np.unique(gt_videos, return_index=True)
+    video_ends = np.append(video_starts[1:], len(gt_videos))
+
+    # Locate the ground truth of each prediction's video.
+    video_idx = np.minimum(np.searchsorted(video_ids, pred_videos), len(video_ids) - 1)
+    has_gt = video_ids[video_idx] == pred_videos
+
+    thresholds = np.asarray(tiou_thresholds)[:, None]
+    lock_gt = np.full((len(tiou_thresholds), len(gt_videos)), -1, dtype=np.int64)
 
     # Initialize true positive and false positive vectors.
-    tp = np.zeros((len(tiou_thresholds), len(prediction)))
-    fp = np.zeros((len(tiou_thresholds), len(prediction)))
-
-    # Adaptation to query faster
-    ground_truth_gbvn = ground_truth.groupby('video-id')
+    tp = np.zeros((len(tiou_thresholds), num_preds))
+    fp = np.zeros((len(tiou_thresholds), num_preds))
 
-    correct_preds = []
     # Assigning true positive to truly grount truth instances.
-    for idx, this_pred in prediction.iterrows():
-        correct_preds.append(pd.Series({
-            'video-id': this_pred['video-id'],
-            'start': this_pred['t-start'],
-            'end': this_pred['t-end'],
-            'score': this_pred['score'],
-            'verb': this_pred['verb'],
-            'noun': this_pred['noun'],
-            'matched_gt': None,
-            'iou': 0.0
-        }))
-        try:
-            # Check if there is at least one ground truth in the video associated.
-            ground_truth_videoid = ground_truth_gbvn.get_group(this_pred['video-id'])
-        except Exception as e:
+    for idx in range(num_preds):
+        # Check if there is at least one ground truth in the video associated.
+        if not has_gt[idx]:
             fp[:, idx] = 1
             continue
 
-        this_gt = ground_truth_videoid.reset_index()
+        start = video_starts[video_idx[idx]]
+        end = video_ends[video_idx[idx]]
         # Get IOU with all GT actions
-        tiou_arr = segment_iou(this_pred[['t-start', 't-end']].values,
-                               this_gt[['t-start', 't-end']].values)
+        tiou_arr = segment_iou(pred_segments[idx], gt_segments[start:end])
 
         # We would like to retrieve the predictions with highest tiou score.
+        # For every threshold at once, the match is the first unlocked ground
+        # truth in that order that is not below the threshold.
         tiou_sorted_idx = tiou_arr.argsort()[::-1]
-        this_match = None
-        for tidx, tiou_thr in enumerate(tiou_thresholds):
-            for jdx in tiou_sorted_idx:
-                # Check if above threshold
-                if tiou_arr[jdx] < tiou_thr:
-                    fp[tidx, idx] = 1
-                    break
-
-                # Check if ground truth is matched to another prediction
-                if lock_gt[tidx, this_gt.loc[jdx]['index']] >= 0:
-                    continue
-
-                # Assign as true positive after the filters above.
-                tp[tidx, idx] = 1
-                lock_gt[tidx, this_gt.loc[jdx]['index']] = idx
-                this_match = this_gt.loc[jdx]['narration']
-                correct_preds[-1]['iou'] = tiou_arr[jdx]
-                break
-
-            # If prediction only matches already matched GT, set as false +ve
-            if fp[tidx, idx] == 0 and tp[tidx, idx] == 0:
-                fp[tidx, idx] = 1
-
-        correct_preds[-1]['matched_gt'] = this_match
+        candidates = ~(tiou_arr[tiou_sorted_idx][None, :] < thresholds)
+        candidates &= lock_gt[:, start + tiou_sorted_idx] < 0
+        is_tp = candidates.any(axis=1)
+
+        # If prediction only matches already matched GT, set as false +ve
+        fp[~is_tp, idx] = 1
+        if not is_tp.any():
+            continue
+
+        # Assign as true positive after the filters above.
+        jdx = tiou_sorted_idx[candidates.argmax(axis=1)[is_tp]]
+        tp[is_tp, idx] = 1
+        lock_gt[is_tp, start + jdx] = idx
+        matched_gt[idx] = gt_order[start + jdx[-1]]
+        matched_iou[idx] = tiou_arr[jdx[-1]]
 
     tp_cumsum = np.cumsum(tp, axis=1).astype(float)
     fp_cumsum = np.cumsum(fp, axis=1).astype(float)
@@ -248,7 +323,51 @@ def compute_average_precision_detection(ground_truth, prediction, tiou_threshold
     for tidx in range(len(tiou_thresholds)):
         ap[tidx] = interpolated_prec_rec(precision_cumsum[tidx,:], recall_cumsum[tidx,:])
 
-    return ap, pd.DataFrame(correct_preds)
+    return ap, sort_idx, matched_gt, matched_iou
+
+def label_average_precision(arrays, gt_range, pred_range, tiou_thresholds=np.linspace(0.1, 0.5, 5), return_matches=False):
+    """Average precision of one label, given the ranges of its ground truth
+    and predictions in the label-grouped arrays. With return_matches, the
+    matches are returned as indices into those arrays.
+    """
+    gt, pred = slice(*gt_range), slice(*pred_range)
+    ap, sort_idx, matched_gt, matched_iou = average_precision_from_arrays(
+            arrays['gt_videos'][gt],
+            arrays['gt_segments'][gt],
+            arrays['pred_videos'][pred],
+            arrays['pred_segments'][pred],
+            arrays['pred_scores'][pred],
+            tiou_thresholds=tiou_thresholds
+        )
+    if not return_matches:
+        return ap, None
+
+    matched_gt[matched_gt >= 0] += gt_range[0]
+    return ap, (sort_idx + pred_range[0], matched_gt, matched_iou)
+
+def group_by_label(labels, num_labels):
+    """Stable order grouping the instances by label, and the bounds of each
+    label's range in that order."""
+    order = np.argsort(labels, kind='stable')
+    bounds = np.searchsorted(labels[order], np.arange(num_labels + 1))
+    return order, bounds
+
+def share_arrays(arrays, folder):
+    """Saves the arrays to folder and maps them back read-only, so joblib
+    workers receive references to the files instead of copies."""
+    shared = {}
+    for name, array in arrays.items():
+        path = os.path.join(folder, f"{name}.npy")
+        np.save(path, np.ascontiguousarray(array))
+        shared[name] = np.load(path, mmap_mode='r')
+    return shared
+
+def resolve_n_jobs(n_jobs, num_tasks):
+    """All available cores if n_jobs is unset or not positive, capped by
+    the number of tasks."""
+    if n_jobs is None or n_jobs <= 0:
+        n_jobs = cpu_count()
+    return max(1, min(n_jobs, num_tasks))
 
 def segment_iou(target_segment, candidate_segments):
     """Compute the temporal intersection over union between a
@@ -312,6 +431,12 @@ parser.add_argument(
 )
 parser.add_argument("--verb-count", default=97, type=int)
 parser.add_argument("--noun-count", default=300, type=int)
+parser.add_argument(
+    "--n_jobs",
+    type=int,
+    default=None,
+    help="Number of parallel jobs computing per-class AP, all available cores if unset"
+)
 
 
 class ValidationException(Exception):
@@ -599,7 +724,7 @@ def main(args):
 
     for task in tasks:
         print(f"    Evaluating {task}...", end="")
-        maps, avg = ANETdetection(groundtruth_df, submission, num_nouns=args.noun_count, label=task, filename=args.path_to_json).evaluate(task)
+        maps, avg = ANETdetection(groundtruth_df, submission, num_nouns=args.noun_count, label=task, filename=args.path_to_json, n_jobs=args.n_jobs).evaluate(task)
         dump(display_metrics, maps, task)
         display_metrics[f"{task}_map_avg"] = avg*100
         print(f"        {task} evaluated")
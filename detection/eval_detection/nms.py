@@ -68,30 +68,16 @@ def seg_voting(nms_segs, all_segs, all_scores, iou_threshold, score_offset=1.5):
 
     # *_segs : N_i x 2, all_scores: N,
 
-    # computer overlap between nms and all segs
-    # construct the distance matrix of # N_nms x # N_all
-    num_nms_segs, num_all_segs = nms_segs.shape[0], all_segs.shape[0]
-    ex_nms_segs = nms_segs[:, None].expand(num_nms_segs, num_all_segs, 2)
-    ex_all_segs = all_segs[None, :].expand(num_nms_segs, num_all_segs, 2)
+    # only the segs overlapping each nms seg are visited (sort-and-sweep in
+    # the extension), instead of building the # N_nms x # N_all iou matrix
+    refined_segs = nms_1d_cpu.seg_voting(
+        nms_segs.float().contiguous().cpu(),
+        all_segs.float().contiguous().cpu(),
+        all_scores.float().contiguous().cpu(),
+        iou_threshold=float(iou_threshold)
+    )
 
-    # compute intersection
-    left = torch.maximum(ex_nms_segs[:, :, 0], ex_all_segs[:, :, 0])
-    right = torch.minimum(ex_nms_segs[:, :, 1], ex_all_segs[:, :, 1])
-    inter = (right-left).clamp(min=0)
-
-    # lens of all segments
-    nms_seg_lens = ex_nms_segs[:, :, 1] - ex_nms_segs[:, :, 0]
-    all_seg_lens = ex_all_segs[:, :, 1] - ex_all_segs[:, :, 0]
-
-    # iou
-    iou = inter / (nms_seg_lens + all_seg_lens - inter)
-
-    # get neighbors (# N_nms x # N_all) / weights
-    seg_weights = (iou >= iou_threshold).to(all_scores.dtype) * all_scores[None, :] * iou
-    seg_weights /= torch.sum(seg_weights, dim=1, keepdim=True)
-    refined_segs = seg_weights @ all_segs
-
-    return refined_segs
+    return refined_segs.to(all_segs)
 
 
 def batched_nms(
@@ -116,45 +102,28 @@ def batched_nms(
                 torch.zeros([0,], dtype=cls_idxs.dtype)
 
     # multiclass nms: apply nms on each class independently
-    new_segs, new_scores, new_cls_idxs = [], [], []
+    # (single call into the extension, parallel across classes)
     if multi_class:
-        for class_id in torch.unique(cls_idxs):
-            curr_indices = torch.where(cls_idxs == class_id)[0]
-            if nms == "soft":
-                sorted_segs, sorted_scores, sorted_cls_idxs = SoftNMSop.apply(
-                    segs[curr_indices],
-                    scores[curr_indices],
-                    cls_idxs[curr_indices],
-                    iou_threshold,
-                    sigma,
-                    min_score,
-                    method
-                )
-            else:
-                sorted_segs, sorted_scores, sorted_cls_idxs = NMSop.apply(
-                    segs[curr_indices],
-                    scores[curr_indices],
-                    cls_idxs[curr_indices],
-                    iou_threshold,
-                    min_score,
-                    max_seg_num
-                )
-
-            # fill in the class index
-            new_segs.append(sorted_segs)
-            new_scores.append(sorted_scores)
-            new_cls_idxs.append(sorted_cls_idxs)
-
-        # cat the results
-        new_segs = torch.cat(new_segs)
-        new_scores = torch.cat(new_scores)
-        new_cls_idxs = torch.cat(new_cls_idxs)
+        dets, inds = nms_1d_cpu.batched_nms(
+            segs.float().contiguous().cpu(),
+            scores.float().contiguous().cpu(),
+            cls_idxs.contiguous().cpu(),
+            iou_threshold=float(iou_threshold),
+            sigma=float(sigma),
+            min_score=float(min_score),
+            method=int(method),
+            soft=(nms == "soft"),
+            max_num=int(max_seg_num)
+        )
+        new_segs = dets[:, :2]
+        new_scores = dets[:, -1]
+        new_cls_idxs = cls_idxs[inds]
     else:
         # class agnostic
         if nms=="soft":
             new_segs, new_scores, new_cls_idxs = SoftNMSop.apply(
                 segs, scores, cls_idxs, iou_threshold,
-                sigma, min_score, 2, max_seg_num
+                sigma, min_score, method
             )
         else:
             new_segs, new_scores, new_cls_idxs = NMSop.apply(
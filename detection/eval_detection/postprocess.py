@@ -0,0 +1,390 @@
+import argparse
+import json
+import time
+
+import numpy as np
+import pandas as pd
+import torch
+
+import evaluate_detection_json
+import evaluate_detection_json_ek100
+
+from nms import batched_nms
+
+
+parser = argparse.ArgumentParser(
+    description="Post-process and evaluate TIM detection results in a single process",
+    formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+)
+parser.add_argument(
+    "path_to_preds",
+    help = "Path to the detection results from TIM"
+)
+parser.add_argument(
+    "path_to_gt",
+    help = "Path to the ground truth files"
+)
+parser.add_argument(
+    "--task",
+    type=str,
+    default=None,
+    choices=['verb', 'noun'],
+    help="EPIC-KITCHENS-100 task of the model, leave unset for Perception Test/EPIC-Sounds"
+)
+parser.add_argument(
+    "--is_audio",
+    action='store_true',
+    help="Flag to signify that the model being evaluated is for audio"
+)
+parser.add_argument(
+    "--score_threshold",
+    type=float,
+    default=None,
+    help = "Preprocessing score threshold (0.03 for EPIC-KITCHENS-100, 0.01 otherwise)"
+)
+parser.add_argument(
+    "--sigma",
+    type=float,
+    default=None,
+    help = "Sigma for soft NMS (0.25 for EPIC-KITCHENS-100, 0.1 otherwise)"
+)
+parser.add_argument(
+    "--num_nouns",
+    type=int,
+    default=300,
+    help="Number of noun classes in EPIC-KITCHENS-100"
+)
+parser.add_argument(
+    "--export_json",
+    type=str,
+    default="",
+    help="Optionally write the submission json to this path"
+)
+parser.add_argument(
+    "--n_jobs",
+    type=int,
+    default=None,
+    help="Number of parallel jobs computing per-class AP, all available cores if unset"
+)
+
+
+class Timings(object):
+    """Wall-clock time of each post-processing stage"""
+    def __init__(self):
+        self.stages = {}
+        self._start = time.perf_counter()
+
+    def lap(self, stage):
+        now = time.perf_counter()
+        self.stages[stage] = now - self._start
+        self._start = now
+
+    def __str__(self):
+        lines = [f"     {stage}: {secs:.2f}s" for stage, secs in self.stages.items()]
+        lines.append(f"     total: {sum(self.stages.values()):.2f}s")
+        return "\n".join(lines)
+
+
+def build_candidates(video_ids, proposals, scores, score_threshold, chunk_size=65536):
+    """Expand dense per-proposal class scores into one candidate per
+    (proposal, class) pair scoring above score_threshold. Proposals are
+    rounded to milliseconds and empty ones are discarded.
+    Returns video ids, segments (N x 2), scores and labels.
+    """
+    proposals = np.round(proposals, 3)
+    valid = (proposals[:, 1] - proposals[:, 0]) > 0.0
+
+    rows, labels = [], []
+    # chunk the thresholding to bound the size of the boolean mask
+    for start in range(0, scores.shape[0], chunk_size):
+        chunk = scores[start:start + chunk_size] > score_threshold
+        chunk &= valid[start:start + chunk_size, None]
+        chunk_rows, chunk_labels = np.nonzero(chunk)
+        rows.append(chunk_rows + start)
+        labels.append(chunk_labels)
+    rows = np.concatenate(rows)
+    labels = np.concatenate(labels)
+
+    return video_ids[rows], proposals[rows], scores[rows, labels], labels
+
+
+def fuse_two_stream(
+            verb_scores,
+            noun_scores,
+            verb_proposals,
+            noun_proposals,
+            top_k=1,
+            verb_alpha=0.65,
+            score_threshold=0.03,
+            num_nouns=300,
+            chunk_size=65536
+        ):
+    """Combines the top-k verbs and nouns of every proposal of a two-stream
+    model into action candidates. A verb-noun pair scores
+    verb^alpha * noun^(1 - alpha) and its segment is the average of the two
+    streams' proposals weighted by their scores. Pairs where either score or
+    the fused score is not above score_threshold are dropped, as are
+    segments that are empty after rounding to milliseconds.
+    Returns the proposal index, segments (N x 2), scores and action labels
+    (verb * num_nouns + noun) of the candidates.
+    """
+    verb_scores = torch.as_tensor(verb_scores)
+    noun_scores = torch.as_tensor(noun_scores)
+    verb_proposals = torch.as_tensor(verb_proposals)
+    noun_proposals = torch.as_tensor(noun_proposals)
+
+    rows, segs, scores, labels = [], [], [], []
+    for start in range(0, verb_scores.shape[0], chunk_size):
+        top_verbs, verb_idxs = verb_scores[start:start + chunk_size].topk(top_k, dim=1)
+        top_nouns, noun_idxs = noun_scores[start:start + chunk_size].topk(top_k, dim=1)
+
+        # every verb-noun pair of a proposal at once, P x k x k
+        verb_pair = top_verbs[:, :, None]
+        noun_pair = top_nouns[:, None, :]
+        pair_scores = verb_pair.pow(verb_alpha) * noun_pair.pow(1.0 - verb_alpha)
+        keep = (verb_pair > score_threshold) & (noun_pair > score_threshold) & (pair_scores > score_threshold)
+        chunk_rows, v, n = torch.nonzero(keep, as_tuple=True)
+
+        weight = top_verbs[chunk_rows, v] / (top_verbs[chunk_rows, v] + top_nouns[chunk_rows, n])
+        weight = weight[:, None]
+        chunk_segs = weight * verb_proposals[start + chunk_rows] + (1 - weight) * noun_proposals[start + chunk_rows]
+        chunk_segs = torch.round(chunk_segs, decimals=3)
+        valid = (chunk_segs[:, 1] - chunk_segs[:, 0]) > 0.0
+
+        rows.append(chunk_rows[valid] + start)
+        segs.append(chunk_segs[valid])
+        scores.append(pair_scores[chunk_rows, v, n][valid])
+        labels.append((verb_idxs[chunk_rows, v] * num_nouns + noun_idxs[chunk_rows, n])[valid])
+
+    if len(rows) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros((0, 2)), np.zeros(0), np.zeros(0, dtype=np.int64)
+
+    return (
+        torch.cat(rows).numpy(),
+        torch.cat(segs).numpy(),
+        torch.cat(scores).numpy(),
+        torch.cat(labels).numpy()
+    )
+
+
+def nms_per_video(
+            video_ids,
+            segs,
+            scores,
+            labels,
+            iou_threshold=0.1,
+            min_score=0.001,
+            sigma=0.4,
+            method=2,
+            nms='soft',
+            multi_class=True,
+            voting_thresh=0.75
+        ):
+    """Runs batched NMS on the candidates of every video. Detections are
+    returned grouped by video, each video sorted by descending score.
+    """
+    order = np.argsort(video_ids, kind='stable')
+    video_ids, segs, scores, labels = video_ids[order], segs[order], scores[order], labels[order]
+    vids, starts = np.unique(video_ids, return_index=True)
+    ends = np.append(starts[1:], len(video_ids))
+
+    out_vids, out_segs, out_scores, out_labels = [], [], [], []
+    for vid, start, end in zip(vids, starts, ends):
+        vid_segs, vid_scores, vid_labels = batched_nms(
+                        torch.from_numpy(segs[start:end]).float(),
+                        torch.from_numpy(scores[start:end]).float(),
+                        torch.from_numpy(labels[start:end]).long(),
+                        iou_threshold=iou_threshold,
+                        min_score=min_score,
+                        sigma=sigma,
+                        method=method,
+                        nms=nms,
+                        multi_class=multi_class,
+                        voting_thresh=voting_thresh
+                    )
+        out_vids.append(np.full(vid_segs.shape[0], vid, dtype=object))
+        out_segs.append(vid_segs)
+        out_scores.append(vid_scores)
+        out_labels.append(vid_labels)
+
+    if len(out_vids) == 0:
+        return np.zeros(0, dtype=object), np.zeros((0, 2)), np.zeros(0), np.zeros(0, dtype=np.int64)
+
+    return (
+        np.concatenate(out_vids),
+        np.round(np.concatenate(out_segs).astype(float), 3),
+        np.concatenate(out_scores).astype(float),
+        np.concatenate(out_labels).astype(np.int64)
+    )
+
+
+def to_prediction_frame(video_ids, segs, scores, labels, task=None, num_nouns=300):
+    """Lays the detections out as the evaluation scripts' load_predicted_segmentations.
+    Labels of the 'action' task are verb * num_nouns + noun."""
+    prediction = pd.DataFrame({
+        'video-id': video_ids,
+        't-start': segs[:, 0],
+        't-end': segs[:, 1],
+        'score': scores,
+    })
+    if task is None:
+        prediction['action'] = labels
+    elif task == 'action':
+        # two-stream labels are verb * num_nouns + noun
+        prediction['verb'], prediction['noun'] = np.divmod(labels, num_nouns)
+        prediction['action'] = labels
+    else:
+        # single task EPIC-KITCHENS-100 models predict the same class for verb and noun
+        prediction['verb'] = labels
+        prediction['noun'] = labels
+        prediction['action'] = labels * num_nouns + labels
+    prediction['label'] = labels
+    return prediction
+
+
+def evaluate(prediction, annotations, task=None, num_nouns=300, n_jobs=None):
+    """Computes mAP of in-memory predictions against the ground truth annotations"""
+    if task is None:
+        task = 'action'
+        detection = evaluate_detection_json.ANETdetection(annotations, None, prediction=prediction, n_jobs=n_jobs)
+        maps, avg = detection.evaluate()
+    else:
+        detection = evaluate_detection_json_ek100.ANETdetection(
+                annotations,
+                None,
+                label=task,
+                num_nouns=num_nouns,
+                prediction=prediction,
+                n_jobs=n_jobs
+            )
+        maps, avg = detection.evaluate(task)
+
+    metrics = {f"{task}_map_at_{i + 1:02d}": m * 100 for i, m in enumerate(maps)}
+    metrics[f"{task}_map_avg"] = avg * 100
+    return metrics
+
+
+def export_json(path, video_ids, segs, scores, labels, task=None, num_nouns=300):
+    """Writes the detections as a compact submission json. Labels of the
+    'action' task are verb * num_nouns + noun."""
+    results = {vid: [] for vid in np.unique(video_ids)}
+    for vid, seg, score, label in zip(video_ids, segs.tolist(), scores.tolist(), labels.tolist()):
+        if task is None:
+            entry = {"action": label, "score": score, "segment": seg}
+        elif task == 'action':
+            verb, noun = divmod(label, num_nouns)
+            entry = {"verb": verb, "noun": noun, "action": f"{verb},{noun}", "score": score, "segment": seg}
+        else:
+            entry = {"verb": label, "noun": label, "action": f"{label},{label}", "score": score, "segment": seg}
+        results[vid].append(entry)
+
+    submission = {
+            "version": "0.2",
+            "challenge": "action_detection",
+            "sls_pt": 2,
+            "sls_tl": 3,
+            "sls_td": 4,
+            "results": results
+        }
+    with open(path, 'w') as f:
+        json.dump(submission, f, separators=(',', ':'))
+
+
+def postprocess(
+            outs,
+            annotations,
+            task=None,
+            is_audio=False,
+            score_threshold=0.01,
+            sigma=0.1,
+            num_nouns=300,
+            export_path="",
+            n_jobs=None,
+            timings=None
+        ):
+    """Candidate building, batched NMS and evaluation on the in-memory
+    outputs of extract_feats. Returns the metrics and the detections.
+    """
+    timings = Timings() if timings is None else timings
+
+    # outputs of extract_feats with --online_nms are already suppressed
+    if "segments" in outs:
+        detections = (
+            np.asarray(outs['video_ids'], dtype=object),
+            outs['segments'],
+            outs['scores'],
+            outs['labels']
+        )
+        print(f"Total Entries: {len(detections[0])}")
+        return evaluate_detections(detections, annotations, task, num_nouns, export_path, n_jobs, timings)
+
+    proposals = outs['a_proposals'] if is_audio else outs['v_proposals']
+    scores = outs['audio'] if is_audio else outs['action']
+    video_ids, segs, cand_scores, labels = build_candidates(
+            np.asarray(outs['video_ids'], dtype=object),
+            proposals,
+            scores,
+            score_threshold
+        )
+    timings.lap("candidates")
+    print(f"Running NMS on {len(video_ids)} candidates from {proposals.shape[0]} proposals.")
+
+    detections = nms_per_video(
+            video_ids,
+            segs,
+            cand_scores,
+            labels,
+            iou_threshold=0.1,
+            min_score=0.001,
+            sigma=sigma,
+            method=2,
+            nms='soft'
+        )
+    timings.lap("nms")
+    print(f"Total Entries: {len(detections[0])}")
+
+    return evaluate_detections(detections, annotations, task, num_nouns, export_path, n_jobs, timings)
+
+
+def evaluate_detections(detections, annotations, task, num_nouns, export_path, n_jobs, timings):
+    if export_path:
+        export_json(export_path, *detections, task=task, num_nouns=num_nouns)
+        timings.lap("export")
+
+    prediction = to_prediction_frame(*detections, task=task, num_nouns=num_nouns)
+    metrics = evaluate(prediction, annotations, task=task, num_nouns=num_nouns, n_jobs=n_jobs)
+    timings.lap("evaluation")
+
+    return metrics, detections
+
+
+def main(args):
+    timings = Timings()
+    epic = args.task is not None
+    score_threshold = args.score_threshold if args.score_threshold is not None else (0.03 if epic else 0.01)
+    sigma = args.sigma if args.sigma is not None else (0.25 if epic else 0.1)
+
+    print("Loading Files")
+    outs = torch.load(args.path_to_preds, map_location='cpu')
+    annotations = pd.read_pickle(args.path_to_gt)
+    timings.lap("loading")
+
+    metrics, _ = postprocess(
+            outs,
+            annotations,
+            task=args.task,
+            is_audio=args.is_audio,
+            score_threshold=score_threshold,
+            sigma=sigma,
+            num_nouns=args.num_nouns,
+            export_path=args.export_json,
+            n_jobs=args.n_jobs,
+            timings=timings
+        )
+
+    evaluate_detection_json.print_metrics(metrics)
+    print("Timings:")
+    print(timings)
+
+if __name__ == "__main__":
+    main(parser.parse_args())
@@ -10,7 +10,8 @@ setup(
         CppExtension(
             name = 'nms_1d_cpu',
             sources = ['./csrc/nms_cpu.cpp'],
-            extra_compile_args=['-fopenmp']
+            extra_compile_args=['-fopenmp'],
+            extra_link_args=['-fopenmp']
         )
     ],
     cmdclass={
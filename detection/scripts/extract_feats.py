@@ -5,10 +5,13 @@ import os
 
 import time_interval_machine.datasets.loader as loader
 import time_interval_machine.utils.logging as logging
+import time_interval_machine.utils.profiler as profiler
+import time_interval_machine.utils.resources as resources
 import time_interval_machine.utils.distributed as du
 import time_interval_machine.utils.checkpoint as ch
+import time_interval_machine.utils.shards as shards
 
-from time_interval_machine.utils.meters import FeatureMeter
+from time_interval_machine.utils.meters import FeatureMeter, write_throughput_summary
 from time_interval_machine.models.build import build_model
 
 torch.set_printoptions(sci_mode=False)
@@ -29,10 +32,12 @@ def init_extract(args):
 
     # Setup logging format.
     logging.setup_logging(args.output_dir)
+    resources.start_sampler(args)
     is_master_proc = du.is_master_proc(args.num_gpus * args.num_shards)
 
     model, args = build_model(args)
     logger.info(model)
+    profiler.start_profiler(args, model, "extract")
 
     logger.info("Output dir : {}".format(args.output_dir))
 
@@ -53,10 +58,20 @@ def init_extract(args):
         else:
             mode = "test"
 
-    feat_loader = loader.create_loader(args, mode, args.data_modality, rng_generator, get_gt_segments=False)
-    feat_meter = FeatureMeter(args=args)
-
-    logger.info(f"Extracting features for {len(feat_loader.dataset.windows)} windows.")
+    feat_loader = loader.create_loader(args, mode, args.data_modality, rng_generator, get_gt_segments=False, contiguous=True)
+    stream_file = None
+    if args.online_nms:
+        # The detections of each video are appended to a per-rank stream as
+        # soon as it is finished, merge_shards recovers them after a crash
+        file_path = get_output_path(args)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        world_size = du.get_world_size()
+        stream_file = shards.stream_path(file_path, du.get_rank(), world_size)
+        if du.is_root_proc():
+            shards.write_manifest(file_path, world_size)
+    feat_meter = FeatureMeter(args=args, stream_file=stream_file)
+
+    logger.info(f"Extracting features for {len(feat_loader.dataset)} windows.")
     extract_features(
                 args=args,
                 feat_loader=feat_loader,
@@ -64,6 +79,18 @@ def init_extract(args):
                 is_master_proc=is_master_proc,
                 feat_meter=feat_meter
             )
+    if is_master_proc:
+        write_throughput_summary(args.output_dir, {"extract": feat_meter})
+
+def get_output_path(args):
+    features_dir = os.path.join(args.output_dir, 'features')
+    feats_file = ""
+    if "visual" in args.data_modality:
+        feats_file += str(args.video_val_action_pickle).split("/")[-1].replace(".pkl", "")
+    if "audio" in args.data_modality:
+        feats_file += str(args.audio_val_action_pickle).split("/")[-1].replace(".pkl", "")
+    suffix = "detections" if args.online_nms else "features"
+    return os.path.join(features_dir, f'{feats_file}_{suffix}.pth.tar')
 
 def extract_features(
             args,
@@ -96,45 +123,50 @@ def extract_features(
                             label_queries=False
                         )
 
-            # Gather metrics onto 1 GPU
-            if args.num_gpus > 1:
-                output = du.all_gather([output])
-
-                meta = du.all_gather_unaligned(meta)
-                key = list(meta[0].keys())[0]
-                metadata = {key: []}
-                for i in range(len(meta)):
-                    metadata[key].extend(meta[i][key])
-
+            profiler.range_push("feature_meter")
             feat_meter.update(
                     output[0],
                     output[1],
                     query_times,
                     metadata
                 )
+            profiler.range_pop()
 
             feat_meter.net_toc()
 
             # Measure elapsed time
             feat_meter.iter_toc()
+            feat_meter.update_throughput(
+                    [visual_input, audio_input],
+                    sum(q.numel() // 2 for q in query_times if q is not None)
+                )
             if i % args.print_freq == 0 and is_master_proc:
                 message = feat_meter.get_feat_message(i, len(feat_loader))
                 logger.info(message)
 
+            profiler.step("extract")
             feat_meter.iter_tic()
 
         data = feat_meter.finalize_metrics()
 
-        if is_master_proc:
-            features_dir = os.path.join(args.output_dir, 'features')
+        file_path = get_output_path(args)
+        features_dir = os.path.dirname(file_path)
+
+        world_size = du.get_world_size()
+        if world_size > 1:
+            # Each process saves its own windows, the root merges them once all are written
+            os.makedirs(features_dir, exist_ok=True)
+            shards.write_shard(data, file_path, du.get_rank(), world_size)
+            du.synchronize()
+            if du.is_root_proc():
+                manifest = shards.write_manifest(file_path, world_size)
+                shards.merge_shards(manifest)
+        elif is_master_proc:
             if not os.path.exists(features_dir):
                 os.makedirs(features_dir)
-            feats_file = ""
-            if "visual" in args.data_modality:
-                feats_file += str(args.video_val_action_pickle).split("/")[-1].replace(".pkl", "")
-            if "audio" in args.data_modality:
-                feats_file += str(args.audio_val_action_pickle).split("/")[-1].replace(".pkl", "")
-            file_path = os.path.join(features_dir, f'{feats_file}_features.pth.tar')
             logger.info(f"Saving to file path: {file_path}")
             torch.save(data, open(file_path, 'wb'), pickle_protocol=5)
-
+            if args.online_nms:
+                # The stream is only needed until the full output is saved
+                os.remove(shards.stream_path(file_path, 0, 1))
+                os.remove(shards.manifest_path(file_path))
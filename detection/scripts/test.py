@@ -7,13 +7,15 @@ import os
 
 import time_interval_machine.datasets.loader as loader
 import time_interval_machine.utils.logging as logging
+import time_interval_machine.utils.profiler as profiler
+import time_interval_machine.utils.resources as resources
 import time_interval_machine.utils.distributed as du
 import time_interval_machine.utils.checkpoint as ch
 
 from time_interval_machine.models.helpers.losses.sigmoid import sigmoid_focal_loss
 from time_interval_machine.models.helpers.losses.iou import ctr_diou_loss_1d
 from time_interval_machine.models.helpers.losses.loss import get_loss
-from time_interval_machine.utils.meters import InferenceMeter
+from time_interval_machine.utils.meters import InferenceMeter, write_throughput_summary
 from time_interval_machine.models.build import build_model
 
 logger = logging.get_logger(__name__)
@@ -34,6 +36,7 @@ def init_test(args):
 
     # Setup logging format.
     logging.setup_logging(args.output_dir)
+    resources.start_sampler(args)
     is_master_proc = du.is_master_proc(args.num_gpus * args.num_shards)
 
     logger.info("Output dir : {}".format(args.output_dir))
@@ -42,6 +45,7 @@ def init_test(args):
 
     model, args = build_model(args)
     logger.info(model)
+    profiler.start_profiler(args, model, "val")
 
     ch.load_checkpoint(args, model)
 
@@ -73,6 +77,8 @@ def init_test(args):
                     wandb_log=False,
                     iters=0
                 )
+    if is_master_proc:
+        write_throughput_summary(args.output_dir, {"val": val_meter})
 
 def validate(
             args,
@@ -117,7 +123,7 @@ def validate(
             loss = torch.FloatTensor([0.0]).cuda()
 
             # Compute output
-            output, offsets, labels, _, ious = model(
+            output, offsets, labels, query_times, ious = model(
                         [visual_input, audio_input],
                         "encoder",
                         times,
@@ -125,6 +131,7 @@ def validate(
                         label_queries=True
                     )
             val_meter.net_toc()
+            profiler.range_push("loss")
 
             # Visual side loss
             if ("visual" in args.data_modality):
@@ -253,8 +260,11 @@ def validate(
                 loss += (visual_loss + visual_reg_loss)
                 loss += args.lambda_audio * (audio_loss + audio_reg_loss)
 
+            profiler.range_pop()
+
             # Gather losses onto 1 GPU
             if args.num_gpus > 1:
+                profiler.range_push("distributed")
                 if "visual" in args.data_modality:
                     if args.include_verb_noun:
                         visual_loss_verb = du.all_reduce([visual_loss_verb])[0]
@@ -270,6 +280,7 @@ def validate(
                     audio_reg_loss = du.all_reduce([audio_reg_loss])[0]
 
                 loss = du.all_reduce([loss])[0]
+                profiler.range_pop()
 
             val_meter.update(
                     visual_loss.cpu().item(),
@@ -290,6 +301,10 @@ def validate(
 
             # Measure elapsed time
             val_meter.iter_toc()
+            val_meter.update_throughput(
+                    [visual_input, audio_input],
+                    sum(q.numel() // 2 for q in query_times if q is not None)
+                )
             if i % args.print_freq == 0 and is_master_proc:
                 message = val_meter.get_val_message(
                         epoch,
@@ -298,6 +313,7 @@ def validate(
                     )
                 logger.info(message)
 
+            profiler.step("val")
             val_meter.iter_tic()
 
         best_loss, is_best = val_meter.update_epoch(epoch)
@@ -8,13 +8,15 @@ import os
 import time_interval_machine.models.helpers.losses.drloc as drl
 import time_interval_machine.datasets.loader as loader
 import time_interval_machine.utils.logging as logging
+import time_interval_machine.utils.profiler as profiler
+import time_interval_machine.utils.resources as resources
 import time_interval_machine.utils.distributed as du
 import time_interval_machine.utils.checkpoint as ch
 import time_interval_machine.utils.misc as misc
 
 from time_interval_machine.models.helpers.losses.sigmoid import sigmoid_focal_loss
 from time_interval_machine.models.helpers.losses.iou import ctr_diou_loss_1d
-from time_interval_machine.utils.meters import TrainMeter, InferenceMeter
+from time_interval_machine.utils.meters import TrainMeter, InferenceMeter, write_throughput_summary
 from time_interval_machine.models.helpers.losses.loss import get_loss
 from time_interval_machine.utils.checkpoint import save_checkpoint
 from time_interval_machine.models.build import build_model
@@ -36,11 +38,13 @@ def init_train(args):
 
     # Setup logging format.
     logging.setup_logging(args.output_dir)
+    resources.start_sampler(args)
     logger.info(f"Random Seed is: {args.seed}")
     is_master_proc = du.is_master_proc(args.num_gpus * args.num_shards)
 
     model, args = build_model(args)
     logger.info(model)
+    profiler.start_profiler(args, model, "train")
 
     logger.info("Output dir : {}".format(args.output_dir))
 
@@ -156,6 +160,7 @@ def init_train(args):
                     is_best
                 )
     if is_master_proc:
+        write_throughput_summary(args.output_dir, {"train": train_meter, "val": val_meter})
         wandb.finish()
 
 def train_epoch(
@@ -209,7 +214,7 @@ def train_epoch(
             drloc_loss = torch.FloatTensor([0.0]).detach()
 
             # Compute output
-            output, offsets, labels, _, ious = model(
+            output, offsets, labels, query_times, ious = model(
                         [visual_input, audio_input],
                         "encoder",
                         times,
@@ -217,6 +222,7 @@ def train_epoch(
                         label_queries=True
                     )
             train_meter.net_toc()
+            profiler.range_push("loss")
 
 
             # Visual side loss
@@ -366,9 +372,11 @@ def train_epoch(
                                     )
                 loss += (args.lambda_drloc * drloc_loss)
 
+        profiler.range_pop()
         misc.check_nan_losses(loss)
 
         # Compute gradient and backprop
+        profiler.range_push("backward")
         optimizer.zero_grad()
         if args.enable_amp:
             scaler.scale(loss).backward()
@@ -385,9 +393,11 @@ def train_epoch(
 
         with warmup_scheduler.dampening():
             lr_scheduler.step()
+        profiler.range_pop()
 
         # Collect losses onto one GPU before update
         if args.num_gpus > 1:
+            profiler.range_push("distributed")
             if "visual" in args.data_modality:
                 if args.include_verb_noun:
                     visual_loss_verb = du.all_reduce([visual_loss_verb])[0]
@@ -406,9 +416,14 @@ def train_epoch(
                 drloc_loss = du.all_reduce([drloc_loss])[0]
 
             loss = du.all_reduce([loss])[0]
+            profiler.range_pop()
 
         # Measure elapsed time
         train_meter.iter_toc()
+        train_meter.update_throughput(
+                [visual_input, audio_input],
+                sum(q.numel() // 2 for q in query_times if q is not None)
+            )
 
         # Track losses
         train_meter.update(
@@ -448,6 +463,7 @@ def train_epoch(
                 wandb.log(log_dict)
             logger.info(message)
 
+        profiler.step("train")
         train_meter.iter_tic()
 
     # Log validation epoch stats
@@ -31,6 +31,18 @@ def load_feats(feat_info, data_path, mode):
 
     return feat_times, feats
 
+def nearest_index(sorted_times, t):
+    """Index of the time closest to t in a sorted 1D tensor, the earlier one
+    on ties as with argmin."""
+    i = int(torch.searchsorted(sorted_times, torch.tensor([t], dtype=sorted_times.dtype))[0])
+    if i == 0:
+        return 0
+    if i == sorted_times.size(0):
+        return i - 1
+    if (sorted_times[i - 1] - t).abs() <= (sorted_times[i] - t).abs():
+        return i - 1
+    return i
+
 class SlidingWindowDataset(data.Dataset):
     def __init__(self,
                 v_data_path,
@@ -52,7 +64,8 @@ class SlidingWindowDataset(data.Dataset):
                 dataset_name='epic',
                 get_gt_segments=True,
                 include_verb_noun=False,
-                verb_only=True
+                verb_only=True,
+                lazy_windows=False
             ):
 
         logger.info("Constructing dataset for split : {}".format(mode))
@@ -82,6 +95,8 @@ class SlidingWindowDataset(data.Dataset):
         self.get_gt_segments = get_gt_segments
         self.include_verb_noun = include_verb_noun
         self.verb_only = verb_only
+        # Windows without ground truth are only arithmetic in the stride
+        self.lazy_windows = lazy_windows and not get_gt_segments
 
 
         logger.info("Caching Features")
@@ -101,7 +116,7 @@ class SlidingWindowDataset(data.Dataset):
 
         self.max_window_actions = self.max_visual_actions + self.max_audio_actions
         out_string = (f'{mode.capitalize()} Sliding Window dataset constructed. '\
-                    f'Number of {self.window_size} Second Windows: {len(self.windows)}')
+                    f'Number of {self.window_size} Second Windows: {len(self)}')
         if get_gt_segments:
             out_string += (f'\n\t\t\t\t\tTotal Actions: {self.num_actions}\n' \
                         f'\t\t\t\t\tMax actions in window: {self.max_window_actions}\n' \
@@ -206,8 +221,10 @@ class SlidingWindowDataset(data.Dataset):
         self.windows = []
         windows_path = self.create_windows_path(v_labels_pkl, a_labels_pkl)
 
+        if self.lazy_windows:
+            self.init_lazy_windows(video_info)
         # Check if windows are precomputed
-        if not os.path.exists(windows_path):
+        elif not os.path.exists(windows_path):
             for vid, data in video_info.iterrows():
                 video_duration = math.ceil(data['duration'])
                 vid_feat_times = self.v_feat_times[vid] if 'visual' in self.model_modality else self.a_feat_times[vid]
@@ -302,6 +319,46 @@ class SlidingWindowDataset(data.Dataset):
         self.min_query = round(self.min_query, 3)
         self.max_query = round(self.max_query, 3)
 
+    def init_lazy_windows(self, video_info):
+        """Only stores the number of windows of each video, the windows and
+        their features are found in __getitem__."""
+        feat_times = self.v_feat_times if 'visual' in self.model_modality else self.a_feat_times
+
+        self.lazy_videos = video_info.index.tolist()
+        self.lazy_durations = [math.ceil(d) for d in video_info['duration']]
+        num_windows = [
+                max(math.ceil((d - self.window_size) / self.window_stride) + 1, 1)
+                for d in self.lazy_durations
+            ]
+        self.lazy_offsets = np.concatenate([[0], np.cumsum(num_windows)]).astype(np.int64)
+
+        # Contiguous start and stop times for binary searching the features
+        self.lazy_feat_times = {
+                vid: (feat_times[vid][:, 0].contiguous(), feat_times[vid][:, 1].contiguous())
+                for vid in self.lazy_videos
+            }
+
+    def get_lazy_window(self, index):
+        v = int(np.searchsorted(self.lazy_offsets, index, side='right')) - 1
+        vid = self.lazy_videos[v]
+        win_start = self.window_stride * int(index - self.lazy_offsets[v])
+        win_stop = min(self.lazy_durations[v], win_start + self.window_size)
+
+        feat_starts, feat_stops = self.lazy_feat_times[vid]
+        input_start = nearest_index(feat_starts, max(0.0, win_start))
+        input_end = nearest_index(feat_stops, win_stop)
+
+        return {
+            'video_id': vid,
+            'start_sec': win_start,
+            'stop_sec': win_stop,
+            'feat_indices': self.pad_feat_indices(input_start, input_end, feat_starts.size(0)),
+            'v_gt_segments': torch.empty((0, 2)).float(),
+            'a_gt_segments': torch.empty((0, 2)).float(),
+            'v_labels': torch.empty((0, 4)).long(),
+            'a_labels': torch.empty((0, 4)).long()
+        }
+
     def create_windows_path(self, v_labels_pkl, a_labels_pkl):
         windows_path = "precomputed_windows/"
 
@@ -322,7 +379,7 @@ class SlidingWindowDataset(data.Dataset):
 
 
     def __getitem__(self, index):
-        window = self.windows[index]
+        window = self.get_lazy_window(index) if self.lazy_windows else self.windows[index]
         video_id = window['video_id']
         feat_indices = window['feat_indices']
         v_gt_segments = torch.round(window['v_gt_segments'] - window['start_sec'], decimals=3)
@@ -399,16 +456,28 @@ class SlidingWindowDataset(data.Dataset):
         return v_data, a_data, times, label, metadata
 
     def __len__(self):
+        if self.lazy_windows:
+            return int(self.lazy_offsets[-1])
         return len(self.windows)
 
+    def video_boundaries(self):
+        """Index of the first window of each video"""
+        if self.lazy_windows:
+            return self.lazy_offsets[:-1]
+        video_ids = [window['video_id'] for window in self.windows]
+        return [0] + [i for i in range(1, len(video_ids)) if video_ids[i] != video_ids[i - 1]]
+
     def get_window_features(self, feat_times, window_start, window_stop):
         # Get features to represent windowed input
         start_time = max(0.0, window_start)
         input_start = np.absolute(feat_times[:, 0] - start_time).argmin()
         input_end = np.absolute(feat_times[:, 1] - window_stop).argmin()
 
+        return self.pad_feat_indices(input_start, input_end, len(feat_times))
+
+    def pad_feat_indices(self, input_start, input_end, num_times):
         feat_indices = list(range(input_start, input_end, self.feat_stride))
-        feat_indices = np.clip(feat_indices, 0, len(feat_times) - 1)
+        feat_indices = np.clip(feat_indices, 0, num_times - 1)
         feat_indices = torch.from_numpy(feat_indices).long()
 
         num_pad = self.num_feats - feat_indices.size(0)
@@ -33,7 +33,10 @@ def build_model(args, gpu_id=None):
                 data_modality=args.data_modality,
                 num_feats=args.num_feats,
                 include_verb_noun=args.include_verb_noun,
-                label_smoothing=args.label_smoothing
+                label_smoothing=args.label_smoothing,
+                cascade_top_n=args.cascade_top_n,
+                cascade_layers=args.cascade_layers,
+                query_budgets=args.query_budgets
             )
 
     if args.num_gpus:
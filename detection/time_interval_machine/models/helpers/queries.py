@@ -0,0 +1,61 @@
+import torch
+
+from torch import nn
+
+class QueryPyramid(nn.Module):
+    """Multi-scale time interval queries over a normalised window.
+
+    Each scale holds queries with 50% overlap, starting at query_size and
+    doubling until the queries cover the window. The pyramid is built once
+    into a non-persistent buffer, so it moves with the model and is not
+    saved in checkpoints.
+
+    Args:
+        query_size (float): Length of the queries at the finest scale.
+        budgets (list, optional): Number of queries to keep at each scale,
+            finest first. -1 keeps the whole scale, 0 skips it and k > 0 keeps
+            k evenly spaced queries. Scales without a budget are kept whole.
+    """
+    def __init__(self, query_size, budgets=None):
+        super(QueryPyramid, self).__init__()
+
+        scales = []
+        while query_size < 1.0:
+            start_times = torch.arange(0.0, 1.0, step=query_size / 2)
+            end_times = start_times + query_size
+            layer_times = torch.stack([start_times, end_times], dim=-1)
+            layer_times = torch.round(layer_times, decimals=3)
+            scales.append(layer_times)
+            query_size *= 2
+
+        self.num_scales = len(scales)
+        self.num_pyramid_queries = sum(layer_times.size(0) for layer_times in scales)
+
+        budgets = list(budgets) if budgets is not None else []
+        budgets += [-1] * (self.num_scales - len(budgets))
+
+        queries = []
+        for layer_times, budget in zip(scales, budgets):
+            if budget < 0 or budget >= layer_times.size(0):
+                queries.append(layer_times)
+            elif budget > 0:
+                keep = torch.linspace(0, layer_times.size(0) - 1, budget).round().long()
+                queries.append(layer_times[keep])
+        self.scale_sizes = [layer_times.size(0) for layer_times in queries]
+
+        assert len(queries) > 0, "Query budgets skip every scale of the pyramid"
+        self.register_buffer("queries", torch.concat(queries, dim=0).unsqueeze(0), persistent=False)
+
+    @property
+    def num_queries(self):
+        return self.queries.size(1)
+
+    def expand(self, batch_size):
+        """All queries for every window in the batch, [B, N_q, 2] view"""
+        return self.queries.expand(batch_size, -1, -1)
+
+    def sample(self, batch_size, num_queries):
+        """The same random subset of num_queries queries for every window in
+        the batch, [B, num_queries, 2]"""
+        inds = torch.randperm(self.num_queries)[:num_queries]
+        return self.queries[:, inds.to(self.queries.device)].expand(batch_size, -1, -1)
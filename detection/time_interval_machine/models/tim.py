@@ -8,6 +8,7 @@ from torch import nn
 import time_interval_machine.models.helpers.head as head
 import time_interval_machine.utils.logging as logging
 
+from time_interval_machine.models.helpers.queries import QueryPyramid
 from time_interval_machine.models.helpers.encodings import AudioVisualFeatureEncoding, VisualFeatureEncoding, AudioFeatureEncoding
 from time_interval_machine.models.helpers.transformers import TransformerEncoder, TransformerEncoderLayer
 
@@ -31,7 +32,10 @@ class TIM(nn.Module):
                 num_feats=50,
                 include_verb_noun=True,
                 iou_threshold=0.25,
-                label_smoothing=0.9
+                label_smoothing=0.9,
+                cascade_top_n=0,
+                cascade_layers=2,
+                query_budgets=None
             ):
         super(TIM, self).__init__()
 
@@ -54,6 +58,9 @@ class TIM(nn.Module):
         self.include_verb_noun = include_verb_noun
         self.iou_threshold = iou_threshold
         self.label_smoothing = label_smoothing
+        self.cascade_top_n = cascade_top_n
+        self.cascade_layers = min(cascade_layers, num_layers)
+        self.query_budgets = query_budgets
 
         logger.info("Building {} Transformer with {}-D, {} heads, and {} layers.".format(
                                                              self.input_modality,
@@ -137,22 +144,10 @@ class TIM(nn.Module):
                                 nn.Linear(self.d_model, 1)
                             )
 
-        self.train_pool = self.generate_queries(query_size=0.005)
-        self.inference_queries = self.generate_queries(query_size=0.01)
-        self.num_queries = self.inference_queries.shape[1]
-
-    def generate_queries(self, query_size):
-        queries = []
-        while query_size < 1.0:
-            start_times = torch.arange(0.0, 1.0, step=query_size / 2)
-            end_times = start_times + query_size
-            layer_times = torch.stack([start_times, end_times], dim=-1)
-            layer_times = torch.round(layer_times, decimals=3)
-            queries.append(layer_times)
-            query_size *= 2
-
-        queries = torch.concat(queries, dim=0).unsqueeze(0)
-        return queries
+        self.train_pool = QueryPyramid(query_size=0.005)
+        self.inference_queries = QueryPyramid(query_size=0.01, budgets=self.query_budgets)
+        # Training samples as many queries as the full inference pyramid
+        self.num_queries = self.inference_queries.num_pyramid_queries
     
     def assign_positive_labels(self, modality, query_labels):
         if modality == "visual":
@@ -278,13 +273,9 @@ class TIM(nn.Module):
         all_times = feature_times
 
         if "visual" in self.data_modality:
-            v_queries = torch.randperm(self.train_pool.shape[1])[:self.num_queries]
-            v_queries = self.train_pool[:, v_queries.long()]
-
-            v_queries = v_queries.repeat(all_times.shape[0], 1, 1)
+            v_queries = self.train_pool.sample(all_times.shape[0], self.num_queries)
             num_v_queries = v_queries.shape[1]
 
-            v_queries = v_queries.to(device=feature_times.device)
             v_offsets, v_labels, v_query_ious = self.label_queries(
                                             v_queries,
                                             target,
@@ -295,13 +286,9 @@ class TIM(nn.Module):
             v_queries = torch.flatten(v_queries, start_dim=0, end_dim=1)
 
         if "audio" in self.data_modality:
-            a_queries = torch.randperm(self.train_pool.shape[1])[:self.num_queries]
-            a_queries = self.train_pool[:, a_queries.long()]
-
-            a_queries = a_queries.repeat(all_times.shape[0], 1, 1)
+            a_queries = self.train_pool.sample(all_times.shape[0], self.num_queries)
             num_a_queries = a_queries.shape[1]
 
-            a_queries = a_queries.to(device=feature_times.device)
             a_offsets, a_labels, a_query_ious = self.label_queries(
                                             a_queries,
                                             target,
@@ -316,15 +303,7 @@ class TIM(nn.Module):
         # Project features to lower dim and include time and modality encodings.
         x = self.feature_encoding(inputs, time_encodings, num_v_queries, num_a_queries)
 
-        # Mask queries from each other to remove dependence on queries for performance
-        mask = torch.ones(size=(x.size(0), x.size(0)), device=x.device)
-        mask[:, :self.num_feats] = 0.
-        mask = mask.fill_diagonal_(0.)
-
-        mask = mask.unsqueeze(0)
-        mask = mask.repeat_interleave(self.nhead*x.size(1), dim=0).bool()
-
-        x, _ = self.backbone(x, src_mask=mask)
+        x, _ = self.backbone(x, src_mask=self.get_query_masks(x))
 
         # Output Shapes: # [B, N_queries, C]
         cls_scores = self.cls_head(x, num_v_queries, num_a_queries)
@@ -345,10 +324,9 @@ class TIM(nn.Module):
         all_times = feature_times
 
         if "visual" in self.data_modality:
-            v_queries = self.inference_queries.repeat(all_times.shape[0], 1, 1)
+            v_queries = self.inference_queries.expand(all_times.shape[0])
             num_v_queries = v_queries.shape[1]
 
-            v_queries = v_queries.to(device=feature_times.device)
             if label_queries:
                 v_offsets, v_labels, v_query_ious = self.label_queries(
                                                 v_queries,
@@ -360,11 +338,9 @@ class TIM(nn.Module):
             v_queries = torch.flatten(v_queries, start_dim=0, end_dim=1)
 
         if "audio" in self.data_modality:
-            a_queries = torch.randperm(self.inference_queries.shape[1])[:self.num_queries]
-            a_queries = self.inference_queries.repeat(all_times.shape[0], 1, 1)
+            a_queries = self.inference_queries.expand(all_times.shape[0])
             num_a_queries = a_queries.shape[1]
 
-            a_queries = a_queries.to(device=feature_times.device)
             if label_queries:
                 a_offsets, a_labels, a_query_ious = self.label_queries(
                                                 a_queries,
@@ -380,14 +356,14 @@ class TIM(nn.Module):
         # Project features to lower dim and include time and modality encodings.
         x = self.feature_encoding(inputs, time_encodings, num_v_queries, num_a_queries)
 
-        # Mask queries from each other to remove dependence on queries for performance
-        masks = torch.ones(size=(x.size(0), x.size(0)), device=x.device)
-        masks[:, :self.num_feats] = 0.
-        masks = masks.fill_diagonal_(0.)
-
-        masks = masks.unsqueeze(0)
-        masks = masks.repeat_interleave(self.nhead*x.size(1), dim=0).bool()
-        x, _ = self.backbone(x, src_mask=masks)
+        if self.cascade_top_n > 0 and not label_queries:
+            x, (v_queries, a_queries), (num_v_queries, num_a_queries) = self.forward_cascade(
+                                                                    x,
+                                                                    (v_queries, a_queries),
+                                                                    (num_v_queries, num_a_queries)
+                                                                )
+        else:
+            x, _ = self.backbone(x, src_mask=self.get_query_masks(x))
 
         # Output Shapes: # [B, N_queries, C]
         cls_scores = self.cls_head(x, num_v_queries, num_a_queries)
@@ -399,6 +375,71 @@ class TIM(nn.Module):
                 (v_queries, a_queries), \
                 (v_query_ious, a_query_ious)
 
+    def get_query_masks(self, x):
+        # Mask queries from each other to remove dependence on queries for performance
+        masks = torch.ones(size=(x.size(0), x.size(0)), device=x.device)
+        masks[:, :self.num_feats] = 0.
+        masks = masks.fill_diagonal_(0.)
+
+        masks = masks.unsqueeze(0)
+        masks = masks.repeat_interleave(self.nhead*x.size(1), dim=0).bool()
+        return masks
+
+    def forward_cascade(self, x, queries, num_queries):
+        """Two stage inference. All queries go through the first
+        cascade_layers layers and are scored for actionness by the max class
+        logit of cls_head. Only the top cascade_top_n queries of each modality
+        per window go through the remaining layers and the heads.
+
+        Queries only attend to the features and themselves, so the kept
+        queries get the same outputs as without the cascade.
+
+        Args:
+            x (torch.Tensor[S, B, C]): Encoded features followed by the visual
+            then audio queries
+            queries (tuple): Flattened visual and audio query times [B*Nq, 2]
+            num_queries (tuple): Number of visual and audio queries per window
+        Returns:
+            x (torch.Tensor[B, S', C]): Backbone output for the features and
+            kept queries
+            queries (tuple): Flattened times of the kept queries [B*N, 2]
+            num_queries (tuple): Number of kept queries per window
+        """
+        layers = self.backbone.layers
+        masks = self.get_query_masks(x)
+        for layer in layers[:self.cascade_layers]:
+            x, _ = layer(x, src_mask=masks)
+
+        x = x.transpose(0, 1)
+        batch_size = x.size(0)
+        cls_scores = self.cls_head(x, *num_queries)
+        tokens = [x[:, :self.num_feats]]
+        offset = self.num_feats
+        kept_queries, kept_num_queries = [], []
+        for times, num, scores in zip(queries, num_queries, (cls_scores[2], cls_scores[3])):
+            if num == 0:
+                kept_queries.append(times)
+                kept_num_queries.append(0)
+                continue
+
+            actionness = scores.view(batch_size, num, -1).max(dim=-1)[0]
+            keep = actionness.topk(min(self.cascade_top_n, num), dim=1)[1].sort(dim=1)[0]
+
+            query_tokens = x[:, offset:offset+num]
+            tokens.append(query_tokens.gather(1, keep[:, :, None].expand(-1, -1, x.size(-1))))
+
+            times = times.view(batch_size, num, 2).gather(1, keep[:, :, None].expand(-1, -1, 2))
+            kept_queries.append(torch.flatten(times, start_dim=0, end_dim=1))
+            kept_num_queries.append(keep.size(1))
+            offset += num
+
+        x = torch.cat(tokens, dim=1).transpose(0, 1).contiguous()
+        masks = self.get_query_masks(x)
+        for layer in layers[self.cascade_layers:]:
+            x, _ = layer(x, src_mask=masks)
+
+        return x.transpose(0, 1).contiguous(), tuple(kept_queries), tuple(kept_num_queries)
+
     def forward_encoder(
                 self,
                 inputs,
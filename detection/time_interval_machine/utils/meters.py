@@ -1,11 +1,16 @@
 import numpy as np
+import subprocess
 import datetime
 import torch
+import json
+import os
 
 from fvcore.common.timer import Timer
 
 import time_interval_machine.utils.logging as logging
-import time_interval_machine.utils.misc as misc
+import time_interval_machine.utils.resources as resources
+
+from time_interval_machine.utils.online_nms import OnlineNMS
 
 logger = logging.get_logger(__name__)
 
@@ -26,12 +31,106 @@ class AverageMeter(object):
         self.count += n
         self.avg = self.sum / self.count
 
+class ThroughputMeter(object):
+    """Windows, queries and feature tokens per second and the fraction of
+    time spent waiting for data. Rates are tracked as exponential moving
+    averages of each iteration, and as totals since the last reset and
+    since the start of the run."""
+    def __init__(self, model_modality, momentum=0.9):
+        self.model_modality = model_modality
+        self.momentum = momentum
+        self.run = self.empty_totals()
+        self.reset()
+
+    @staticmethod
+    def empty_totals():
+        return {"iters": 0, "windows": 0, "queries": 0, "tokens": 0, "time": 0.0, "data_time": 0.0}
+
+    def reset(self):
+        self.epoch = self.empty_totals()
+        self.ema = {}
+
+    def update(self, inputs, num_queries, iter_time, data_time):
+        if iter_time <= 0.0:
+            return
+        num_windows = inputs[0].size(0)
+        num_tokens = 0
+        if "visual" in self.model_modality:
+            num_tokens += inputs[0].size(0) * inputs[0].size(1)
+        if "audio" in self.model_modality:
+            num_tokens += inputs[1].size(0) * inputs[1].size(1)
+
+        for totals in [self.epoch, self.run]:
+            totals["iters"] += 1
+            totals["windows"] += num_windows
+            totals["queries"] += int(num_queries)
+            totals["tokens"] += num_tokens
+            totals["time"] += iter_time
+            totals["data_time"] += data_time
+
+        rates = self.get_rates({
+                    "windows": num_windows,
+                    "queries": num_queries,
+                    "tokens": num_tokens,
+                    "time": iter_time,
+                    "data_time": data_time
+                })
+        for k, v in rates.items():
+            self.ema[k] = v if k not in self.ema else self.momentum * self.ema[k] + (1 - self.momentum) * v
+
+    @staticmethod
+    def get_rates(totals):
+        time = max(totals["time"], 1e-8)
+        return {
+            "windows_per_sec": totals["windows"] / time,
+            "queries_per_sec": totals["queries"] / time,
+            "tokens_per_sec": totals["tokens"] / time,
+            "data_wait": totals["data_time"] / time
+        }
+
+    def get_message(self):
+        if len(self.ema) == 0:
+            return ''
+        return (' Windows/s: {windows_per_sec:.1f} |'
+                ' Queries/s: {queries_per_sec:.0f} |'
+                ' Tokens/s: {tokens_per_sec:.0f} |'
+                ' Data Wait: {data_wait:.1%} |'.format(**self.ema))
+
+    def get_stats(self, prefix, epoch=False):
+        rates = self.get_rates(self.epoch) if epoch else self.ema
+        return {f"{prefix}/{k}": v for k, v in rates.items()}
+
+    def summary(self):
+        return {**self.run, **self.get_rates(self.run)}
+
+
+def write_throughput_summary(output_dir, meters):
+    """Save the run throughput of each meter, e.g. {"train": train_meter},
+    with the commit it was measured at to output_dir/throughput.json"""
+    try:
+        commit = subprocess.run(
+                        ["git", "rev-parse", "HEAD"],
+                        cwd=os.path.dirname(os.path.abspath(__file__)),
+                        capture_output=True,
+                        text=True
+                    ).stdout.strip()
+    except OSError:
+        commit = ""
+
+    summary = {"commit": commit}
+    summary.update({name: meter.throughput.summary() for name, meter in meters.items()})
+    file_path = os.path.join(output_dir, "throughput.json")
+    with open(file_path, 'w') as f:
+        json.dump(summary, f, indent=4)
+    logger.info(f"Saved throughput summary to {file_path}")
+
 class TrainMeter(object):
     """Tracks multiple metrics for TIM model during training"""
     def __init__(self, args):
         self.iter_timer = Timer()
         self.data_timer = Timer()
         self.net_timer = Timer()
+        self.throughput = ThroughputMeter(args.model_modality)
 
         self.losses = AverageMeter()
         self.drloc_losses = AverageMeter()
@@ -56,6 +155,7 @@ class TrainMeter(object):
         self.reset()
 
     def reset(self):
+        self.throughput.reset()
         self.losses.reset()
         self.drloc_losses.reset()
         self.visual_action_losses.reset()
@@ -91,6 +191,14 @@ class TrainMeter(object):
     def net_toc(self):
         self.net_timer.pause()
 
+    def update_throughput(self, inputs, num_queries):
+        self.throughput.update(
+                inputs,
+                num_queries,
+                self.iter_timer.seconds(),
+                self.data_timer.seconds()
+            )
+
     def update(
             self,
             visual_loss,
@@ -176,6 +284,7 @@ class TrainMeter(object):
                     }
                 )
 
+        stats_dict.update(self.throughput.get_stats("Train"))
         return stats_dict
 
     def get_train_message(self, epoch, i, dataloader_size, lr):
@@ -223,10 +332,11 @@ class TrainMeter(object):
                         ' RAM: {ram[0]:.2f}/{ram[1]:.2f}GB |'
                         ' GPU: {gpu[0]:.2f}/{gpu[1]:.2f}GB |'.format(
                                                 loss=self.losses,
-                                                ram=misc.cpu_mem_usage(),
-                                                gpu=misc.gpu_mem_usage()
+                                                ram=resources.cpu_mem_usage(),
+                                                gpu=resources.gpu_mem_usage()
                                             )
                         )
+        message_str += self.throughput.get_message()
         return message_str
 
     def get_train_epoch_stats(self, iters):
@@ -261,6 +371,7 @@ class TrainMeter(object):
                     }
                 )
 
+        stats_dict.update(self.throughput.get_stats("Train_Epoch", epoch=True))
         return stats_dict
 
     def get_train_epoch_message(self, epoch):
@@ -320,6 +431,7 @@ class InferenceMeter(object):
         self.iter_timer = Timer()
         self.data_timer = Timer()
         self.net_timer = Timer()
+        self.throughput = ThroughputMeter(args.model_modality)
 
         self.losses = AverageMeter()
         self.visual_action_losses = AverageMeter()
@@ -347,6 +459,7 @@ class InferenceMeter(object):
         self.reset()
 
     def reset(self):
+        self.throughput.reset()
         self.losses.reset()
         self.visual_action_losses.reset()
         self.visual_reg_losses.reset()
@@ -380,6 +493,14 @@ class InferenceMeter(object):
     def net_toc(self):
         self.net_timer.pause()
 
+    def update_throughput(self, inputs, num_queries):
+        self.throughput.update(
+                inputs,
+                num_queries,
+                self.iter_timer.seconds(),
+                self.data_timer.seconds()
+            )
+
     def update(
             self,
             visual_loss,
@@ -483,10 +604,11 @@ class InferenceMeter(object):
                         ' RAM: {ram[0]:.2f}/{ram[1]:.2f}GB |'
                         ' GPU: {gpu[0]:.2f}/{gpu[1]:.2f}GB |'.format(
                                                 loss=self.losses,
-                                                ram=misc.cpu_mem_usage(),
-                                                gpu=misc.gpu_mem_usage()
+                                                ram=resources.cpu_mem_usage(),
+                                                gpu=resources.gpu_mem_usage()
                                             )
                         )
+        message_str += self.throughput.get_message()
         return message_str
 
     def get_val_epoch_stats(self, iters):
@@ -521,6 +643,7 @@ class InferenceMeter(object):
                     }
                 )
 
+        stats_dict.update(self.throughput.get_stats("Val", epoch=True))
         return stats_dict
 
     def get_val_epoch_message(self, epoch):
@@ -575,11 +698,13 @@ class FeatureMeter(object):
     """Tracks multiple metrics for TIM model during validation"""
     def __init__(
             self,
-            args
+            args,
+            stream_file=None
         ):
         self.iter_timer = Timer()
         self.data_timer = Timer()
         self.net_timer = Timer()
+        self.throughput = ThroughputMeter(args.model_modality)
         self.total_time = 0
         self.peak_cpu_mem = 0.0
         self.peak_gpu_mem = 0.0
@@ -605,6 +730,17 @@ class FeatureMeter(object):
 
         self.video_ids = np.zeros(0, dtype=object)
 
+        # Reduce proposals to detections on the fly instead of storing them
+        self.online_nms = None
+        self.num_proposals = 0
+        if args.online_nms:
+            assert self.modality in ["visual", "audio"], "Online NMS needs a single data modality"
+            self.online_nms = OnlineNMS(
+                                score_threshold=args.nms_score_threshold,
+                                sigma=args.nms_sigma,
+                                stream_file=stream_file
+                            )
+
     def reset(self):
         """
         Reset the metric.
@@ -648,6 +784,14 @@ class FeatureMeter(object):
     def net_toc(self):
         self.net_timer.pause()
 
+    def update_throughput(self, inputs, num_queries):
+        self.throughput.update(
+                inputs,
+                num_queries,
+                self.iter_timer.seconds(),
+                self.data_timer.seconds()
+            )
+
 
     def update(self, features, regressions, query_times, metadata):
         """
@@ -660,11 +804,7 @@ class FeatureMeter(object):
             clip_ids (tensor): clip indexes of the current batch, dimension is
                 N.
         """
-        ram = misc.cpu_mem_usage()
-        gpu = misc.gpu_mem_usage()
-
-        self.peak_cpu_mem = max(ram[0], self.peak_cpu_mem)
-        self.peak_gpu_mem = max(gpu[0], self.peak_gpu_mem)
+        resources.track_mem_usage()
 
         if "visual" in self.modality:
             video_ids = np.array(metadata['video_id'], dtype=object)
@@ -677,14 +817,26 @@ class FeatureMeter(object):
 
             v_query_times = query_times[0].cpu()
             v_query_times = torch.flatten(v_query_times, end_dim=-2)
-            max_time = v_query_times.max()
-
-            og_query = (v_query_times * win_size) + win_starts[:, None]
-            self.og_v_props = torch.concat([self.og_v_props, og_query])
+            # The cascade may only keep queries within the window
+            max_time = max(v_query_times.max(), 1.0)
 
             v_proposals = regressions[0].cpu()
             v_proposals = torch.clamp(v_proposals, min=0.0, max=max_time)
             v_proposals = (v_proposals * win_size) + win_starts[:, None]
+            action_preds = torch.sigmoid(features[2]).cpu()
+            self.num_proposals += v_proposals.size(0)
+
+            if self.online_nms is not None:
+                self.online_nms.update(
+                                video_ids,
+                                win_starts.numpy(),
+                                v_proposals.numpy(),
+                                action_preds.numpy()
+                            )
+                return
+
+            og_query = (v_query_times * win_size) + win_starts[:, None]
+            self.og_v_props = torch.concat([self.og_v_props, og_query])
             self.v_props = torch.concat([self.v_props, v_proposals])
 
             if self.include_verb_noun:
@@ -693,7 +845,6 @@ class FeatureMeter(object):
                 self.verb_preds = torch.concat([self.verb_preds, verb_preds])
                 self.noun_preds = torch.concat([self.noun_preds, noun_preds])
 
-            action_preds = torch.sigmoid(features[2]).cpu()
             self.action_preds = torch.concat([self.action_preds, action_preds])
             self.video_ids = np.concatenate([self.video_ids, video_ids], axis=0)
 
@@ -708,24 +859,32 @@ class FeatureMeter(object):
 
             a_query_times = query_times[1].cpu()
             a_query_times = torch.flatten(a_query_times, end_dim=-2)
-            max_time = a_query_times.max()
-
-            og_query = (a_query_times * win_size) + win_starts[:, None]
-            self.og_a_props = torch.concat([self.og_a_props, og_query])
+            max_time = max(a_query_times.max(), 1.0)
 
             a_proposals = regressions[1].cpu()
             a_proposals = torch.clamp(a_proposals, min=0.0, max=max_time)
             a_proposals = (a_proposals * win_size) + win_starts[:, None]
-            self.a_props = torch.concat([self.a_props, a_proposals])
-
             aud_preds = torch.sigmoid(features[3]).cpu()
+            self.num_proposals += a_proposals.size(0)
 
+            if self.online_nms is not None:
+                self.online_nms.update(
+                                video_ids,
+                                win_starts.numpy(),
+                                a_proposals.numpy(),
+                                aud_preds.numpy()
+                            )
+                return
+
+            og_query = (a_query_times * win_size) + win_starts[:, None]
+            self.og_a_props = torch.concat([self.og_a_props, og_query])
+            self.a_props = torch.concat([self.a_props, a_proposals])
             self.aud_preds = torch.concat([self.aud_preds, aud_preds])
             self.video_ids = np.concatenate([self.video_ids, video_ids], axis=0)
 
 
     def get_feat_message(self, iter, total_iters):
-        return ('| Iter: [{0}]/[{1}] |'
+        message_str = ('| Iter: [{0}]/[{1}] |'
                 ' Features Extracted: {num_feats} |'
                 ' Time: {batch_time:.3f} |'
                 ' Data: {data_time:.3f} |'
@@ -734,14 +893,16 @@ class FeatureMeter(object):
                 ' GPU: {gpu[0]:.2f}/{gpu[1]:.2f} GB |'.format(
                                             iter,
                                             total_iters,
-                                            num_feats=(self.action_preds.size(0) + self.aud_preds.size(0)),
+                                            num_feats=self.num_proposals,
                                             batch_time=self.iter_timer.seconds(),
                                             data_time=self.data_timer.seconds(),
                                             net_time=self.net_timer.seconds(),
-                                            ram=misc.cpu_mem_usage(),
-                                            gpu=misc.gpu_mem_usage()
+                                            ram=resources.cpu_mem_usage(),
+                                            gpu=resources.gpu_mem_usage()
                                         )
             )
+        message_str += self.throughput.get_message()
+        return message_str
 
     def save_chunk(self):
         data = {"video_ids": self.video_ids}
@@ -774,6 +935,22 @@ class FeatureMeter(object):
 
 
     def finalize_metrics(self):
+        if self.online_nms is not None:
+            data = self.online_nms.finalize()
+        else:
+            data = self.collect_predictions()
+
+        self.peak_cpu_mem, self.peak_gpu_mem = resources.peak_mem_usage()
+        time_taken = str(datetime.timedelta(seconds=int(self.total_time)))
+        final_message = (f'| Features Extracted: {self.num_proposals} |'
+                        f' Time Elapsed: {time_taken} |'
+                        f' Peak RAM: {self.peak_cpu_mem:.2f} GB |'
+                        f' Peak GPU: {self.peak_gpu_mem:.2f} GB |'
+                    )
+        logger.info(final_message)
+        return data
+
+    def collect_predictions(self):
         data = {"video_ids": self.video_ids}
         if "visual" in self.modality:
             if self.include_verb_noun:
@@ -799,11 +976,4 @@ class FeatureMeter(object):
                         "og_a_props": self.og_a_props.numpy()
                     }
                 )
-        time_taken = str(datetime.timedelta(seconds=int(self.total_time)))
-        final_message = (f'| Features Extracted: {(self.action_preds.size(0) + self.aud_preds.size(0))} |'
-                        f' Time Elapsed: {time_taken} |'
-                        f' Peak RAM: {self.peak_cpu_mem:.2f} GB |'
-                        f' Peak GPU: {self.peak_gpu_mem:.2f} GB |'
-                    )
-        logger.info(final_message)
         return data
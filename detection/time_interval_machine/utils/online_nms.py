@@ -0,0 +1,178 @@
+import numpy as np
+import torch
+
+import time_interval_machine.utils.logging as logging
+import time_interval_machine.utils.shards as shards
+
+logger = logging.get_logger(__name__)
+
+
+class OnlineNMS(object):
+    """Score filtering and NMS of detection proposals during extraction.
+
+    Candidates are buffered per video. Windows arrive in temporal order, so a
+    later window can only add proposals starting at or after its window start.
+    Once the buffered candidates split into two groups that no candidate
+    bridges, and the earlier group ends before the latest window start, that
+    group can never overlap a future proposal and is suppressed immediately.
+    This gives the same detections as running NMS over the whole video while
+    only keeping the unresolved tail of the current video in memory.
+
+    With a stream_file, the detections of each video are appended to it as
+    soon as the video is finished, so they survive a crash of the run and can
+    be read with shards.read_stream before extraction ends.
+    """
+    def __init__(
+            self,
+            score_threshold=0.03,
+            iou_threshold=0.1,
+            min_score=0.001,
+            sigma=0.25,
+            method=2,
+            nms='soft',
+            stream_file=None
+        ):
+        # The C++ NMS is built from detection/eval_detection (see README)
+        import nms_1d_cpu
+        self.nms_1d_cpu = nms_1d_cpu
+
+        self.score_threshold = score_threshold
+        self.iou_threshold = iou_threshold
+        self.min_score = min_score
+        self.sigma = sigma
+        self.method = method
+        self.soft = (nms == 'soft')
+
+        self.stream_file = stream_file
+        if stream_file is not None:
+            # Start a new stream, a previous run's videos are extracted again
+            open(stream_file, 'wb').close()
+
+        self.video_id = None
+        self.horizon = -np.inf
+        self.reset_buffer()
+
+        self.video_ids = []
+        self.segments = []
+        self.scores = []
+        self.labels = []
+        self.num_candidates = 0
+        self.num_detections = 0
+        # Index of the first detections of the current video in the lists above
+        self.video_start = 0
+
+    def reset_buffer(self):
+        self.buf_segs = np.zeros((0, 2), dtype=np.float32)
+        self.buf_scores = np.zeros(0, dtype=np.float32)
+        self.buf_labels = np.zeros(0, dtype=np.int64)
+
+    def update(self, video_ids, window_starts, proposals, scores):
+        """
+        Add the proposals of a batch of windows.
+        Args:
+            video_ids (ndarray): video id of each proposal, N.
+            window_starts (ndarray): start of the window of each proposal, N.
+            proposals (ndarray): proposal segments in seconds, N x 2.
+            scores (ndarray): class scores of each proposal, N x C.
+        """
+        # split the batch into runs of consecutive proposals from the same video
+        changes = np.nonzero(video_ids[1:] != video_ids[:-1])[0] + 1
+        bounds = np.concatenate([[0], changes, [len(video_ids)]])
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            if video_ids[start] != self.video_id:
+                self.end_video()
+                self.video_id = video_ids[start]
+                self.horizon = -np.inf
+
+            props = np.round(proposals[start:end], 3)
+            valid = (props[:, 1] - props[:, 0]) > 0.0
+            rows, labels = np.nonzero((scores[start:end] > self.score_threshold) & valid[:, None])
+
+            self.buf_segs = np.concatenate([self.buf_segs, props[rows]])
+            self.buf_scores = np.concatenate([self.buf_scores, scores[start:end][rows, labels]])
+            self.buf_labels = np.concatenate([self.buf_labels, labels])
+            self.num_candidates += rows.shape[0]
+
+            self.horizon = max(self.horizon, float(window_starts[start:end].max()))
+            self.flush(self.horizon)
+
+    def flush(self, horizon=np.inf):
+        """Suppress every buffered candidate that no proposal starting at or
+        after horizon can overlap."""
+        if self.buf_scores.shape[0] == 0:
+            return
+
+        order = np.argsort(self.buf_segs[:, 0], kind='stable')
+        starts = self.buf_segs[order, 0]
+        reach = np.maximum.accumulate(self.buf_segs[order, 1])
+
+        # candidates [0, k) are closed when nothing after them starts before their reach
+        closed = (reach <= horizon) & (reach <= np.append(starts[1:], np.inf))
+        if not closed.any():
+            return
+        k = np.nonzero(closed)[0][-1] + 1
+
+        done, keep = order[:k], order[k:]
+        self.emit(self.buf_segs[done], self.buf_scores[done], self.buf_labels[done])
+        self.buf_segs = self.buf_segs[keep]
+        self.buf_scores = self.buf_scores[keep]
+        self.buf_labels = self.buf_labels[keep]
+
+    def end_video(self):
+        """Suppress the rest of the current video and stream its detections"""
+        self.flush()
+        if self.stream_file is not None and len(self.video_ids) > self.video_start:
+            shards.append_stream(
+                    self.stream_file,
+                    {
+                        "video_ids": np.concatenate(self.video_ids[self.video_start:]),
+                        "segments": np.concatenate(self.segments[self.video_start:]),
+                        "scores": np.concatenate(self.scores[self.video_start:]),
+                        "labels": np.concatenate(self.labels[self.video_start:])
+                    }
+                )
+        self.video_start = len(self.video_ids)
+
+    def emit(self, segs, scores, labels):
+        dets, inds = self.nms_1d_cpu.batched_nms(
+                torch.from_numpy(np.ascontiguousarray(segs)).float(),
+                torch.from_numpy(np.ascontiguousarray(scores)).float(),
+                torch.from_numpy(np.ascontiguousarray(labels)).long(),
+                iou_threshold=float(self.iou_threshold),
+                sigma=float(self.sigma),
+                min_score=float(self.min_score),
+                method=int(self.method),
+                soft=self.soft,
+                max_num=0
+            )
+        dets = dets.numpy()
+        num_dets = dets.shape[0]
+        self.video_ids.append(np.full(num_dets, self.video_id, dtype=object))
+        self.segments.append(np.round(dets[:, :2].astype(float), 3))
+        self.scores.append(dets[:, 2].astype(float))
+        self.labels.append(labels[inds.numpy()])
+        self.num_detections += num_dets
+
+    def finalize(self):
+        self.end_video()
+        self.video_id = None
+        self.horizon = -np.inf
+
+        if len(self.video_ids) == 0:
+            video_ids = np.zeros(0, dtype=object)
+            segments = np.zeros((0, 2))
+            scores = np.zeros(0)
+            labels = np.zeros(0, dtype=np.int64)
+        else:
+            video_ids = np.concatenate(self.video_ids)
+            segments = np.concatenate(self.segments)
+            scores = np.concatenate(self.scores)
+            labels = np.concatenate(self.labels)
+
+        logger.info(f"Online NMS kept {self.num_detections} of {self.num_candidates} candidates.")
+        return {
+            "video_ids": video_ids,
+            "segments": segments,
+            "scores": scores,
+            "labels": labels
+        }
@@ -41,6 +41,22 @@ def parse_args():
     parser.add_argument('--feat_dropout', type=float, default=0.5)
     parser.add_argument('--seq_dropout', type=float, default=0.5)
     parser.add_argument('--iou_threshold', type=float, default=0.6)
+    parser.add_argument('--cascade_top_n',
+                        type=int,
+                        default=0,
+                        help='Only keep the top N queries per window after the first cascade stage during --extract_feats, 0 disables the cascade'
+                    )
+    parser.add_argument('--cascade_layers',
+                        type=int,
+                        default=2,
+                        help='Number of backbone layers used to score the actionness of all queries in the first cascade stage'
+                    )
+    parser.add_argument('--query_budgets',
+                        type=int,
+                        nargs='+',
+                        default=None,
+                        help='Inference queries kept per pyramid scale, finest first. -1 keeps all, 0 skips the scale'
+                    )
     parser.add_argument('--verb_only',
                         type=str2bool,
                         default=False,
@@ -100,6 +116,11 @@ def parse_args():
                         type=float,
                         help='Stride of input window in seconds'
                     )
+    parser.add_argument('--lazy_windows',
+                        type=str2bool,
+                        default=True,
+                        help='Compute windows on the fly instead of precomputing them for splits without ground truth'
+                    )
     parser.add_argument('--m_drloc',
                         default=32,
                         type=int,
@@ -148,6 +169,40 @@ def parse_args():
                     )
     parser.add_argument('--output_dir', type=Path)
     parser.add_argument('--enable_wandb_log', action='store_true')
+    parser.add_argument('--profile',
+                        action='store_true',
+                        help='Profile a range of iterations and save a Chrome trace to output_dir/profile'
+                    )
+    parser.add_argument('--profile_start',
+                        default=10,
+                        type=int,
+                        help='First iteration to profile with --profile'
+                    )
+    parser.add_argument('--profile_steps',
+                        default=5,
+                        type=int,
+                        help='Number of iterations to profile with --profile'
+                    )
+    parser.add_argument('--resource_interval',
+                        default=1.0,
+                        type=float,
+                        help='Seconds between background samples of memory and CPU usage, 0 disables the sampler'
+                    )
+    parser.add_argument('--online_nms',
+                        type=str2bool,
+                        default=False,
+                        help='Run score filtering and NMS per video during --extract_feats'
+                    )
+    parser.add_argument('--nms_score_threshold',
+                        default=0.03,
+                        type=float,
+                        help='Score threshold for candidates of the online NMS'
+                    )
+    parser.add_argument('--nms_sigma',
+                        default=0.25,
+                        type=float,
+                        help='Sigma for the online soft NMS'
+                    )
     parser.add_argument('--train', action='store_true')
     parser.add_argument('--validate', action='store_true')
     parser.add_argument('--extract_feats', action='store_true')
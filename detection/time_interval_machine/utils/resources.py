@@ -0,0 +1,181 @@
+"""Background sampling of memory and CPU usage."""
+
+import collections
+import threading
+import psutil
+import atexit
+import torch
+import time
+import os
+
+import time_interval_machine.utils.distributed as du
+import time_interval_machine.utils.logging as logging
+import time_interval_machine.utils.misc as misc
+
+logger = logging.get_logger(__name__)
+
+_SAMPLER = None
+
+# Peaks of the direct queries, used when the sampler is off
+_PEAK_RAM = 0.0
+_PEAK_GPU = 0.0
+
+FIELDS = [
+    "time",
+    "ram_used",
+    "ram_total",
+    "rss",
+    "cpu_percent",
+    "gpu_allocated",
+    "gpu_peak",
+    "gpu_total"
+]
+
+
+class ResourceSampler(object):
+    """
+    Records the memory and CPU usage of this process from a daemon thread.
+    The latest samples are kept in a ring buffer and every sample is
+    appended to log_path as a csv row. Memory is in GB and cpu_percent can
+    exceed 100 when several cores are busy.
+    Args:
+        interval (float): seconds between samples.
+        history (int): number of samples kept in memory.
+        log_path (str, optional): csv file the samples are appended to.
+    """
+    def __init__(self, interval=1.0, history=3600, log_path=None):
+        self.interval = interval
+        self.samples = collections.deque(maxlen=history)
+        self.peak_ram = 0.0
+        self.peak_gpu = 0.0
+
+        self.process = psutil.Process(os.getpid())
+        # The first call only starts the measurement
+        self.process.cpu_percent(interval=None)
+
+        # Read the device here, the sampling thread would otherwise see device 0
+        if torch.cuda.is_available():
+            self.device = torch.cuda.current_device()
+            self.gpu_total = torch.cuda.get_device_properties(self.device).total_memory / 1024 ** 3
+        else:
+            self.device = None
+            self.gpu_total = 0.0
+
+        self.log_file = None
+        if log_path is not None:
+            new_file = not os.path.exists(log_path) or os.path.getsize(log_path) == 0
+            self.log_file = open(log_path, 'a', buffering=1)
+            if new_file:
+                self.log_file.write(",".join(FIELDS) + "\n")
+
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="resource_sampler", daemon=True)
+        self.sample()
+
+    def sample(self):
+        vram = psutil.virtual_memory()
+        ram_used = (vram.total - vram.available) / 1024 ** 3
+        rss = self.process.memory_info().rss / 1024 ** 3
+        cpu_percent = self.process.cpu_percent(interval=None)
+        if self.device is not None:
+            gpu_allocated = torch.cuda.memory_allocated(self.device) / 1024 ** 3
+            gpu_peak = torch.cuda.max_memory_allocated(self.device) / 1024 ** 3
+        else:
+            gpu_allocated, gpu_peak = 0.0, 0.0
+
+        sample = (
+            time.time(),
+            ram_used,
+            vram.total / 1024 ** 3,
+            rss,
+            cpu_percent,
+            gpu_allocated,
+            gpu_peak,
+            self.gpu_total
+        )
+        self.samples.append(sample)
+        self.peak_ram = max(self.peak_ram, ram_used)
+        self.peak_gpu = max(self.peak_gpu, gpu_peak)
+
+        if self.log_file is not None:
+            self.log_file.write(",".join(f"{v:.4f}" for v in sample) + "\n")
+        return sample
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            self.sample()
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        if self.thread.is_alive():
+            self.stop_event.set()
+            self.thread.join()
+        if self.log_file is not None:
+            self.log_file.close()
+            self.log_file = None
+
+
+def start_sampler(args):
+    """Start sampling every args.resource_interval seconds, writing the samples
+    of each process to resources_rank<r>.csv in args.output_dir"""
+    global _SAMPLER
+    if args.resource_interval <= 0 or _SAMPLER is not None:
+        return _SAMPLER
+
+    log_path = None
+    if args.output_dir is not None:
+        os.makedirs(args.output_dir, exist_ok=True)
+        log_path = os.path.join(args.output_dir, f"resources_rank{du.get_rank()}.csv")
+
+    _SAMPLER = ResourceSampler(interval=args.resource_interval, log_path=log_path).start()
+    atexit.register(stop_sampler)
+    logger.info(f"Sampling resource usage every {args.resource_interval}s to {log_path}")
+    return _SAMPLER
+
+
+def stop_sampler():
+    global _SAMPLER
+    if _SAMPLER is not None:
+        _SAMPLER.stop()
+        _SAMPLER = None
+
+
+def cpu_mem_usage():
+    """Latest system memory (RAM) usage and total (GB)"""
+    global _PEAK_RAM
+    if _SAMPLER is None:
+        usage = misc.cpu_mem_usage()
+        _PEAK_RAM = max(_PEAK_RAM, usage[0])
+        return usage
+    sample = _SAMPLER.samples[-1]
+    return sample[1], sample[2]
+
+
+def gpu_mem_usage():
+    """Latest peak GPU memory allocated and total (GB)"""
+    global _PEAK_GPU
+    if _SAMPLER is None:
+        usage = misc.gpu_mem_usage() if torch.cuda.is_available() else (0.0, 0.0)
+        _PEAK_GPU = max(_PEAK_GPU, usage[0])
+        return usage
+    sample = _SAMPLER.samples[-1]
+    return sample[6], sample[7]
+
+
+def track_mem_usage():
+    """Without the sampler, query the memory usage so the peaks include it.
+    The sampler tracks the peaks itself, so this does nothing while it runs."""
+    if _SAMPLER is None:
+        cpu_mem_usage()
+        gpu_mem_usage()
+
+
+def peak_mem_usage():
+    """Highest RAM usage and GPU memory allocated seen so far (GB)"""
+    if _SAMPLER is None:
+        track_mem_usage()
+        return _PEAK_RAM, _PEAK_GPU
+    return _SAMPLER.peak_ram, _SAMPLER.peak_gpu
@@ -0,0 +1,129 @@
+import numpy as np
+import argparse
+import json
+import pickle
+import torch
+import os
+
+import time_interval_machine.utils.logging as logging
+
+logger = logging.get_logger(__name__)
+
+EXT = ".pth.tar"
+STREAM_EXT = ".stream.pkl"
+
+
+def shard_path(file_path, rank, world_size):
+    return file_path.replace(EXT, f".rank{rank}-of-{world_size}{EXT}")
+
+
+def stream_path(file_path, rank, world_size):
+    return file_path.replace(EXT, f".rank{rank}-of-{world_size}{STREAM_EXT}")
+
+
+def concat_outputs(outputs):
+    """Concatenate output dicts of numpy arrays key by key"""
+    outputs = [o for o in outputs if len(o) > 0]
+    if len(outputs) == 0:
+        return {}
+    return {k: np.concatenate([o[k] for o in outputs], axis=0) for k in outputs[0].keys()}
+
+
+def append_stream(path, data):
+    """Append one output dict, e.g. the detections of a video, to a stream file"""
+    with open(path, 'ab') as f:
+        pickle.dump(data, f, protocol=5)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def read_stream(path):
+    """
+    Concatenate the output dicts appended to a stream file so far. The
+    file can be read while extraction is still running, and a last record
+    cut short by a crash is ignored.
+    """
+    records = []
+    with open(path, 'rb') as f:
+        while True:
+            try:
+                records.append(pickle.load(f))
+            except EOFError:
+                break
+            except pickle.UnpicklingError:
+                logger.warning(f"Ignoring a truncated record at the end of {path}")
+                break
+    return concat_outputs(records)
+
+
+def manifest_path(file_path):
+    return file_path.replace(EXT, ".manifest.json")
+
+
+def write_shard(data, file_path, rank, world_size):
+    """Save the outputs of one process next to the final output file"""
+    path = shard_path(file_path, rank, world_size)
+    logger.info(f"Saving shard to file path: {path}")
+    torch.save(data, open(path, 'wb'), pickle_protocol=5)
+    return path
+
+
+def write_manifest(file_path, world_size):
+    """List the shards to merge into file_path, in rank order"""
+    path = manifest_path(file_path)
+    manifest = {
+            "output": os.path.basename(file_path),
+            "world_size": world_size,
+            "shards": [
+                os.path.basename(shard_path(file_path, r, world_size))
+                for r in range(world_size)
+            ]
+        }
+    with open(path, 'w') as f:
+        json.dump(manifest, f, indent=4)
+    return path
+
+
+def merge_shards(path, remove_shards=True):
+    """
+    Merge the shards listed in a manifest into a single output file.
+    Each process extracts a contiguous range of whole videos, so the shards
+    are concatenated in rank order to give the single process output.
+    A shard that was never written, because its process stopped early, is
+    recovered from its stream file if there is one.
+    """
+    root = os.path.dirname(path)
+    with open(path, 'r') as f:
+        manifest = json.load(f)
+
+    shards = []
+    for s in manifest["shards"]:
+        shard_file = os.path.join(root, s)
+        stream_file = shard_file.replace(EXT, STREAM_EXT)
+        if os.path.exists(shard_file):
+            shards.append(torch.load(shard_file, map_location='cpu'))
+        elif os.path.exists(stream_file):
+            logger.warning(f"No shard {s}, reading the videos finished in {os.path.basename(stream_file)}")
+            shards.append(read_stream(stream_file))
+        else:
+            raise FileNotFoundError(f"Neither {shard_file} nor {stream_file} exist")
+    data = concat_outputs(shards)
+
+    file_path = os.path.join(root, manifest["output"])
+    logger.info(f"Saving merged shards to file path: {file_path}")
+    torch.save(data, open(file_path, 'wb'), pickle_protocol=5)
+
+    if remove_shards:
+        for s in manifest["shards"]:
+            for f in [os.path.join(root, s), os.path.join(root, s.replace(EXT, STREAM_EXT))]:
+                if os.path.exists(f):
+                    os.remove(f)
+    return file_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merge the shards of a distributed extraction")
+    parser.add_argument("manifest", type=str, help="Path to the .manifest.json of the extraction")
+    parser.add_argument("--keep_shards", action='store_true', help="Do not delete the shards after merging")
+    args = parser.parse_args()
+    merge_shards(args.manifest, remove_shards=not args.keep_shards)
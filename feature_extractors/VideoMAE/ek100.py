@@ -8,6 +8,7 @@ from decord import VideoReader, cpu
 from torch.utils.data import Dataset
 from torchvision import transforms
 
+from frame_io import frame_archive
 import video_transforms as video_transforms
 import volume_transforms as volume_transforms
 from random_erasing import RandomErasing
@@ -278,18 +279,7 @@ class EKRawFrameClsDataset(Dataset):
                 ]
                 all_index.extend(tmp_index)
             all_index = list(np.sort(np.array(all_index)))
-            imgs = []
-            for idx in all_index:
-                frame_fname = os.path.join(fname,
-                                           self.filename_tmpl.format(idx + 1 + frame_offset))
-                # img_bytes = self.client.get(frame_fname)
-                with open(frame_fname, "rb") as fp:
-                    img_bytes = fp.read()
-                img_np = np.frombuffer(img_bytes, np.uint8)
-                img = cv2.imdecode(img_np, cv2.IMREAD_COLOR)
-                cv2.cvtColor(img, cv2.COLOR_BGR2RGB, img)
-                imgs.append(img)
-            buffer = np.array(imgs)
+            buffer = np.array(self._decode_frames(fname, all_index, frame_offset))
             return buffer
 
         # handle temporal segments
@@ -318,19 +308,27 @@ class EKRawFrameClsDataset(Dataset):
             all_index = [0] * (self.num_segment - num_frames) + list(
                 range(num_frames))
         all_index = list(np.array(all_index))
+        buffer = np.array(self._decode_frames(fname, all_index, frame_offset))
+        return buffer
+
+    def _decode_frames(self, fname, all_index, frame_offset):
+        # Read from the packed archive of the video if there is one
+        archive = frame_archive.open_archive(fname)
         imgs = []
         for idx in all_index:
-            frame_fname = os.path.join(fname,
-                                       self.filename_tmpl.format(idx + 1 + frame_offset))
-            # img_bytes = self.client.get(frame_fname)
-            with open(frame_fname, "rb") as fp:
-                img_bytes = fp.read()
-            img_np = np.frombuffer(img_bytes, np.uint8)
-            img = cv2.imdecode(img_np, cv2.IMREAD_COLOR)
+            if archive is not None:
+                img = archive.decode(idx + 1 + frame_offset)
+            else:
+                frame_fname = os.path.join(fname,
+                                           self.filename_tmpl.format(idx + 1 + frame_offset))
+                # img_bytes = self.client.get(frame_fname)
+                with open(frame_fname, "rb") as fp:
+                    img_bytes = fp.read()
+                img_np = np.frombuffer(img_bytes, np.uint8)
+                img = cv2.imdecode(img_np, cv2.IMREAD_COLOR)
             cv2.cvtColor(img, cv2.COLOR_BGR2RGB, img)
             imgs.append(img)
-        buffer = np.array(imgs)
-        return buffer
+        return imgs
 
     def __len__(self):
         if self.mode != 'test':
@@ -2,6 +2,7 @@
 import argparse
 import os
 import random
+import sys
 
 import numpy as np
 import pandas as pd
@@ -10,7 +11,13 @@ from timm.models import create_model
 from torch.utils.data import Dataset
 import cv2
 
+# frame_io is shared with the other extractors in feature_extractors/
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
 import modeling_finetune # Important, needed to initialise models
+from frame_io import frame_archive
+from frame_io.frame_cache import FrameCache, VideoGroupedBatchSampler
+from frame_io.jpeg import decode_flag
 from torchvision import transforms
 import video_transforms as video_transforms
 import volume_transforms as volume_transforms
@@ -64,6 +71,18 @@ def get_args():
     parser.add_argument(
         '--ckpt_path',
         help='Load from checkpoint')
+    parser.add_argument(
+        '--frame_cache_mb',
+        default=256,
+        type=int,
+        help='Memory in MB for decoded frames each worker keeps, 0 disables the cache.'
+    )
+    parser.add_argument(
+        '--reduced_decode',
+        action='store_true',
+        help='Decode frames at 1/2, 1/4 or 1/8 scale when their short side stays at least 224. '
+             'Faster, but the features differ slightly.'
+    )
 
     args = parser.parse_args()
 
@@ -81,46 +100,81 @@ class FeatureExtractionDataset(Dataset):
     def __init__(self,
                  df_vid_group,
                  video_path,
-                 enable_augmentation):
+                 num_aug=1,
+                 frame_cache_mb=0,
+                 min_size=0):
         self.df_vid_group = df_vid_group
         self.video_path = video_path
-        self.enable_augmentation = enable_augmentation
-        self.transform = video_transforms.Compose([
-                video_transforms.Resize(224,
-                                        interpolation='bilinear'),
-                video_transforms.CenterCrop(size=(224,
-                                                    224)),
-                volume_transforms.ClipToTensor(),
-                video_transforms.Normalize(mean=[0.485, 0.456, 0.406],
-                                            std=[0.229, 0.224, 0.225])
-            ])
+        self.num_aug = num_aug
+        self.min_size = min_size
+        self.frame_cache = FrameCache(frame_cache_mb * 1024 ** 2) if frame_cache_mb > 0 else None
+        self.transform = build_transform()
 
     def __getitem__(self, index):
         row = self.df_vid_group.iloc[index]
         start_frame = row['start_frame']
         stop_frame = row['stop_frame']
         num_frames = stop_frame - start_frame
-        data = load_frame(self.video_path, num_frames, start_frame)
-        if self.enable_augmentation:
-            # RandAugment
-            aug_transform = video_transforms.create_random_augment(
-                input_size=(224, 224),
-                auto_augment='rand-m7-n4-mstd0.5-inc1',
-                interpolation='bicubic',
-            )
-            data = [transforms.ToPILImage()(frame) for frame in data]
-            data = aug_transform(data)
-
-        frame_q = self.transform(data)  # torch.Size([3, 16, 224, 224])
-        return frame_q
+        data = load_frame(self.video_path, num_frames, start_frame, frame_cache=self.frame_cache,
+                          min_size=self.min_size)
+        frame_q = make_views(data, self.transform, self.num_aug)  # torch.Size([num_aug, 3, 16, 224, 224])
+        return frame_q, index
 
     def __len__(self):
         return self.df_vid_group.shape[0]
 
 
-def load_frame(sample, num_frames, frame_offset, num_segment=16, filename_tmpl='frame_{:010}.jpg'):
-    fname = sample
+def build_transform():
+    return video_transforms.Compose([
+            video_transforms.Resize(224,
+                                    interpolation='bilinear'),
+            video_transforms.CenterCrop(size=(224,
+                                                224)),
+            volume_transforms.ClipToTensor(),
+            video_transforms.Normalize(mean=[0.485, 0.456, 0.406],
+                                        std=[0.229, 0.224, 0.225])
+        ])
+
+
+def make_views(data, transform, num_aug=1):
+    # The frames are loaded once for the unaugmented view and the
+    # num_aug - 1 augmented views
+    views = [transform(data)]  # torch.Size([3, 16, 224, 224])
+    for _ in range(1, num_aug):
+        # RandAugment
+        aug_transform = video_transforms.create_random_augment(
+            input_size=(224, 224),
+            auto_augment='rand-m7-n4-mstd0.5-inc1',
+            interpolation='bicubic',
+        )
+        aug_data = [transforms.ToPILImage()(frame) for frame in data]
+        aug_data = aug_transform(aug_data)
+        views.append(transform(aug_data))
+    return torch.stack(views)
 
+
+def decode_frames(fname, frame_idxs, filename_tmpl='frame_{:010}.jpg', min_size=0):
+    # Read from the packed archive of the video if there is one
+    archive = frame_archive.open_archive(fname)
+    imgs = []
+    for frame_idx in frame_idxs:
+        if archive is not None:
+            img_np = archive.read(frame_idx)
+            img = archive.decode(frame_idx, decode_flag(img_np, min_size))
+        else:
+            frame_fname = os.path.join(fname,
+                                        filename_tmpl.format(frame_idx))
+            # img_bytes = self.client.get(frame_fname)
+            with open(frame_fname, "rb") as fp:
+                img_bytes = fp.read()
+            img_np = np.frombuffer(img_bytes, np.uint8)
+            img = cv2.imdecode(img_np, decode_flag(img_np, min_size))
+        cv2.cvtColor(img, cv2.COLOR_BGR2RGB, img)
+        imgs.append(img)
+    return imgs
+
+
+def sample_frame_idxs(num_frames, frame_offset, num_segment=16):
     # handle temporal segments
     average_duration = num_frames // num_segment
     all_index = []
@@ -131,21 +185,56 @@ def load_frame(sample, num_frames, frame_offset, num_segment=16, filename_tmpl='
         (average_duration // 2))
 
     all_index = list(np.array(all_index))
-    imgs = []
-    for idx in all_index:
-        frame_fname = os.path.join(fname,
-                                    filename_tmpl.format(idx + 1 + frame_offset))
-        # img_bytes = self.client.get(frame_fname)
-        with open(frame_fname, "rb") as fp:
-            img_bytes = fp.read()
-        img_np = np.frombuffer(img_bytes, np.uint8)
-        img = cv2.imdecode(img_np, cv2.IMREAD_COLOR)
-        cv2.cvtColor(img, cv2.COLOR_BGR2RGB, img)
-        imgs.append(img)
+    return [int(idx + 1 + frame_offset) for idx in all_index]
+
+
+def load_frame(sample, num_frames, frame_offset, num_segment=16, filename_tmpl='frame_{:010}.jpg', frame_cache=None,
+               min_size=0):
+    fname = sample
+
+    frame_idxs = sample_frame_idxs(num_frames, frame_offset, num_segment)
+    if frame_cache is not None:
+        imgs = frame_cache.load(
+                    [(fname, idx) for idx in frame_idxs],
+                    lambda keys: decode_frames(fname, [idx for _, idx in keys], filename_tmpl, min_size)
+                )
+    else:
+        imgs = decode_frames(fname, frame_idxs, filename_tmpl, min_size)
     buffer = np.array(imgs)
     return buffer
 
 
+def load_model(model_name, dataset, ckpt_path):
+    # get model & load ckpt
+    model = create_model(
+        model_name,
+        img_size=224,
+        pretrained=False,
+        num_classes=[97, 300] if dataset == "ek100" else 67,
+        all_frames=16,
+        tubelet_size=2,
+        drop_rate=0.0,
+        drop_path_rate=0.2,
+        attn_drop_rate=0.0,
+        head_drop_rate=0.3,
+        drop_block_rate=None,
+        use_mean_pooling=True,
+        init_scale=0.001,
+        with_cp=False,
+        num_segment=1,
+    )
+
+    ckpt = torch.load(ckpt_path, map_location='cpu')
+    for model_key in ['model', 'module']:
+        if model_key in ckpt:
+            ckpt = ckpt[model_key]
+            break
+    model.load_state_dict(ckpt)
+    model.eval()
+    model.cuda()
+    return model
+
+
 def extract_feature(args):
     # Set random seeds
     random.seed(args.seed)
@@ -180,34 +269,7 @@ def extract_feature(args):
     torch.cuda.set_device(rank)
     rank_vids = [vid for i,vid in enumerate(all_vids) if (i % world_size) == rank]
 
-    # get model & load ckpt
-    model = create_model(
-        args.model,
-        img_size=224,
-        pretrained=False,
-        num_classes=[97, 300] if args.dataset == "ek100" else 67,
-        all_frames=16,
-        tubelet_size=2,
-        drop_rate=0.0,
-        drop_path_rate=0.2,
-        attn_drop_rate=0.0,
-        head_drop_rate=0.3,
-        drop_block_rate=None,
-        use_mean_pooling=True,
-        init_scale=0.001,
-        with_cp=False,
-        num_segment=1,
-    )
-
-
-    ckpt = torch.load(args.ckpt_path, map_location='cpu')
-    for model_key in ['model', 'module']:
-        if model_key in ckpt:
-            ckpt = ckpt[model_key]
-            break
-    model.load_state_dict(ckpt)
-    model.eval()
-    model.cuda()
+    model = load_model(args.model, args.dataset, args.ckpt_path)
 
     # Extract Feature
     for video_id, df_vid_group in rank_vids:
@@ -215,35 +277,33 @@ def extract_feature(args):
 
         video_path = os.path.join(args.data_path, f"{video_id}")
 
-        all_sets = []
-        for i in range(args.num_aug):
-            dataset = FeatureExtractionDataset(
-                                            df_vid_group=df_vid_group,
-                                            video_path=video_path,
-                                            enable_augmentation=(i > 0)
-                                        )
-            data_loader = torch.utils.data.DataLoader(dataset,
-                                                    batch_size=32,
-                                                    num_workers=2,
-                                                    pin_memory=True,
-                                                    drop_last=False,
-                                                    shuffle=False,
-                                                    generator=rng_generator,
-                                                )
-            feature_list = []
-            for input_data in data_loader:
-                input_data = input_data.cuda()
-                with torch.no_grad():
-                    feature = model.forward_features(input_data)
-                    feature_list.extend(feature.cpu().numpy())
-            all_sets.append(np.vstack(feature_list))
-            
-        if args.num_aug > 1:
-            all_sets = np.stack(all_sets, axis=1)
-        else:
-            all_sets = np.expand_dims(all_sets[0], axis=1)
-
-        # [N, C]
+        dataset = FeatureExtractionDataset(
+                                        df_vid_group=df_vid_group,
+                                        video_path=video_path,
+                                        num_aug=args.num_aug,
+                                        frame_cache_mb=args.frame_cache_mb,
+                                        min_size=224 if args.reduced_decode else 0
+                                    )
+        # Each worker loads a contiguous run of clips to reuse its cached frames.
+        # Every clip holds num_aug views, so 32 views still go through the model at once.
+        data_loader = torch.utils.data.DataLoader(dataset,
+                                                batch_sampler=VideoGroupedBatchSampler(
+                                                    range(len(dataset)), max(32 // args.num_aug, 1), 2),
+                                                num_workers=2,
+                                                pin_memory=True,
+                                                generator=rng_generator,
+                                            )
+        feature_list = [None] * len(dataset)
+        for input_data, index in data_loader:
+            input_data = input_data.cuda()
+            with torch.no_grad():
+                feature = model.forward_features(input_data.flatten(0, 1))
+            feature = feature.view(input_data.shape[0], args.num_aug, -1)
+            for idx, feat in zip(index.tolist(), feature.cpu().numpy()):
+                feature_list[idx] = feat
+
+        # [N, num_aug, C]
+        all_sets = np.stack(feature_list)
         np.save(url, all_sets)
         print(f'Save feature on {url}')
 
@@ -10,6 +10,7 @@ import argparse
 import datetime
 import json
 import os
+import sys
 import time
 from collections import OrderedDict
 from functools import partial
@@ -23,6 +24,9 @@ from timm.loss import LabelSmoothingCrossEntropy, SoftTargetCrossEntropy
 from timm.models import create_model
 from timm.utils import ModelEma
 
+# frame_io is shared with the other extractors in feature_extractors/
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
 import modeling_finetune # Important, needed to initialise models
 import utils
 from datasets import build_dataset
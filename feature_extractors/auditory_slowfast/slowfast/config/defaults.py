@@ -191,6 +191,24 @@ _C.AUDIO_DATA.NUM_FRAMES = 250
 # Number of frequencies of the input spectrogram
 _C.AUDIO_DATA.NUM_FREQUENCIES = 128
 
+# Number of resampled WAV files each dataloader worker keeps in memory (AVE
+# and Perception Test). Files at SAMPLING_RATE are read clip by clip instead.
+_C.AUDIO_DATA.CACHE_VIDEOS = 4
+
+# Compute the spectrogram of whole videos once and slice the clips out of it,
+# instead of one STFT per clip. Clips are aligned to HOP_LENGTH.
+_C.AUDIO_DATA.VIDEO_SPECTROGRAM = False
+
+# Length in seconds of the audio each video spectrogram STFT is computed over.
+_C.AUDIO_DATA.SPECTROGRAM_CHUNK_SECS = 60.0
+
+# Number of video spectrogram chunks each dataloader worker keeps in memory.
+_C.AUDIO_DATA.SPECTROGRAM_CACHE_CHUNKS = 4
+
+# Folder of video spectrograms saved by tools/build_spectrogram_store.py. When
+# set, clips are read from it and the audio is not loaded.
+_C.AUDIO_DATA.SPECTROGRAM_STORE = ""
+
 
 # ---------------------------------------------------------------------------- #
 # Optimizer options
@@ -302,6 +320,13 @@ _C.EPICSOUNDS.AUDIO_DATA_FILE = ""
 
 _C.EPICSOUNDS.TEST_LIST = "epic_frame_train0.pkl"
 
+# Length in seconds of the chunks the untrimmed audio is read and cached in.
+_C.EPICSOUNDS.CHUNK_SECS = 10.0
+
+# Number of chunks each dataloader worker keeps in memory, 0 reads every clip
+# directly from the HDF5 file.
+_C.EPICSOUNDS.CACHE_CHUNKS = 32
+
 
 # -----------------------------------------------------------------------------
 # AVE Dataset options
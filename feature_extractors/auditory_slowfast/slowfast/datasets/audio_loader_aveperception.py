@@ -2,8 +2,70 @@ import random
 import numpy as np
 import torch
 import os
+import collections
 import librosa
-from librosa import stft, filters
+import soundfile as sf
+from librosa import stft
+
+from .spectrogram import mel_basis
+
+
+class WavReader(object):
+    """
+    Reads sample ranges of the untrimmed WAV files of a dataset. The header
+    of each file is read once. Files already at the target sampling rate are
+    read by seeking to the clip, only files that need resampling are decoded
+    in full, and the cache_videos most recently used of those are kept in
+    memory. Each dataloader worker has its own reader.
+    Args:
+        audio_dir (str): folder with a <video_id>.wav file per video.
+        sampling_rate (int): sampling rate the audio is returned at.
+        cache_videos (int): number of resampled waveforms to keep.
+    """
+    def __init__(self, audio_dir, sampling_rate, cache_videos=4):
+        self.audio_dir = audio_dir
+        self.sampling_rate = sampling_rate
+        self.cache_videos = cache_videos
+        self.info = {}
+        self.cache = collections.OrderedDict()
+
+    def _info(self, video):
+        if video not in self.info:
+            path = os.path.join(self.audio_dir, video + '.wav')
+            self.info[video] = (path, sf.info(path))
+        return self.info[video]
+
+    def _load(self, path):
+        if path in self.cache:
+            self.cache.move_to_end(path)
+            return self.cache[path]
+        samples, sr = librosa.load(path, sr=self.sampling_rate, mono=True)
+        assert sr == self.sampling_rate, \
+            "Audio sampling rate ({}) does not match target sampling rate ({})".format(sr, self.sampling_rate)
+        if self.cache_videos > 0:
+            self.cache[path] = samples
+            if len(self.cache) > self.cache_videos:
+                self.cache.popitem(last=False)
+        return samples
+
+    def num_samples(self, video):
+        path, info = self._info(video)
+        if info.samplerate != self.sampling_rate:
+            return self._load(path).shape[0]
+        return info.frames
+
+    def read(self, video, start_idx, end_idx):
+        """Mono samples [start_idx, end_idx) of video, clipped to its length"""
+        path, info = self._info(video)
+        if info.samplerate != self.sampling_rate:
+            return self._load(path)[start_idx:end_idx]
+
+        start_idx = min(max(start_idx, 0), info.frames)
+        end_idx = min(max(end_idx, start_idx), info.frames)
+        samples, _ = sf.read(path, start=start_idx, stop=end_idx, dtype='float32', always_2d=True)
+        # Same down-mix as librosa.load(mono=True)
+        return samples.mean(axis=1) if samples.shape[1] > 1 else samples[:, 0]
+
 
 def get_start_end_idx(audio_size, clip_size, clip_idx, num_clips, start_sample=0):
     """
@@ -36,13 +98,7 @@ def get_start_end_idx(audio_size, clip_size, clip_idx, num_clips, start_sample=0
     return start_sample + start_idx, start_sample + end_idx
 
 
-def pack_audio_perception(cfg, audio_record, temporal_sample_index):
-    path_audio = os.path.join(cfg.PERCEPTION.AUDIO_DATA_DIR, audio_record.untrimmed_video_name + '.wav')
-
-    samples, sr = librosa.load(path_audio, sr=cfg.AUDIO_DATA.SAMPLING_RATE, mono=True)
-    assert sr == cfg.AUDIO_DATA.SAMPLING_RATE, \
-        "Audio sampling rate ({}) does not match target sampling rate ({})".format(sr, cfg.AUDIO_DATA.SAMPLING_RATE)
-
+def pack_audio_perception(cfg, audio_reader, audio_record, temporal_sample_index, spec_engine=None):
     start_idx, end_idx = get_start_end_idx(
         audio_record.num_audio_samples,
         int(round(cfg.AUDIO_DATA.SAMPLING_RATE * cfg.AUDIO_DATA.CLIP_SECS)),
@@ -50,17 +106,20 @@ def pack_audio_perception(cfg, audio_record, temporal_sample_index):
         cfg.TEST.NUM_FEATURES,
         start_sample=audio_record.start_audio_sample
     )
-    spectrogram = _extract_sound_feature(cfg, samples, audio_record, int(start_idx), int(end_idx))
+    start_idx, end_idx = _clip_bounds(cfg, audio_record, int(start_idx), int(end_idx))
+    if spec_engine is not None:
+        spectrogram = spec_engine.clip(audio_record.untrimmed_video_name, start_idx, end_idx)
+    else:
+        samples = audio_reader.read(audio_record.untrimmed_video_name, start_idx, end_idx)
+        spectrogram = _log_specgram(cfg, samples,
+                                    window_size=cfg.AUDIO_DATA.WINDOW_LENGTH,
+                                    step_size=cfg.AUDIO_DATA.HOP_LENGTH
+                                    )
+    spectrogram = _extract_sound_feature(cfg, spectrogram)
     return spectrogram
 
 
-def pack_audio_ave(cfg, audio_record, temporal_sample_index):
-    path_audio = os.path.join(cfg.AVE.AUDIO_DATA_DIR, audio_record.untrimmed_video_name + '.wav')
-
-    samples, sr = librosa.load(path_audio, sr=cfg.AUDIO_DATA.SAMPLING_RATE, mono=True)
-    assert sr == cfg.AUDIO_DATA.SAMPLING_RATE, \
-        "Audio sampling rate ({}) does not match target sampling rate ({})".format(sr, cfg.AUDIO_DATA.SAMPLING_RATE)
-
+def pack_audio_ave(cfg, audio_reader, audio_record, temporal_sample_index, spec_engine=None):
     start_idx, end_idx = get_start_end_idx(
         audio_record.num_audio_samples,
         int(round(cfg.AUDIO_DATA.SAMPLING_RATE * cfg.AUDIO_DATA.CLIP_SECS)),
@@ -68,7 +127,16 @@ def pack_audio_ave(cfg, audio_record, temporal_sample_index):
         cfg.TEST.NUM_FEATURES,
         start_sample=audio_record.start_audio_sample
     )
-    spectrogram = _extract_sound_feature(cfg, samples, audio_record, int(start_idx), int(end_idx))
+    start_idx, end_idx = _clip_bounds(cfg, audio_record, int(start_idx), int(end_idx))
+    if spec_engine is not None:
+        spectrogram = spec_engine.clip(audio_record.untrimmed_video_name, start_idx, end_idx)
+    else:
+        samples = audio_reader.read(audio_record.untrimmed_video_name, start_idx, end_idx)
+        spectrogram = _log_specgram(cfg, samples,
+                                    window_size=cfg.AUDIO_DATA.WINDOW_LENGTH,
+                                    step_size=cfg.AUDIO_DATA.HOP_LENGTH
+                                    )
+    spectrogram = _extract_sound_feature(cfg, spectrogram)
     return spectrogram
 
 
@@ -83,31 +151,21 @@ def _log_specgram(cfg, audio, window_size=10,
                 hop_length=noverlap,
                 win_length=nperseg,
                 pad_mode='constant')
-    mel_basis = filters.mel(sr=cfg.AUDIO_DATA.SAMPLING_RATE,
-                            n_fft=2048,
-                            n_mels=128,
-                            htk=True,
-                            norm=None)
-    mel_spec = np.dot(mel_basis, np.abs(spec))
+    mel_spec = np.dot(mel_basis(cfg.AUDIO_DATA.SAMPLING_RATE), np.abs(spec))
 
     # log-mel-spec
     log_mel_spec = np.log(mel_spec + eps)
     return log_mel_spec.T
 
 
-def _extract_sound_feature(cfg, samples, audio_record, start_idx, end_idx):
+def _clip_bounds(cfg, audio_record, start_idx, end_idx):
+    """Range of the untrimmed audio the spectrogram is computed from"""
     if audio_record.num_audio_samples < int(round(cfg.AUDIO_DATA.SAMPLING_RATE * cfg.AUDIO_DATA.CLIP_SECS)):
-        samples = samples[audio_record.start_audio_sample:audio_record.end_audio_sample]
-        spectrogram = _log_specgram(cfg, samples,
-                                    window_size=cfg.AUDIO_DATA.WINDOW_LENGTH,
-                                    step_size=cfg.AUDIO_DATA.HOP_LENGTH
-                                    )
-    else:
-        samples = samples[start_idx:end_idx]
-        spectrogram = _log_specgram(cfg, samples,
-                                    window_size=cfg.AUDIO_DATA.WINDOW_LENGTH,
-                                    step_size=cfg.AUDIO_DATA.HOP_LENGTH
-                                    )
+        return audio_record.start_audio_sample, audio_record.end_audio_sample
+    return start_idx, end_idx
+
+
+def _extract_sound_feature(cfg, spectrogram):
     num_timesteps_to_pad = cfg.AUDIO_DATA.NUM_FRAMES - spectrogram.shape[0]
     spectrogram = np.pad(spectrogram, ((0, num_timesteps_to_pad), (0, 0)), 'edge')
     return torch.tensor(spectrogram).unsqueeze(0)
@@ -1,7 +1,61 @@
 import random
 import numpy as np
 import torch
-from librosa import stft, filters
+import collections
+from librosa import stft
+
+from .spectrogram import mel_basis
+
+
+class AudioChunkReader(object):
+    """
+    Reads sample ranges of the untrimmed waveforms in the EPIC-SOUNDS HDF5
+    file. With cache_chunks > 0 the file is read in aligned chunks of
+    chunk_size samples and the most recently used chunks are kept in memory,
+    so the overlapping clips of neighbouring records are only read once.
+    Each dataloader worker has its own reader.
+    Args:
+        audio_dataset (h5py.File): the opened HDF5 file.
+        chunk_size (int): number of samples per cached chunk.
+        cache_chunks (int): number of chunks to keep, 0 reads every range
+            directly from the file.
+    """
+    def __init__(self, audio_dataset, chunk_size, cache_chunks=0):
+        self.audio_dataset = audio_dataset
+        self.chunk_size = chunk_size
+        self.cache_chunks = cache_chunks if chunk_size > 0 else 0
+        self.cache = collections.OrderedDict()
+
+    def _read_chunk(self, video, chunk_idx):
+        key = (video, chunk_idx)
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        start = chunk_idx * self.chunk_size
+        chunk = self.audio_dataset[video][start:start + self.chunk_size]
+        self.cache[key] = chunk
+        if len(self.cache) > self.cache_chunks:
+            self.cache.popitem(last=False)
+        return chunk
+
+    def num_samples(self, video):
+        return self.audio_dataset[video].shape[0]
+
+    def read(self, video, start_idx, end_idx):
+        """Samples [start_idx, end_idx) of video, clipped to its length"""
+        num_samples = self.num_samples(video)
+        start_idx = min(max(start_idx, 0), num_samples)
+        end_idx = min(max(end_idx, start_idx), num_samples)
+        if self.cache_chunks == 0 or start_idx == end_idx:
+            return self.audio_dataset[video][start_idx:end_idx]
+
+        first = start_idx // self.chunk_size
+        last = (end_idx - 1) // self.chunk_size
+        chunks = [self._read_chunk(video, c) for c in range(first, last + 1)]
+        samples = chunks[0] if len(chunks) == 1 else np.concatenate(chunks)
+        offset = first * self.chunk_size
+        return samples[start_idx - offset:end_idx - offset]
+
 
 def get_start_end_idx(audio_size, clip_size, clip_idx, num_clips, start_sample=0):
     """
@@ -34,8 +88,7 @@ def get_start_end_idx(audio_size, clip_size, clip_idx, num_clips, start_sample=0
     return start_sample + start_idx, start_sample + end_idx
 
 
-def pack_audio_epic(cfg, audio_dataset, audio_record, temporal_sample_index):
-    samples = audio_dataset[audio_record.untrimmed_video_name][()]
+def pack_audio_epic(cfg, audio_reader, audio_record, temporal_sample_index, spec_engine=None):
     start_idx, end_idx = get_start_end_idx(
         audio_record.num_audio_samples,
         int(round(cfg.AUDIO_DATA.SAMPLING_RATE * cfg.AUDIO_DATA.CLIP_SECS)),
@@ -43,7 +96,17 @@ def pack_audio_epic(cfg, audio_dataset, audio_record, temporal_sample_index):
         cfg.TEST.NUM_FEATURES,
         start_sample=audio_record.start_audio_sample
     )
-    spectrogram = _extract_sound_feature(cfg, samples, audio_record, int(start_idx), int(end_idx))
+    # Only read the samples of the clip from the untrimmed audio
+    start_idx, end_idx = _clip_bounds(cfg, audio_record, int(start_idx), int(end_idx))
+    if spec_engine is not None:
+        spectrogram = spec_engine.clip(audio_record.untrimmed_video_name, start_idx, end_idx)
+    else:
+        samples = audio_reader.read(audio_record.untrimmed_video_name, start_idx, end_idx)
+        spectrogram = _log_specgram(cfg, samples,
+                                    window_size=cfg.AUDIO_DATA.WINDOW_LENGTH,
+                                    step_size=cfg.AUDIO_DATA.HOP_LENGTH
+                                    )
+    spectrogram = _extract_sound_feature(cfg, spectrogram, audio_record)
     return spectrogram
 
 
@@ -59,31 +122,22 @@ def _log_specgram(cfg, audio, window_size=10,
                 hop_length=noverlap,
                 win_length=nperseg,
                 pad_mode='constant')
-    mel_basis = filters.mel(sr=cfg.AUDIO_DATA.SAMPLING_RATE,
-                            n_fft=2048,
-                            n_mels=128,
-                            htk=True,
-                            norm=None)
-    mel_spec = np.dot(mel_basis, np.abs(spec))
+    mel_spec = np.dot(mel_basis(cfg.AUDIO_DATA.SAMPLING_RATE), np.abs(spec))
 
     # log-mel-spec
     log_mel_spec = np.log(mel_spec + eps)
     return log_mel_spec.T
 
 
-def _extract_sound_feature(cfg, samples, audio_record, start_idx, end_idx):
+def _clip_bounds(cfg, audio_record, start_idx, end_idx):
+    """Range of the untrimmed audio the spectrogram is computed from"""
+    if audio_record.num_audio_samples < int(round(cfg.AUDIO_DATA.SAMPLING_RATE * cfg.AUDIO_DATA.CLIP_SECS)):
+        return audio_record.start_audio_sample, audio_record.end_audio_sample
+    return start_idx, end_idx
+
+
+def _extract_sound_feature(cfg, spectrogram, audio_record):
     if audio_record.num_audio_samples < int(round(cfg.AUDIO_DATA.SAMPLING_RATE * cfg.AUDIO_DATA.CLIP_SECS)):
-        samples = samples[audio_record.start_audio_sample:audio_record.end_audio_sample]
-        spectrogram = _log_specgram(cfg, samples,
-                                    window_size=cfg.AUDIO_DATA.WINDOW_LENGTH,
-                                    step_size=cfg.AUDIO_DATA.HOP_LENGTH
-                                    )
         num_timesteps_to_pad = cfg.AUDIO_DATA.NUM_FRAMES - spectrogram.shape[0]
         spectrogram = np.pad(spectrogram, ((0, num_timesteps_to_pad), (0, 0)), 'edge')
-    else:
-        samples = samples[start_idx:end_idx]
-        spectrogram = _log_specgram(cfg, samples,
-                                    window_size=cfg.AUDIO_DATA.WINDOW_LENGTH,
-                                    step_size=cfg.AUDIO_DATA.HOP_LENGTH
-                                    )
     return torch.tensor(spectrogram).unsqueeze(0)
@@ -10,7 +10,8 @@ from .build import DATASET_REGISTRY
 
 from .spec_augment import combined_transforms
 from . import utils as utils
-from .audio_loader_aveperception import pack_audio_ave
+from .audio_loader_aveperception import WavReader, pack_audio_ave
+from .spectrogram import SpectrogramEngine, SpectrogramStore
 from .ave_record import AVEAudioRecord
 
 logger = logging.get_logger(__name__)
@@ -23,6 +24,10 @@ class Ave(torch.utils.data.Dataset):
         self.cfg = cfg
 
         self._num_clips = cfg.TEST.NUM_FEATURES
+        self.audio_reader = None
+        self.spec_engine = None
+        if cfg.AUDIO_DATA.SPECTROGRAM_STORE:
+            self.spec_engine = SpectrogramStore(cfg.AUDIO_DATA.SPECTROGRAM_STORE, cfg)
 
         logger.info("Constructing AVE ...")
         self._construct_loader()
@@ -70,9 +75,24 @@ class Ave(torch.utils.data.Dataset):
             index (int): Return the index of the audio.
         """
 
+        if self.audio_reader is None and self.spec_engine is None:
+            self.audio_reader = WavReader(
+                self.cfg.AVE.AUDIO_DATA_DIR,
+                self.cfg.AUDIO_DATA.SAMPLING_RATE,
+                cache_videos=self.cfg.AUDIO_DATA.CACHE_VIDEOS
+            )
+
+            if self.cfg.AUDIO_DATA.VIDEO_SPECTROGRAM:
+                self.spec_engine = SpectrogramEngine(
+                    self.cfg,
+                    self.audio_reader,
+                    chunk_secs=self.cfg.AUDIO_DATA.SPECTROGRAM_CHUNK_SECS,
+                    cache_chunks=self.cfg.AUDIO_DATA.SPECTROGRAM_CACHE_CHUNKS
+                )
+
         temporal_sample_index = self._temporal_idx[index]
 
-        spectrogram = pack_audio_ave(self.cfg, self._audio_records[index], temporal_sample_index)
+        spectrogram = pack_audio_ave(self.cfg, self.audio_reader, self._audio_records[index], temporal_sample_index, self.spec_engine)
 
         # Normalization.
         spectrogram = spectrogram.float()
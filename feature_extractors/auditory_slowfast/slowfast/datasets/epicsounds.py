@@ -13,7 +13,8 @@ from .epicsounds_record import EpicSoundsAudioRecord
 
 from .spec_augment import combined_transforms
 from . import utils as utils
-from .audio_loader_epic import pack_audio_epic
+from .audio_loader_epic import AudioChunkReader, pack_audio_epic
+from .spectrogram import SpectrogramEngine, SpectrogramStore
 
 logger = logging.get_logger(__name__)
 
@@ -27,6 +28,10 @@ class Epicsounds(torch.utils.data.Dataset):
         self._num_clips = cfg.TEST.NUM_FEATURES
 
         self.audio_dataset = None
+        self.audio_reader = None
+        self.spec_engine = None
+        if cfg.AUDIO_DATA.SPECTROGRAM_STORE:
+            self.spec_engine = SpectrogramStore(cfg.AUDIO_DATA.SPECTROGRAM_STORE, cfg)
         self._construct_loader()
 
     def _construct_loader(self):
@@ -70,13 +75,26 @@ class Epicsounds(torch.utils.data.Dataset):
             label (int): the label of the current audio.
             index (int): Return the index of the audio.
         """
-        if self.audio_dataset is None:
+        if self.audio_dataset is None and self.spec_engine is None:
             self.audio_dataset = h5py.File(self.cfg.EPICSOUNDS.AUDIO_DATA_FILE, 'r')
+            self.audio_reader = AudioChunkReader(
+                self.audio_dataset,
+                int(round(self.cfg.EPICSOUNDS.CHUNK_SECS * self.cfg.AUDIO_DATA.SAMPLING_RATE)),
+                cache_chunks=self.cfg.EPICSOUNDS.CACHE_CHUNKS
+            )
+
+            if self.cfg.AUDIO_DATA.VIDEO_SPECTROGRAM:
+                self.spec_engine = SpectrogramEngine(
+                    self.cfg,
+                    self.audio_reader,
+                    chunk_secs=self.cfg.AUDIO_DATA.SPECTROGRAM_CHUNK_SECS,
+                    cache_chunks=self.cfg.AUDIO_DATA.SPECTROGRAM_CACHE_CHUNKS
+                )
 
         temporal_sample_index = self._temporal_idx[index]
 
 
-        spectrogram = pack_audio_epic(self.cfg, self.audio_dataset, self._audio_records[index], temporal_sample_index)
+        spectrogram = pack_audio_epic(self.cfg, self.audio_reader, self._audio_records[index], temporal_sample_index, self.spec_engine)
         # Normalization.
         spectrogram = spectrogram.float()
         if temporal_sample_index != 0:
@@ -10,7 +10,8 @@ from .build import DATASET_REGISTRY
 
 from .spec_augment import combined_transforms
 from . import utils as utils
-from .audio_loader_aveperception import pack_audio_perception
+from .audio_loader_aveperception import WavReader, pack_audio_perception
+from .spectrogram import SpectrogramEngine, SpectrogramStore
 from .perception_record import PerceptionAudioRecord
 
 logger = logging.get_logger(__name__)
@@ -21,6 +22,10 @@ class Perception(torch.utils.data.Dataset):
     def __init__(self, cfg):
         self.cfg = cfg
         self._num_clips = cfg.TEST.NUM_FEATURES
+        self.audio_reader = None
+        self.spec_engine = None
+        if cfg.AUDIO_DATA.SPECTROGRAM_STORE:
+            self.spec_engine = SpectrogramStore(cfg.AUDIO_DATA.SPECTROGRAM_STORE, cfg)
 
         logger.info("Constructing Perception Test")
         self._construct_loader()
@@ -67,9 +72,24 @@ class Perception(torch.utils.data.Dataset):
             label (int): the label of the current audio.
             index (int): Return the index of the audio.
         """
+        if self.audio_reader is None and self.spec_engine is None:
+            self.audio_reader = WavReader(
+                self.cfg.PERCEPTION.AUDIO_DATA_DIR,
+                self.cfg.AUDIO_DATA.SAMPLING_RATE,
+                cache_videos=self.cfg.AUDIO_DATA.CACHE_VIDEOS
+            )
+
+            if self.cfg.AUDIO_DATA.VIDEO_SPECTROGRAM:
+                self.spec_engine = SpectrogramEngine(
+                    self.cfg,
+                    self.audio_reader,
+                    chunk_secs=self.cfg.AUDIO_DATA.SPECTROGRAM_CHUNK_SECS,
+                    cache_chunks=self.cfg.AUDIO_DATA.SPECTROGRAM_CACHE_CHUNKS
+                )
+
         temporal_sample_index = self._temporal_idx[index]
 
-        spectrogram = pack_audio_perception(self.cfg, self._audio_records[index], temporal_sample_index)
+        spectrogram = pack_audio_perception(self.cfg, self.audio_reader, self._audio_records[index], temporal_sample_index, self.spec_engine)
         # Normalization.
         spectrogram = spectrogram.float()
         if temporal_sample_index != 0:
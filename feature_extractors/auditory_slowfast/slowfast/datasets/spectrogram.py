@@ -0,0 +1,181 @@
+import collections
+import functools
+import json
+import numpy as np
+import torch
+import os
+from librosa import filters
+from numpy.lib.format import open_memmap
+
+N_FFT = 2048
+N_MELS = 128
+
+
+@functools.lru_cache(maxsize=None)
+def mel_basis(sampling_rate):
+    return filters.mel(sr=sampling_rate,
+                       n_fft=N_FFT,
+                       n_mels=N_MELS,
+                       htk=True,
+                       norm=None)
+
+
+def clip_frames(start_idx, end_idx, hop_length, num_frames):
+    """First and last frame of a video spectrogram covering samples [start_idx, end_idx)"""
+    first = min(int(round(start_idx / hop_length)), num_frames - 1)
+    last = min(first + (end_idx - start_idx) // hop_length, num_frames - 1)
+    return first, last
+
+
+class SpectrogramEngine(object):
+    """
+    Computes the log-mel spectrogram of whole videos and serves clips as
+    slices of its frames, so the frames shared by overlapping clips are
+    only computed once. Videos are processed in chunks of chunk_secs with a
+    single torch STFT per chunk and the cache_chunks most recently used
+    chunks are kept. Frame f is centred on sample f * hop of the untrimmed
+    audio, and a clip starting at sample s uses the frames from round(s / hop),
+    so clips are aligned to the hop length.
+    Args:
+        cfg (CfgNode): configs, for the AUDIO_DATA options.
+        audio_reader: reader with read(video, start, end) and num_samples(video).
+        chunk_secs (float): length of audio computed at once.
+        cache_chunks (int): number of chunks to keep.
+        eps (float): offset added before the log.
+    """
+    def __init__(self, cfg, audio_reader, chunk_secs=60.0, cache_chunks=4, eps=1e-6):
+        self.audio_reader = audio_reader
+        sampling_rate = cfg.AUDIO_DATA.SAMPLING_RATE
+        self.win_length = int(round(cfg.AUDIO_DATA.WINDOW_LENGTH * sampling_rate / 1e3))
+        self.hop_length = int(round(cfg.AUDIO_DATA.HOP_LENGTH * sampling_rate / 1e3))
+        self.chunk_frames = max(int(round(chunk_secs * sampling_rate / self.hop_length)), 1)
+        self.cache_chunks = max(cache_chunks, 1)
+        self.eps = eps
+
+        self.window = torch.hann_window(self.win_length)
+        self.mel_basis = torch.from_numpy(mel_basis(sampling_rate))
+        self.cache = collections.OrderedDict()
+
+    def num_frames(self, video):
+        # Same as a centred STFT of the whole video
+        return 1 + self.audio_reader.num_samples(video) // self.hop_length
+
+    def _compute_chunk(self, video, chunk_idx):
+        first = chunk_idx * self.chunk_frames
+        num_frames = min(self.chunk_frames, self.num_frames(video) - first)
+
+        # Samples under the frames, zero outside of the video as in a
+        # centred STFT with constant padding
+        start = first * self.hop_length - N_FFT // 2
+        length = (num_frames - 1) * self.hop_length + N_FFT
+        samples = self.audio_reader.read(video, max(start, 0), start + length)
+        left = max(-start, 0)
+        samples = np.pad(samples, (left, length - left - samples.shape[0]))
+
+        spec = torch.stft(torch.from_numpy(samples).float(),
+                          n_fft=N_FFT,
+                          hop_length=self.hop_length,
+                          win_length=self.win_length,
+                          window=self.window,
+                          center=False,
+                          return_complex=True)
+        mel_spec = torch.matmul(self.mel_basis, spec.abs())
+        return torch.log(mel_spec + self.eps).T.numpy()
+
+    def chunks(self, video):
+        """Yields the first frame and the frames of each chunk of video"""
+        for c in range((self.num_frames(video) + self.chunk_frames - 1) // self.chunk_frames):
+            yield c * self.chunk_frames, self._compute_chunk(video, c)
+
+    def _chunk(self, video, chunk_idx):
+        key = (video, chunk_idx)
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        chunk = self._compute_chunk(video, chunk_idx)
+        self.cache[key] = chunk
+        if len(self.cache) > self.cache_chunks:
+            self.cache.popitem(last=False)
+        return chunk
+
+    def clip(self, video, start_idx, end_idx):
+        """Log-mel frames of samples [start_idx, end_idx), `num frames` x `num frequencies`"""
+        first, last = clip_frames(start_idx, end_idx, self.hop_length, self.num_frames(video))
+        chunks = [
+            self._chunk(video, c)
+            for c in range(first // self.chunk_frames, last // self.chunk_frames + 1)
+        ]
+        frames = chunks[0] if len(chunks) == 1 else np.concatenate(chunks)
+        offset = (first // self.chunk_frames) * self.chunk_frames
+        return frames[first - offset:last + 1 - offset]
+
+
+class SpectrogramStore(object):
+    """
+    Serves clips from video spectrograms precomputed by
+    tools/build_spectrogram_store.py, without reading any audio. The store
+    is a folder with log_mel.npy, the float16 frames of all videos one after
+    the other, and index.json with the settings and the offset and number
+    of frames of each video. log_mel.npy is memory-mapped on first use so
+    every dataloader worker maps it itself.
+    Args:
+        path (str): folder of the store.
+        cfg (CfgNode): configs, the AUDIO_DATA options must match the store.
+    """
+    def __init__(self, path, cfg):
+        self.path = path
+        with open(os.path.join(path, "index.json"), 'r') as f:
+            index = json.load(f)
+        settings = {
+            "sampling_rate": cfg.AUDIO_DATA.SAMPLING_RATE,
+            "window_length": cfg.AUDIO_DATA.WINDOW_LENGTH,
+            "hop_length": cfg.AUDIO_DATA.HOP_LENGTH,
+            "n_fft": N_FFT,
+            "n_mels": N_MELS
+        }
+        for k, v in settings.items():
+            assert index[k] == v, \
+                "Spectrogram store {} has {} {}, expected {}".format(path, k, index[k], v)
+
+        self.hop_length = int(round(cfg.AUDIO_DATA.HOP_LENGTH * cfg.AUDIO_DATA.SAMPLING_RATE / 1e3))
+        self.videos = index["videos"]
+        self.log_mel = None
+
+    def clip(self, video, start_idx, end_idx):
+        """Log-mel frames of samples [start_idx, end_idx), `num frames` x `num frequencies`"""
+        if self.log_mel is None:
+            self.log_mel = np.load(os.path.join(self.path, "log_mel.npy"), mmap_mode='r')
+        offset, num_frames = self.videos[video]
+        first, last = clip_frames(start_idx, end_idx, self.hop_length, num_frames)
+        return self.log_mel[offset + first:offset + last + 1].astype(np.float32)
+
+
+def build_store(cfg, audio_reader, videos, path):
+    """Compute the spectrograms of videos and save them as a SpectrogramStore in path"""
+    engine = SpectrogramEngine(cfg, audio_reader, chunk_secs=cfg.AUDIO_DATA.SPECTROGRAM_CHUNK_SECS)
+    index = {
+        "sampling_rate": cfg.AUDIO_DATA.SAMPLING_RATE,
+        "window_length": cfg.AUDIO_DATA.WINDOW_LENGTH,
+        "hop_length": cfg.AUDIO_DATA.HOP_LENGTH,
+        "n_fft": N_FFT,
+        "n_mels": N_MELS,
+        "videos": {}
+    }
+    offset = 0
+    for video in videos:
+        num_frames = engine.num_frames(video)
+        index["videos"][video] = [offset, num_frames]
+        offset += num_frames
+
+    os.makedirs(path, exist_ok=True)
+    log_mel = open_memmap(os.path.join(path, "log_mel.npy"), mode='w+', dtype=np.float16, shape=(offset, N_MELS))
+    for video in videos:
+        offset = index["videos"][video][0]
+        for first, frames in engine.chunks(video):
+            log_mel[offset + first:offset + first + frames.shape[0]] = frames
+    log_mel.flush()
+    del log_mel
+
+    with open(os.path.join(path, "index.json"), 'w') as f:
+        json.dump(index, f)
+    return index
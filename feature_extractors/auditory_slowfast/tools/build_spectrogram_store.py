@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+
+"""Precompute the log-mel spectrograms of the videos of TEST_LIST for AUDIO_DATA.SPECTROGRAM_STORE."""
+
+import h5py
+import pandas as pd
+
+import slowfast.utils.logging as logging
+from slowfast.datasets.audio_loader_aveperception import WavReader
+from slowfast.datasets.audio_loader_epic import AudioChunkReader
+from slowfast.datasets.spectrogram import build_store
+from slowfast.utils.parser import load_config, parse_args
+
+logger = logging.get_logger(__name__)
+
+
+def build_reader(cfg):
+    """Audio reader and annotations of cfg.TEST.DATASET"""
+    dataset = cfg.TEST.DATASET.lower()
+    if dataset == "epicsounds":
+        audio_dataset = h5py.File(cfg.EPICSOUNDS.AUDIO_DATA_FILE, 'r')
+        # The spectrograms are computed from long contiguous reads, caching does not help
+        return AudioChunkReader(audio_dataset, 0), cfg.EPICSOUNDS.TEST_LIST
+    elif dataset == "ave":
+        return WavReader(cfg.AVE.AUDIO_DATA_DIR, cfg.AUDIO_DATA.SAMPLING_RATE, cache_videos=1), cfg.AVE.TEST_LIST
+    elif dataset == "perception":
+        return WavReader(cfg.PERCEPTION.AUDIO_DATA_DIR, cfg.AUDIO_DATA.SAMPLING_RATE, cache_videos=1), cfg.PERCEPTION.TEST_LIST
+    raise NotImplementedError("Dataset {} is not supported".format(cfg.TEST.DATASET))
+
+
+def main():
+    args = parse_args()
+    cfg = load_config(args)
+    logging.setup_logging(cfg.OUTPUT_DIR)
+    assert cfg.AUDIO_DATA.SPECTROGRAM_STORE, "Set AUDIO_DATA.SPECTROGRAM_STORE to the folder to save the store to"
+
+    audio_reader, test_list = build_reader(cfg)
+    videos = list(pd.read_pickle(test_list)['video_id'].unique())
+    logger.info("Computing the spectrograms of {} videos from {}".format(len(videos), test_list))
+
+    index = build_store(cfg, audio_reader, videos, cfg.AUDIO_DATA.SPECTROGRAM_STORE)
+    num_frames = sum(v[1] for v in index["videos"].values())
+    logger.info("Saved {} frames to {}".format(num_frames, cfg.AUDIO_DATA.SPECTROGRAM_STORE))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+import argparse
+import h5py
+import tqdm
+
+
+def rechunk(input_file, output_file, sampling_rate, chunk_secs, compression=None):
+    chunk_size = max(1, int(round(sampling_rate * chunk_secs)))
+    with h5py.File(input_file, 'r') as f_in, h5py.File(output_file, 'w') as f_out:
+        for video in tqdm.tqdm(list(f_in.keys())):
+            d_in = f_in[video]
+            # h5py needs positive chunk dimensions, so empty waveforms are not chunked
+            empty = d_in.shape[0] == 0
+            d_out = f_out.create_dataset(
+                            video,
+                            shape=d_in.shape,
+                            dtype=d_in.dtype,
+                            chunks=None if empty else (min(chunk_size, d_in.shape[0]),) + d_in.shape[1:],
+                            compression=None if empty else compression
+                        )
+            # Copy a few chunks at a time so long videos are never fully loaded
+            step = chunk_size * 64
+            for start in range(0, d_in.shape[0], step):
+                d_out[start:start + step] = d_in[start:start + step]
+            for k, v in d_in.attrs.items():
+                d_out.attrs[k] = v
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+                description='Rewrite the EPIC-SOUNDS HDF5 file with chunks aligned to EPICSOUNDS.CHUNK_SECS'
+            )
+    parser.add_argument('input_file', help='HDF5 file of untrimmed audio waveforms')
+    parser.add_argument('output_file', help='Path to save the chunked HDF5 file to')
+    parser.add_argument('--sampling_rate', default=24000, type=int, help='Sampling rate of the audio')
+    parser.add_argument('--chunk_secs', default=10.0, type=float, help='Length of each chunk in seconds')
+    parser.add_argument('--compression', default=None, choices=['gzip', 'lzf'], help='Optional compression of the chunks')
+
+    args = parser.parse_args()
+    rechunk(args.input_file, args.output_file, args.sampling_rate, args.chunk_secs, args.compression)
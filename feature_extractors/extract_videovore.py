@@ -0,0 +1,178 @@
+"""Extract the Omnivore and VideoMAE features of EPIC-KITCHENS in one pass as 2048-d videovore features"""
+import argparse
+import os
+import random
+import sys
+
+import cv2
+import numpy as np
+import pandas as pd
+import torch
+from torch.utils.data import Dataset
+
+# The two extractors are separate projects, import them from their folders
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'omnivore'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'VideoMAE'))
+
+from omnivore.config.defaults import get_cfg
+from omnivore.datasets import build_dataset
+from omnivore.datasets.epickitchens_record import EpicKitchensVideoRecord
+from omnivore.datasets.frame_loader import count_video_frames, get_frame_idx, get_video_dir, load_frames
+from omnivore.models import build_model
+
+import feature_extraction as videomae
+from frame_io.frame_cache import VideoGroupedBatchSampler
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        'Extract Omnivore and VideoMAE features from the same decoded frames')
+
+    parser.add_argument(
+        '--cfg',
+        dest='cfg_file',
+        default='omnivore/configs/EPIC-KITCHENS/OMNIVORE_feature.yaml',
+        type=str,
+        help='Omnivore config file')
+    parser.add_argument(
+        '--videomae_model',
+        default='vit_large_patch16_224',
+        type=str,
+        help='Name of the VideoMAE model')
+    parser.add_argument(
+        '--videomae_ckpt_path',
+        type=str,
+        help='VideoMAE checkpoint')
+    parser.add_argument(
+        'opts',
+        default=None,
+        nargs=argparse.REMAINDER,
+        help='Omnivore config options, see omnivore/omnivore/config/defaults.py')
+
+    return parser.parse_args()
+
+
+def load_config(args):
+    cfg = get_cfg()
+    cfg.merge_from_file(args.cfg_file)
+    if args.opts is not None:
+        cfg.merge_from_list(args.opts)
+
+    assert cfg.TEST.DATASET == 'epickitchens', "Videovore features are only extracted for EPIC-KITCHENS"
+    # Both backbones give [N, num_aug, 1024] features, the first set unaugmented
+    assert cfg.TEST.NUM_SPATIAL_CROPS == 1, "Set TEST.NUM_SPATIAL_CROPS 1 for videovore features"
+    # Each process extracts its own videos, see extract_features
+    cfg.NUM_GPUS = 1
+    os.makedirs(cfg.OUTPUT_DIR, exist_ok=True)
+    return cfg
+
+
+class VideovoreDataset(Dataset):
+    """
+    The clips of a video for both backbones. The frames Omnivore and VideoMAE
+    sample from a clip are decoded once, through the frame cache of the
+    Omnivore dataset, and each backbone makes its num_aug views from them.
+    Args:
+        omnivore_dataset (Epickitchens): the Omnivore dataset, for its views,
+            frame index and frame cache.
+        video_records (list): EpicKitchensVideoRecord of the clips of the video.
+    """
+    def __init__(self, omnivore_dataset, video_records):
+        self.omnivore_dataset = omnivore_dataset
+        self.video_records = video_records
+        self.cfg = omnivore_dataset.cfg
+        self.num_aug = self.cfg.TEST.NUM_FEATURES
+        self.videomae_transform = videomae.build_transform()
+
+    def __getitem__(self, index):
+        record = self.video_records[index]
+        path_to_video = get_video_dir(self.cfg, record, 'epickitchens')
+        num_frames_video = count_video_frames(path_to_video, self.omnivore_dataset.frame_index)
+        omnivore_idxs = get_frame_idx(self.cfg, record, num_frames_video).tolist()
+        videomae_idxs = videomae.sample_frame_idxs(record.num_frames, record.start_frame)
+
+        frame_idxs = sorted(set(omnivore_idxs) | set(videomae_idxs))
+        frames = load_frames(self.cfg, path_to_video, frame_idxs, self.omnivore_dataset.frame_cache)
+        frames = dict(zip(frame_idxs, frames))
+
+        # Omnivore takes BGR frames and VideoMAE RGB ones
+        omnivore_views = self.omnivore_dataset.make_views(
+            torch.as_tensor(np.stack([frames[idx] for idx in omnivore_idxs]))
+        )
+        videomae_views = videomae.make_views(
+            np.array([cv2.cvtColor(frames[idx], cv2.COLOR_BGR2RGB) for idx in videomae_idxs]),
+            self.videomae_transform,
+            self.num_aug
+        )
+        return omnivore_views, videomae_views, index
+
+    def __len__(self):
+        return len(self.video_records)
+
+
+def extract_features(args, cfg):
+    # Set random seeds
+    random.seed(cfg.RNG_SEED)
+    np.random.seed(cfg.RNG_SEED)
+    rng_generator = torch.manual_seed(cfg.RNG_SEED)
+
+    # Clips of each video, in time order as SlidingWindowDataset reads them
+    df_vid = pd.read_pickle(cfg.EPICKITCHENS.TEST_LIST)
+    df_vid = df_vid.sort_values(['video_id', 'start_frame'], kind='stable')
+    all_vids = []
+    for video_id, df_vid_group in df_vid.groupby('video_id', sort=True):
+        url = os.path.join(cfg.OUTPUT_DIR, video_id + '.npy')
+        if not os.path.exists(url):
+            all_vids.append((video_id, [EpicKitchensVideoRecord(tup) for tup in df_vid_group.iterrows()]))
+
+    if 'SLURM_LOCALID' in os.environ:
+        rank = int(os.environ['SLURM_LOCALID'])
+        world_size = int(os.environ['SLURM_NTASKS'])
+    else:
+        rank = 0
+        world_size = 1
+
+    torch.cuda.set_device(rank)
+    rank_vids = [vid for i, vid in enumerate(all_vids) if (i % world_size) == rank]
+
+    omnivore_model = build_model(cfg)
+    omnivore_model.eval()
+    videomae_model = videomae.load_model(args.videomae_model, 'ek100', args.videomae_ckpt_path)
+
+    omnivore_dataset = build_dataset(cfg.TEST.DATASET, cfg, 'test')
+    num_aug = cfg.TEST.NUM_FEATURES
+    # TEST.BATCH_SIZE counts views as in the Omnivore loader
+    batch_size = max(cfg.TEST.BATCH_SIZE // num_aug, 1)
+
+    for video_id, video_records in rank_vids:
+        url = os.path.join(cfg.OUTPUT_DIR, video_id + '.npy')
+
+        dataset = VideovoreDataset(omnivore_dataset, video_records)
+        data_loader = torch.utils.data.DataLoader(dataset,
+                                                batch_sampler=VideoGroupedBatchSampler(
+                                                    range(len(dataset)), batch_size, cfg.DATA_LOADER.NUM_WORKERS),
+                                                num_workers=cfg.DATA_LOADER.NUM_WORKERS,
+                                                pin_memory=cfg.DATA_LOADER.PIN_MEMORY,
+                                                generator=rng_generator,
+                                            )
+        feature_list = [None] * len(dataset)
+        for omnivore_views, videomae_views, index in data_loader:
+            with torch.no_grad():
+                omnivore_feature = omnivore_model(omnivore_views.cuda().flatten(0, 1))
+                videomae_feature = videomae_model.forward_features(videomae_views.cuda().flatten(0, 1))
+            # Omnivore channels first, as merge_features.py concatenates them
+            feature = torch.cat([
+                omnivore_feature.view(len(index), num_aug, -1),
+                videomae_feature.view(len(index), num_aug, -1)
+            ], dim=-1)
+            for idx, feat in zip(index.tolist(), feature.cpu().numpy()):
+                feature_list[idx] = feat
+
+        # [N, num_aug, 2048]
+        np.save(url, np.stack(feature_list))
+        print(f'Save feature on {url}')
+
+
+if __name__ == '__main__':
+    args = get_args()
+    extract_features(args, load_config(args))
@@ -0,0 +1,4 @@
+"""
+Frame reading shared by the Omnivore and VideoMAE extractors. Their entry
+points add feature_extractors/ to the python path to import it.
+"""
@@ -0,0 +1,115 @@
+"""
+Packed frame archives: all the JPEG frames of a video in one file.
+
+A video folder <video_dir> with frame_0000000001.jpg, ... is packed into
+<video_dir>.frames, the JPEG bytes one after the other, and
+<video_dir>.index.npy, an int64 array with the frame number, offset and
+length of each frame. Reading a frame is then a slice of the memory-mapped
+archive instead of opening one file per frame. Videos without an archive
+are read from their folder as before.
+"""
+
+import argparse
+import collections
+import re
+import cv2
+import numpy as np
+import os
+
+DATA_EXT = ".frames"
+INDEX_EXT = ".index.npy"
+
+_FRAME_NUMBER = re.compile(r"(\d+)\.jpg$")
+
+# Archives opened by this process, the dataloader workers each open their own
+_OPEN_ARCHIVES = collections.OrderedDict()
+_MAX_OPEN_ARCHIVES = 32
+
+
+class FrameArchive(object):
+    def __init__(self, video_dir):
+        self.path = video_dir + DATA_EXT
+        index = np.load(video_dir + INDEX_EXT)
+        self.offsets = {int(n): (int(o), int(l)) for n, o, l in index}
+        self.data = np.memmap(self.path, dtype=np.uint8, mode='r') if index.shape[0] > 0 else None
+
+    @property
+    def num_frames(self):
+        return len(self.offsets)
+
+    def read(self, frame_number):
+        """Encoded bytes of a frame, as a view of the archive"""
+        if frame_number not in self.offsets:
+            raise FileNotFoundError("Frame {} not in {}".format(frame_number, self.path))
+        offset, length = self.offsets[frame_number]
+        return self.data[offset:offset + length]
+
+    def decode(self, frame_number, flags=cv2.IMREAD_COLOR):
+        img = cv2.imdecode(self.read(frame_number), flags)
+        if img is None:
+            raise Exception("Failed to decode frame {} of {}".format(frame_number, self.path))
+        return img
+
+
+def has_archive(video_dir):
+    return os.path.exists(video_dir + INDEX_EXT)
+
+
+def open_archive(video_dir):
+    """The archive of video_dir, or None if the video has not been packed"""
+    if video_dir in _OPEN_ARCHIVES:
+        _OPEN_ARCHIVES.move_to_end(video_dir)
+        return _OPEN_ARCHIVES[video_dir]
+    if not has_archive(video_dir):
+        return None
+    archive = FrameArchive(video_dir)
+    _OPEN_ARCHIVES[video_dir] = archive
+    if len(_OPEN_ARCHIVES) > _MAX_OPEN_ARCHIVES:
+        _OPEN_ARCHIVES.popitem(last=False)
+    return archive
+
+
+def pack_video(video_dir):
+    """Pack the jpg frames of video_dir into an archive next to it"""
+    frames = []
+    with os.scandir(video_dir) as entries:
+        for e in entries:
+            match = _FRAME_NUMBER.search(e.name)
+            if match is not None and not e.name.startswith('.'):
+                frames.append((int(match.group(1)), e.path))
+    frames.sort()
+
+    index = np.zeros((len(frames), 3), dtype=np.int64)
+    offset = 0
+    # Write the index last, so an interrupted pack is not used
+    with open(video_dir + DATA_EXT, 'wb') as f:
+        for i, (frame_number, path) in enumerate(frames):
+            with open(path, 'rb') as fp:
+                img_bytes = fp.read()
+            f.write(img_bytes)
+            index[i] = (frame_number, offset, len(img_bytes))
+            offset += len(img_bytes)
+    np.save(video_dir + INDEX_EXT, index)
+    return index.shape[0]
+
+
+def find_video_dirs(root):
+    """Folders under root that directly contain jpg frames"""
+    video_dirs = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        if any(f.endswith('.jpg') for f in filenames):
+            video_dirs.append(dirpath)
+    return sorted(video_dirs)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pack the extracted frames of each video into one archive")
+    parser.add_argument("root", type=str, help="Folder with the frame folders of the videos, searched recursively")
+    parser.add_argument("--overwrite", action='store_true', help="Pack videos that already have an archive again")
+    args = parser.parse_args()
+
+    for video_dir in find_video_dirs(args.root):
+        if has_archive(video_dir) and not args.overwrite:
+            continue
+        num_frames = pack_video(video_dir)
+        print("Packed {} frames of {}".format(num_frames, video_dir))
@@ -0,0 +1,83 @@
+import collections
+import numpy as np
+from torch.utils.data import Sampler
+
+
+class FrameCache(object):
+    """
+    Least recently used cache of decoded frames, keyed by (video, frame index).
+    Neighbouring clips of a video share most of their frames, so with the
+    clips of a video going to the same dataloader worker most frames are
+    only decoded once. Each worker has its own cache.
+    Args:
+        max_bytes (int): budget for the decoded frames kept in memory.
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.num_bytes = 0
+        self.frames = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def put(self, key, frame):
+        if frame.nbytes > self.max_bytes:
+            return
+        if key in self.frames:
+            self.num_bytes -= self.frames.pop(key).nbytes
+        self.frames[key] = frame
+        self.num_bytes += frame.nbytes
+        while self.num_bytes > self.max_bytes:
+            self.num_bytes -= self.frames.popitem(last=False)[1].nbytes
+
+    def load(self, keys, load_fn):
+        """
+        The frames of keys, decoding the missing ones with load_fn which
+        takes a list of keys and returns a list of frames.
+        """
+        missing = []
+        for key in keys:
+            if key in self.frames:
+                self.frames.move_to_end(key)
+            elif key not in missing:
+                missing.append(key)
+        self.hits += len(keys) - len(missing)
+        self.misses += len(missing)
+
+        loaded = dict(zip(missing, load_fn(missing))) if len(missing) > 0 else {}
+        frames = [loaded[key] if key in loaded else self.frames[key] for key in keys]
+        for key, frame in loaded.items():
+            self.put(key, frame)
+        return frames
+
+
+class VideoGroupedBatchSampler(Sampler):
+    """
+    Splits the batches of indices into num_workers contiguous runs and
+    orders them so the dataloader, which hands batches to its workers in
+    turn, gives each run to a single worker. The clips of a video are
+    consecutive in the datasets, so each worker loads neighbouring clips one
+    after the other and reuses their decoded frames. The batches are no
+    longer in dataset order.
+    Args:
+        indices (list): dataset indices to sample, in dataset order.
+        batch_size (int): batch size.
+        num_workers (int): number of dataloader workers.
+    """
+    def __init__(self, indices, batch_size, num_workers):
+        indices = list(indices)
+        batches = [indices[i:i + batch_size] for i in range(0, len(indices), batch_size)]
+        # np.array_split puts the longer runs first, so the last round still
+        # goes to the right workers
+        runs = np.array_split(np.arange(len(batches)), max(num_workers, 1))
+        self.batches = [
+            batches[run[i]]
+            for i in range(len(runs[0]))
+            for run in runs
+            if i < len(run)
+        ]
+
+    def __iter__(self):
+        return iter(self.batches)
+
+    def __len__(self):
+        return len(self.batches)
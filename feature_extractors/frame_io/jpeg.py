@@ -0,0 +1,51 @@
+"""Decoding JPEG frames at a reduced scale, straight from their bytes"""
+import cv2
+
+# Scales libjpeg can decode at directly, largest reduction first
+REDUCED_DECODE_FLAGS = [
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+]
+
+# JPEG start of frame markers, which hold the image size
+_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def jpeg_size(img_bytes):
+    """
+    Height and width of a JPEG from its header, without decoding it.
+    Returns None if img_bytes is not a JPEG.
+    """
+    img_bytes = memoryview(img_bytes).cast('B')
+    if len(img_bytes) < 4 or img_bytes[0] != 0xFF or img_bytes[1] != 0xD8:
+        return None
+    i = 2
+    while i + 9 < len(img_bytes):
+        if img_bytes[i] != 0xFF:
+            return None
+        marker = img_bytes[i + 1]
+        if marker == 0xFF:
+            # Fill byte
+            i += 1
+            continue
+        if marker in _SOF_MARKERS:
+            height = (img_bytes[i + 5] << 8) | img_bytes[i + 6]
+            width = (img_bytes[i + 7] << 8) | img_bytes[i + 8]
+            return height, width
+        i += 2 + ((img_bytes[i + 2] << 8) | img_bytes[i + 3])
+    return None
+
+
+def decode_flag(img_bytes, min_size=0):
+    """
+    cv2.imdecode flag for the largest reduction of a JPEG whose short side
+    is still at least min_size, or a full resolution decode.
+    """
+    if min_size > 0:
+        size = jpeg_size(img_bytes)
+        if size is not None:
+            for factor, flag in REDUCED_DECODE_FLAGS:
+                if min(size) // factor >= min_size:
+                    return flag
+    return cv2.IMREAD_COLOR
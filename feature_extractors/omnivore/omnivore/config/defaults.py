@@ -217,6 +217,14 @@ _C.DATA.FRAME_SAMPLING = 'like slowfast'
 
 _C.DATA.USE_RAND_AUGMENT = False
 
+# Json file caching the number of frames of each video folder, shared by the
+# splits and refreshed when a folder changes. Defaults to OUTPUT_DIR/frame_index.json.
+_C.DATA.FRAME_INDEX_FILE = ""
+
+# Decode JPEG frames at 1/2, 1/4 or 1/8 scale when their short side stays at
+# least TEST_CROP_SIZE. Faster, but the features differ slightly.
+_C.DATA.REDUCED_DECODE = False
+
 # ---------------------------------------------------------------------------- #
 # Misc options
 # ---------------------------------------------------------------------------- #
@@ -282,6 +290,13 @@ _C.DATA_LOADER.PIN_MEMORY = True
 # Enable multi thread decoding.
 _C.DATA_LOADER.ENABLE_MULTI_THREAD_DECODE = False
 
+# Memory in MB for decoded frames each worker keeps, 0 disables the cache.
+_C.DATA_LOADER.FRAME_CACHE_MB = 256
+
+# Give each worker contiguous batches, so that the clips of a video share a
+# worker and its frame cache.
+_C.DATA_LOADER.GROUP_BY_VIDEO = True
+
 
 # -----------------------------------------------------------------------------
 # EPIC-KITCHENS Dataset options
@@ -15,7 +15,9 @@ from .ave_record import AVEVideoRecord
 from . import autoaugment as autoaugment
 from . import transform as transform
 from . import utils as utils
-from .frame_loader import pack_frames_to_video_clip
+from frame_io.frame_cache import FrameCache
+from .frame_index import build_frame_index
+from .frame_loader import get_video_dir, pack_frames_to_video_clip
 
 logger = logging.get_logger(__name__)
 
@@ -45,16 +47,10 @@ class Ave(torch.utils.data.Dataset):
             )
 
         self._video_records = []
-        self._spatial_temporal_idx = []
 
         for file in path_annotations_pickle:
             for ii, tup in enumerate(pd.read_pickle(file).iterrows()):
-                for idx in range(self._num_clips):
-                    record = AVEVideoRecord(tup)
-                    
-                    # For running on whole dataset
-                    self._video_records.append(record)
-                    self._spatial_temporal_idx.append(idx)
+                self._video_records.append(AVEVideoRecord(tup))
                 
         assert (
                 len(self._video_records) > 0
@@ -67,6 +63,16 @@ class Ave(torch.utils.data.Dataset):
             )
         )
 
+        # Count the frames of each video once instead of for every clip
+        self.frame_index = build_frame_index(
+            self.cfg,
+            [get_video_dir(self.cfg, record, self.cfg.TEST.DATASET) for record in self._video_records]
+        )
+        # Decoded frames, shared by the overlapping clips a worker loads
+        self.frame_cache = None
+        if self.cfg.DATA_LOADER.FRAME_CACHE_MB > 0:
+            self.frame_cache = FrameCache(self.cfg.DATA_LOADER.FRAME_CACHE_MB * 1024 ** 2)
+
     def __getitem__(self, index):
         """
         Given the video index, return the list of frames, label, and video
@@ -75,25 +81,42 @@ class Ave(torch.utils.data.Dataset):
         Args:
             index (int): the video index provided by the pytorch sampler.
         Returns:
-            frames (tensor): the frames of sampled from the video. The dimension
-                is `channel` x `num frames` x `height` x `width`.
+            frames (tensor): the views of the clip, NUM_FEATURES x
+                NUM_SPATIAL_CROPS of them. The dimension is `num views` x
+                `channel` x `num frames` x `height` x `width`.
             label (int): the label of the current video.
             index (int): if the video provided by pytorch sampler can be
                 decoded, then return the index of the video. If not, return the
                 index of the video replacement that can be decoded.
         """
+        frames = pack_frames_to_video_clip(self.cfg, self._video_records[index], self.cfg.TEST.DATASET, self.frame_index, self.frame_cache)
+        frames = self.make_views(frames)
+        label = self._video_records[index].label
+        metadata = self._video_records[index].metadata
+        if frames.shape[-1] == 49:
+            print(self._video_records.untrimmed_video_name)
+
+        return frames, label, index, metadata
+
+
+    def __len__(self):
+        return len(self._video_records)
+
+    @property
+    def num_views(self):
+        """Number of views stacked in each item"""
+        return self._num_clips
+
+    def make_views(self, frames):
+        """
+        All the views of a clip from its T H W C BGR uint8 frames, stacked as
+        `num views` x `channel` x `num frames` x `height` x `width`.
+        """
         if self.mode in ["test"]:
-            temporal_sample_index = (
-                self._spatial_temporal_idx[index]
-                // self.cfg.TEST.NUM_SPATIAL_CROPS
-            )
             if self.cfg.TEST.NUM_SPATIAL_CROPS == 3:
-                spatial_sample_index = (
-                    self._spatial_temporal_idx[index]
-                    % self.cfg.TEST.NUM_SPATIAL_CROPS
-                )
+                spatial_sample_indices = [0, 1, 2]
             elif self.cfg.TEST.NUM_SPATIAL_CROPS == 1:
-                spatial_sample_index = 1
+                spatial_sample_indices = [1]
             min_scale, max_scale, crop_size = [self.cfg.DATA.TEST_CROP_SIZE] * 3
             assert len({min_scale, max_scale, crop_size}) == 1
             # The testing is deterministic and no jitter should be performed.
@@ -103,9 +126,33 @@ class Ave(torch.utils.data.Dataset):
                 "Does not support {} mode".format(self.mode)
             )
 
-        frames = pack_frames_to_video_clip(self.cfg, self._video_records[index], self.cfg.TEST.DATASET)
-
-        if self.cfg.DATA.USE_RAND_AUGMENT and (temporal_sample_index != 0):
+        # The views share the decoded frames and the unaugmented clip, in the
+        # order temporal_sample_index x spatial_sample_index
+        views = []
+        unaugmented = None
+        for temporal_sample_index in range(self.cfg.TEST.NUM_FEATURES):
+            if self.cfg.DATA.USE_RAND_AUGMENT and (temporal_sample_index != 0):
+                clip = self._prepare_clip(frames, True, min_scale, crop_size)
+            else:
+                if unaugmented is None:
+                    unaugmented = self._prepare_clip(frames, False, min_scale, crop_size)
+                clip = unaugmented
+            for spatial_sample_index in spatial_sample_indices:
+                views.append(self.spatial_sampling(
+                    clip,
+                    spatial_idx=spatial_sample_index,
+                    min_scale=min_scale,
+                    max_scale=max_scale,
+                    crop_size=crop_size,
+                ))
+        return torch.stack(views)
+
+    def _prepare_clip(self, frames, augment, min_scale, crop_size):
+        """
+        Optionally RandAugment the T H W C BGR uint8 frames, then resize,
+        normalize and permute them to C T H W.
+        """
+        if augment:
             # Transform to PIL Image
             frames = [transforms.ToPILImage()(frame.squeeze().numpy()) for frame in frames]
 
@@ -123,13 +170,12 @@ class Ave(torch.utils.data.Dataset):
             # To Tensor: T H W C
             frames = [torch.tensor(np.array(frame)) for frame in frames]
             frames = torch.stack(frames)
-            
+
         # For omnivore style frame transform
         if frames.shape[1] < frames.shape[2]:
             scale = min_scale / frames.shape[1]
         else:
             scale = min_scale / frames.shape[2]
-
         frames = [
                 cv2.resize(
                     img_array.numpy(),
@@ -149,24 +195,7 @@ class Ave(torch.utils.data.Dataset):
         frames = frames - torch.tensor(self.cfg.DATA.MEAN)
         frames = frames / torch.tensor(self.cfg.DATA.STD)
         # T H W C -> C T H W.
-        frames = frames.permute(3, 0, 1, 2)
-        frames = self.spatial_sampling(
-            frames,
-            spatial_idx=spatial_sample_index,
-            min_scale=min_scale,
-            max_scale=max_scale,
-            crop_size=crop_size,
-        )
-        label = self._video_records[index].label
-        metadata = self._video_records[index].metadata
-        if frames.shape[-1] == 49:
-            print(self._video_records.untrimmed_video_name)
-
-        return frames, label, index, metadata
-
-
-    def __len__(self):
-        return len(self._video_records)
+        return frames.permute(3, 0, 1, 2)
 
     def spatial_sampling(
             self,
@@ -0,0 +1,94 @@
+import json
+import numpy as np
+import os
+
+import omnivore.utils.logging as logging
+
+from frame_io import frame_archive
+
+logger = logging.get_logger(__name__)
+
+
+def count_frames(path_to_video):
+    """Number of frames in a folder, the same files as glob('*.jpg'), or in its archive"""
+    if frame_archive.has_archive(path_to_video):
+        return np.load(path_to_video + frame_archive.INDEX_EXT, mmap_mode='r').shape[0]
+    with os.scandir(path_to_video) as entries:
+        return sum(1 for e in entries if e.name.endswith('.jpg') and not e.name.startswith('.'))
+
+
+class FrameIndex(object):
+    """
+    Number of extracted frames of each video folder, so that clips do not
+    list the folder of their video. The index is built in the main process
+    before the dataloader workers are started and saved to index_file.
+    Folders are only listed again when they are new or their modification
+    time changed since the index was saved. Packed videos are counted from
+    the index of their archive.
+    Args:
+        video_dirs (list): frame folders of the videos of the dataset.
+        index_file (str): json file the index is loaded from and saved to.
+    """
+    def __init__(self, video_dirs, index_file):
+        self.index_file = index_file
+        self.videos = {}
+
+        saved = {}
+        if os.path.exists(index_file):
+            with open(index_file, 'r') as f:
+                saved = json.load(f)
+
+        num_listed = 0
+        missing = []
+        for path_to_video in sorted(set(video_dirs)):
+            try:
+                if frame_archive.has_archive(path_to_video):
+                    mtime = os.stat(path_to_video + frame_archive.INDEX_EXT).st_mtime_ns
+                else:
+                    mtime = os.stat(path_to_video).st_mtime_ns
+            except FileNotFoundError:
+                missing.append(path_to_video)
+                self.videos[path_to_video] = {"mtime": None, "num_frames": 0}
+                continue
+            entry = saved.get(path_to_video)
+            if entry is None or entry["mtime"] != mtime:
+                entry = {"mtime": mtime, "num_frames": count_frames(path_to_video)}
+                num_listed += 1
+            self.videos[path_to_video] = entry
+
+        if len(missing) > 0:
+            logger.warning("{} video folders do not exist, e.g. {}".format(len(missing), missing[0]))
+        logger.info(
+            "Frame index of {} videos, {} listed and {} loaded from {}".format(
+                len(self.videos), num_listed, len(self.videos) - num_listed - len(missing), index_file
+            )
+        )
+        if num_listed > 0:
+            self.save()
+
+    def save(self):
+        saved = {}
+        if os.path.exists(self.index_file):
+            with open(self.index_file, 'r') as f:
+                saved = json.load(f)
+        # Keep the videos of other splits sharing the file
+        saved.update({k: v for k, v in self.videos.items() if v["mtime"] is not None})
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.index_file)), exist_ok=True)
+        tmp_file = "{}.{}.tmp".format(self.index_file, os.getpid())
+        with open(tmp_file, 'w') as f:
+            json.dump(saved, f)
+        os.replace(tmp_file, self.index_file)
+
+    def exists(self, path_to_video):
+        return self.videos[path_to_video]["mtime"] is not None
+
+    def num_frames(self, path_to_video):
+        return self.videos[path_to_video]["num_frames"]
+
+
+def build_frame_index(cfg, video_dirs):
+    index_file = cfg.DATA.FRAME_INDEX_FILE
+    if not index_file:
+        index_file = os.path.join(cfg.OUTPUT_DIR, "frame_index.json")
+    return FrameIndex(video_dirs, index_file)
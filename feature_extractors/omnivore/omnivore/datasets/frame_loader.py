@@ -2,6 +2,8 @@ import os
 import sys
 import torch
 import numpy as np
+from frame_io import frame_archive
+from frame_io.jpeg import decode_flag
 from . import utils as utils
 from .decoder import get_start_end_idx
 import glob
@@ -27,26 +29,43 @@ def temporal_sampling(num_frames, start_idx, end_idx, num_samples, start_frame=0
     return index
 
 
-def pack_frames_to_video_clip(cfg, video_record, dataset='epickitchens'):
-    # Load video by loading its extracted frames
+def get_video_dir(cfg, video_record, dataset='epickitchens'):
+    # Folder of the extracted frames of the untrimmed video
     if dataset == 'epickitchens':
-        path_to_video = '{}/{}/rgb_frames/{}'.format(cfg.EPICKITCHENS.VISUAL_DATA_DIR,
-                                                    video_record.participant,
-                                                    video_record.untrimmed_video_name)
-        num_frames_video = len(glob.glob('{}/*.jpg'.format(path_to_video)))
-        img_tmpl = "frame_{:010d}.jpg"
+        return '{}/{}/rgb_frames/{}'.format(cfg.EPICKITCHENS.VISUAL_DATA_DIR,
+                                            video_record.participant,
+                                            video_record.untrimmed_video_name)
     elif dataset == 'ave':
-        path_to_video = '{}/{}'.format(cfg.AVE.VISUAL_DATA_DIR, video_record.untrimmed_video_name)
-        num_frames_video = len(glob.glob('{}/*.jpg'.format(path_to_video)))
-        img_tmpl = "frame_{:010d}.jpg"
+        return '{}/{}'.format(cfg.AVE.VISUAL_DATA_DIR, video_record.untrimmed_video_name)
     elif dataset == 'perception':
-        path_to_video = '{}/{}'.format(cfg.PERCEPTION.VISUAL_DATA_DIR, video_record.untrimmed_video_name)
-        num_frames_video = len(glob.glob('{}/*.jpg'.format(path_to_video)))
-        img_tmpl = "frame_{:010d}.jpg"
+        return '{}/{}'.format(cfg.PERCEPTION.VISUAL_DATA_DIR, video_record.untrimmed_video_name)
     else:
         print("Dataset not implemented : ", dataset)
         sys.exit(1)
 
+
+def read_frames(path_to_video, frame_idxs, img_tmpl="frame_{:010d}.jpg", min_size=0):
+    """Decoded BGR frames of a video, from its archive if it was packed"""
+    archive = frame_archive.open_archive(path_to_video)
+    if archive is not None:
+        return [archive.decode(idx, decode_flag(archive.read(idx), min_size)) for idx in frame_idxs]
+    img_paths = [os.path.join(path_to_video, img_tmpl.format(idx)) for idx in frame_idxs]
+    return utils.retry_load_images(img_paths, backend="cv2", min_size=min_size)
+
+
+def count_video_frames(path_to_video, frame_index=None):
+    """Number of extracted frames of a video, from frame_index if given"""
+    if frame_index is not None:
+        if not frame_index.exists(path_to_video):
+            raise FileNotFoundError("No frames found for video {}".format(path_to_video))
+        return frame_index.num_frames(path_to_video)
+    elif frame_archive.has_archive(path_to_video):
+        return frame_archive.open_archive(path_to_video).num_frames
+    return len(glob.glob('{}/*.jpg'.format(path_to_video)))
+
+
+def get_frame_idx(cfg, video_record, num_frames_video):
+    """Frame numbers of the clip of video_record, as a tensor"""
     if cfg.DATA.FRAME_SAMPLING == 'like omnivore':
 
         seg_size = float(video_record.num_frames - 1) / cfg.DATA.NUM_FRAMES
@@ -60,7 +79,26 @@ def pack_frames_to_video_clip(cfg, video_record, dataset='epickitchens'):
     else:
         print("Data sampling method not implemented : ", cfg.DATA.FRAME_SAMPLING)
         sys.exit(1)
+    return frame_idx
+
+
+def load_frames(cfg, path_to_video, frame_idxs, frame_cache=None):
+    """Decoded BGR frames of frame_idxs, a list of frame numbers, through frame_cache if given"""
+    img_tmpl = "frame_{:010d}.jpg"
+    # Frames are resized to the crop size, so they can be decoded at a lower scale
+    min_size = cfg.DATA.TEST_CROP_SIZE if cfg.DATA.REDUCED_DECODE else 0
+    if frame_cache is not None:
+        return frame_cache.load(
+                    [(path_to_video, idx) for idx in frame_idxs],
+                    lambda keys: read_frames(path_to_video, [idx for _, idx in keys], img_tmpl, min_size)
+                )
+    return read_frames(path_to_video, frame_idxs, img_tmpl, min_size)
 
-    img_paths = [os.path.join(path_to_video, img_tmpl.format(idx.item())) for idx in frame_idx]
-    frames = utils.retry_load_images(img_paths)
-    return frames
+
+def pack_frames_to_video_clip(cfg, video_record, dataset='epickitchens', frame_index=None, frame_cache=None):
+    # Load video by loading its extracted frames
+    path_to_video = get_video_dir(cfg, video_record, dataset)
+    num_frames_video = count_video_frames(path_to_video, frame_index)
+    frame_idx = get_frame_idx(cfg, video_record, num_frames_video)
+    frames = load_frames(cfg, path_to_video, frame_idx.tolist(), frame_cache)
+    return torch.as_tensor(np.stack(frames))
@@ -10,9 +10,28 @@ from torch.utils.data._utils.collate import default_collate
 from torch.utils.data.distributed import DistributedSampler
 from torch.utils.data.sampler import RandomSampler
 
+import omnivore.utils.distributed as du
+from frame_io.frame_cache import VideoGroupedBatchSampler
+
 from .build import build_dataset
 
 
+def process_indices(num_samples):
+    """
+    The contiguous part of the dataset indices this process extracts. With
+    several GPUs the parts are padded to equal sizes as in DistributedSampler,
+    and each process keeps whole runs of neighbouring clips.
+    Args:
+        num_samples (int): size of the dataset.
+    """
+    num_replicas = du.get_world_size()
+    rank = du.get_rank()
+    per_replica = int(np.ceil(num_samples / num_replicas))
+    indices = list(range(num_samples))
+    indices += indices[:per_replica * num_replicas - len(indices)]
+    return indices[rank * per_replica:(rank + 1) * per_replica]
+
+
 def detection_collate(batch):
     """
     Collate function for detection task. Concatanate bboxes, labels and
@@ -69,6 +88,19 @@ def construct_loader(cfg, split):
 
     # Construct the dataset
     dataset = build_dataset(dataset_name, cfg, split)
+    # TEST.BATCH_SIZE counts views and each item stacks num_views of them
+    batch_size = max(batch_size // dataset.num_views, 1)
+    if cfg.DATA_LOADER.GROUP_BY_VIDEO:
+        batch_sampler = VideoGroupedBatchSampler(process_indices(len(dataset)), batch_size, cfg.DATA_LOADER.NUM_WORKERS)
+        loader = torch.utils.data.DataLoader(
+            dataset,
+            batch_sampler=batch_sampler,
+            num_workers=cfg.DATA_LOADER.NUM_WORKERS,
+            pin_memory=cfg.DATA_LOADER.PIN_MEMORY,
+            collate_fn=None,
+        )
+        return loader
+
     # Create a sampler for multi-process training
     sampler = DistributedSampler(dataset) if cfg.NUM_GPUS > 1 else None
     # Create a loader
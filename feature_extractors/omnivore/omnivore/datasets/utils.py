@@ -7,10 +7,24 @@ import torch
 
 import cv2
 
+from frame_io.jpeg import decode_flag
+
 logger = logging.getLogger(__name__)
 
 
-def retry_load_images(image_paths, retry=10, backend="pytorch", flow=False):
+def read_image(image_path, min_size=0):
+    """cv2.imread, decoding at a reduced scale if the short side stays at least min_size"""
+    if min_size <= 0:
+        return cv2.imread(image_path)
+    try:
+        with open(image_path, "rb") as fp:
+            img_np = np.frombuffer(fp.read(), np.uint8)
+    except OSError:
+        return None
+    return cv2.imdecode(img_np, decode_flag(img_np, min_size))
+
+
+def retry_load_images(image_paths, retry=10, backend="pytorch", flow=False, min_size=0):
     """
     This function is to load images with support of retrying for failed load.
 
@@ -18,6 +32,8 @@ def retry_load_images(image_paths, retry=10, backend="pytorch", flow=False):
         image_paths (list): paths of images needed to be loaded.
         retry (int, optional): maximum time of loading retrying. Defaults to 10.
         backend (str): `pytorch` or `cv2`.
+        min_size (int): if > 0, decode at the smallest scale libjpeg supports
+            with a short side of at least min_size.
 
     Returns:
         imgs (list): list of loaded images.
@@ -26,7 +42,7 @@ def retry_load_images(image_paths, retry=10, backend="pytorch", flow=False):
         if flow:
             imgs = [cv2.imread(image_path, cv2.IMREAD_GRAYSCALE) for image_path in image_paths]
         else:
-            imgs = [cv2.imread(image_path) for image_path in image_paths]
+            imgs = [read_image(image_path, min_size) for image_path in image_paths]
 
         if all(img is not None for img in imgs):
             if backend == "pytorch":
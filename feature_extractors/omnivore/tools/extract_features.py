@@ -39,6 +39,7 @@ def perform_feature_extraction(test_loader, model, test_meter, cfg):
 
     test_meter.iter_tic()
 
+    num_views = test_loader.dataset.num_views
     for cur_iter, (inputs, labels, video_idx, meta) in enumerate(test_loader):
 
         # Transfer the data to the current GPU device.
@@ -48,6 +49,11 @@ def perform_feature_extraction(test_loader, model, test_meter, cfg):
         else:
             inputs = inputs.cuda(non_blocking=True)
 
+        # Each item holds all the views of a clip, which go through the model
+        # together. Their ids are the clip index x num_views + the view index.
+        inputs = inputs.flatten(0, 1)
+        video_idx = (video_idx[:, None] * num_views + torch.arange(num_views)).flatten()
+        meta = {'narration_id': [n for n in meta['narration_id'] for _ in range(num_views)]}
         video_idx = video_idx.cuda()
 
         # Perform the forward pass.
@@ -109,14 +115,13 @@ def extract_features(cfg):
 
     if not cfg.TEST.SLIDE.ENABLE:
         assert (
-            len(test_loader.dataset)
-            % (cfg.TEST.NUM_FEATURES * cfg.TEST.NUM_SPATIAL_CROPS)
-            == 0
+            test_loader.dataset.num_views
+            == cfg.TEST.NUM_FEATURES * cfg.TEST.NUM_SPATIAL_CROPS
         )
 
     # Create meters
     test_meter = TestFeatureMeter(
-        len(test_loader.dataset),
+        len(test_loader.dataset) * test_loader.dataset.num_views,
         cfg.TEST.NUM_FEATURES, # each window plays an equal weight on the metrics
         len(test_loader)
     )
@@ -4,6 +4,10 @@ import os
 import argparse
 import sys
 import torch
+
+# frame_io is shared with the other extractors in feature_extractors/
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
 import omnivore.utils.multiprocessing as mpu
 from omnivore.config.defaults import get_cfg
 
@@ -6,11 +6,14 @@ import os
 
 import time_interval_machine.datasets.loader as loader
 import time_interval_machine.utils.logging as logging
+import time_interval_machine.utils.profiler as profiler
+import time_interval_machine.utils.resources as resources
 import time_interval_machine.utils.distributed as du
 import time_interval_machine.utils.checkpoint as ch
 import time_interval_machine.utils.misc as misc
+import time_interval_machine.utils.shards as shards
 
-from time_interval_machine.utils.meters import FeatureMeter
+from time_interval_machine.utils.meters import FeatureMeter, write_throughput_summary
 from time_interval_machine.models.build import build_model
 
 torch.set_printoptions(sci_mode=False)
@@ -31,10 +34,12 @@ def init_extract(args):
 
     # Setup logging format.
     logging.setup_logging(args.output_dir)
+    resources.start_sampler(args)
     is_master_proc = du.is_master_proc(args.num_gpus * args.num_shards)
 
     model, args = build_model(args)
     logger.info(model)
+    profiler.start_profiler(args, model, "extract")
 
     logger.info("Output dir : {}".format(args.output_dir))
 
@@ -55,7 +60,7 @@ def init_extract(args):
         else:
             mode = "test"
 
-    feat_loader = loader.create_loader(args, mode, args.data_modality, rng_generator)
+    feat_loader = loader.create_loader(args, mode, args.data_modality, rng_generator, contiguous=True)
     feat_meter = FeatureMeter(
                 num_actions=feat_loader.dataset.num_actions,
                 args=args
@@ -69,6 +74,8 @@ def init_extract(args):
                 is_master_proc=is_master_proc,
                 feat_meter=feat_meter
             )
+    if is_master_proc:
+        write_throughput_summary(args.output_dir, {"extract": feat_meter})
 
 def extract_features(
             args,
@@ -109,37 +116,48 @@ def extract_features(
                         )
             feat_meter.net_toc()
 
-            # Gather metrics onto 1 GPU
-            if args.num_gpus > 1:
-                output = du.all_gather([output])
-
-                meta = du.all_gather_unaligned(meta)
-                key = list(meta[0].keys())[0]
-                metadata = {key: []}
-                for i in range(len(meta)):
-                    metadata[key].extend(meta[i][key])
-
+            profiler.range_push("feature_meter")
             feat_meter.update(
                     output[0],
                     metadata
                 )
+            profiler.range_pop()
 
             # Measure elapsed time
             feat_meter.iter_toc()
+            feat_meter.update_throughput(
+                    [visual_input, audio_input],
+                    (v_queries + a_queries) * visual_input.size(0)
+                )
             if ((i+1) % args.print_freq == 0 or i == 0) and is_master_proc:
                 message = feat_meter.get_feat_message(i, len(feat_loader))
                 logger.info(message)
 
+            profiler.step("extract")
             feat_meter.iter_tic()
 
-        data = feat_meter.finalize_metrics()
-
-        if is_master_proc:
-            features_dir = os.path.join(args.output_dir, 'features')
-            if not os.path.exists(features_dir):
-                os.makedirs(features_dir)
-            feats_file = str(args.video_val_action_pickle).split("/")[-1].replace(".pkl", "")
-            file_path = os.path.join(features_dir, f'{feats_file}_features.pkl')
-            logger.info(f"Saving to file path: {file_path}")
-            pickle.dump(data, open(file_path, 'wb'))
-
+        features_dir = os.path.join(args.output_dir, 'features')
+        feats_file = str(args.video_val_action_pickle).split("/")[-1].replace(".pkl", "")
+        file_path = os.path.join(features_dir, f'{feats_file}_features.pkl')
+
+        world_size = du.get_world_size()
+        if world_size > 1:
+            # Each process saves its own sums, the root averages them once all are written
+            os.makedirs(features_dir, exist_ok=True)
+            shards.write_shard(feat_meter.get_shard(), file_path, du.get_rank(), world_size)
+            du.synchronize()
+            if du.is_root_proc():
+                manifest = shards.write_manifest(
+                                file_path,
+                                world_size,
+                                feat_loader.dataset.num_actions,
+                                args
+                            )
+                shards.merge_shards(manifest)
+        else:
+            data = feat_meter.finalize_metrics()
+            if is_master_proc:
+                if not os.path.exists(features_dir):
+                    os.makedirs(features_dir)
+                logger.info(f"Saving to file path: {file_path}")
+                pickle.dump(data, open(file_path, 'wb'))
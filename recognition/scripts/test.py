@@ -6,11 +6,13 @@ import os
 
 import time_interval_machine.datasets.loader as loader
 import time_interval_machine.utils.logging as logging
+import time_interval_machine.utils.profiler as profiler
+import time_interval_machine.utils.resources as resources
 import time_interval_machine.utils.distributed as du
 import time_interval_machine.utils.checkpoint as ch
 import time_interval_machine.utils.misc as misc
 
-from time_interval_machine.utils.meters import InferenceMeter
+from time_interval_machine.utils.meters import InferenceMeter, write_throughput_summary
 from time_interval_machine.models.build import build_model
 
 logger = logging.get_logger(__name__)
@@ -31,6 +33,7 @@ def init_test(args):
 
     # Setup logging format.
     logging.setup_logging(args.output_dir)
+    resources.start_sampler(args)
     is_master_proc = du.is_master_proc(args.num_gpus * args.num_shards)
 
     logger.info("Output dir : {}".format(args.output_dir))
@@ -42,6 +45,7 @@ def init_test(args):
 
     model, args = build_model(args)
     logger.info(model)
+    profiler.start_profiler(args, model, "val")
 
     ch.load_checkpoint(args, model)
 
@@ -73,6 +77,8 @@ def init_test(args):
                     wandb_log=False,
                     iters=0
                 )
+    if is_master_proc:
+        write_throughput_summary(args.output_dir, {"val": val_meter})
 
 def validate(
             args,
@@ -116,6 +122,7 @@ def validate(
                             a_queries
                         )
             val_meter.net_toc()
+            profiler.range_push("loss")
 
 
             # Compute visual loss
@@ -174,8 +181,11 @@ def validate(
                 a_target = torch.empty(size=(audio_input.size(0),))
                 a_action_ids = torch.empty(size=(audio_input.size(0),))
 
+            profiler.range_pop()
+
             # Gather losses onto 1 GPU
             if args.num_gpus > 1:
+                profiler.range_push("distributed")
                 verb_preds = du.all_gather([verb_preds])
                 noun_preds = du.all_gather([noun_preds])
                 action_preds = du.all_gather([action_preds])
@@ -191,6 +201,7 @@ def validate(
                 audio_loss = du.all_reduce([audio_loss])[0]
                 valid_visual = du.all_gather([torch.IntTensor(valid_visual)]).sum()
                 valid_audio = du.all_gather([torch.IntTensor(valid_audio)]).sum()
+                profiler.range_pop()
 
             val_meter.update(
                     verb_preds.detach().cpu(),
@@ -212,6 +223,10 @@ def validate(
 
             # Measure elapsed time
             val_meter.iter_toc()
+            val_meter.update_throughput(
+                    [visual_input, audio_input],
+                    (v_queries + a_queries) * visual_input.size(0)
+                )
             if i % args.print_freq == 0 and is_master_proc:
                 message = val_meter.get_val_message(
                         epoch,
@@ -220,6 +235,7 @@ def validate(
                     )
                 logger.info(message)
 
+            profiler.step("val")
             val_meter.iter_tic()
 
         best_acc1, is_best, stop = val_meter.update_epoch(epoch)
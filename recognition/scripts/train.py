@@ -8,11 +8,13 @@ import os
 import time_interval_machine.models.helpers.losses.drloc as drl
 import time_interval_machine.datasets.loader as loader
 import time_interval_machine.utils.logging as logging
+import time_interval_machine.utils.profiler as profiler
+import time_interval_machine.utils.resources as resources
 import time_interval_machine.utils.distributed as du
 import time_interval_machine.utils.checkpoint as ch
 import time_interval_machine.utils.misc as misc
 
-from time_interval_machine.utils.meters import TrainMeter, InferenceMeter
+from time_interval_machine.utils.meters import TrainMeter, InferenceMeter, write_throughput_summary
 from time_interval_machine.utils.mixup import mixup_data, mixup_criterion
 from time_interval_machine.utils.checkpoint import save_checkpoint
 from time_interval_machine.models.build import build_model
@@ -35,11 +37,13 @@ def init_train(args):
 
     # Setup logging format.
     logging.setup_logging(args.output_dir)
+    resources.start_sampler(args)
     logger.info(f"Random Seed is: {args.seed}")
     is_master_proc = du.is_master_proc(args.num_gpus * args.num_shards)
 
     model, args = build_model(args)
     logger.info(model)
+    profiler.start_profiler(args, model, "train")
 
     logger.info("Output dir : {}".format(args.output_dir))
 
@@ -159,6 +163,7 @@ def init_train(args):
             break
 
     if is_master_proc:
+        write_throughput_summary(args.output_dir, {"train": train_meter, "val": val_meter})
         wandb.finish()
 
 def train_epoch(
@@ -214,6 +219,7 @@ def train_epoch(
                         a_queries
                     )
             train_meter.net_toc()
+            profiler.range_push("loss")
 
             # For labels
             target_a = {k: torch.flatten(v) for k, v in target_a.items()}
@@ -348,9 +354,11 @@ def train_epoch(
             else:
                 drloc_loss = torch.FloatTensor([0.0]).detach()
 
+        profiler.range_pop()
         misc.check_nan_losses(loss)
 
         # Compute gradient and backprop
+        profiler.range_push("backward")
         optimizer.zero_grad()
         if args.enable_amp:
             scaler.scale(loss).backward()
@@ -367,9 +375,11 @@ def train_epoch(
 
         with warmup_scheduler.dampening():
             lr_scheduler.step()
+        profiler.range_pop()
 
         # Collect losses onto one GPU before update
         if args.num_gpus > 1:
+            profiler.range_push("distributed")
             verb_preds = du.all_gather([verb_preds])
             noun_preds = du.all_gather([noun_preds])
             action_preds = du.all_gather([action_preds])
@@ -387,6 +397,7 @@ def train_epoch(
             drloc_loss = du.all_reduce([drloc_loss])[0]
             valid_visual = du.all_gather([torch.IntTensor(valid_visual)]).sum()
             valid_audio = du.all_gather([torch.IntTensor(valid_audio)]).sum()
+            profiler.range_pop()
 
         # Track losses
         train_meter.update(
@@ -411,6 +422,10 @@ def train_epoch(
 
         # Measure elapsed time
         train_meter.iter_toc()
+        train_meter.update_throughput(
+                [visual_input, audio_input],
+                (v_queries + a_queries) * visual_input.size(0)
+            )
 
         if i % args.print_freq == 0 and is_master_proc:
             message = train_meter.get_train_message(
@@ -428,6 +443,7 @@ def train_epoch(
                 wandb.log(log_dict)
             logger.info(message)
 
+        profiler.step("train")
         train_meter.iter_tic()
 
     train_meter.update_epoch()
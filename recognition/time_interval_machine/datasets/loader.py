@@ -1,15 +1,41 @@
+import numpy as np
 import torch
 
+from torch.utils.data import Sampler
 from torch.utils.data.distributed import DistributedSampler
 
 import time_interval_machine.utils.logging as logging
+import time_interval_machine.utils.distributed as du
 
 from time_interval_machine.datasets.sliding_window import SlidingWindowDataset
 
 
 logger = logging.get_logger(__name__)
 
-def create_loader(args, split, modality, generator):
+class ContiguousSampler(Sampler):
+    """Splits the dataset into one contiguous block per process, in order
+    and without padding, so each sample is seen exactly once. If boundaries
+    are given, blocks are only split at those indices."""
+    def __init__(self, dataset, boundaries=None):
+        num_samples = len(dataset)
+        world_size = du.get_world_size()
+        cuts = np.linspace(0, num_samples, world_size + 1).round().astype(np.int64)
+        if boundaries is not None:
+            boundaries = np.append(np.asarray(boundaries, dtype=np.int64), num_samples)
+            nearest = np.abs(boundaries[None, :] - cuts[1:-1, None]).argmin(axis=1)
+            cuts[1:-1] = boundaries[nearest]
+
+        rank = du.get_rank()
+        self.start = int(cuts[rank])
+        self.end = int(cuts[rank + 1])
+
+    def __iter__(self):
+        return iter(range(self.start, self.end))
+
+    def __len__(self):
+        return self.end - self.start
+
+def create_loader(args, split, modality, generator, contiguous=False):
     logger.info("Creating {} loader for modality: {}".format(split, modality))
     if split == "train":
         v_action_pkl = args.video_train_action_pickle
@@ -47,7 +73,12 @@ def create_loader(args, split, modality, generator):
 
     batch_size = int(args.batch_size / max(1, args.num_gpus))
     workers = int(args.workers / max(1, args.num_gpus))
-    sampler = DistributedSampler(dataset) if args.num_gpus > 1 else None
+    if contiguous and du.get_world_size() > 1:
+        sampler = ContiguousSampler(dataset)
+    elif args.num_gpus > 1:
+        sampler = DistributedSampler(dataset)
+    else:
+        sampler = None
     loader = torch.utils.data.DataLoader(
             dataset,
             batch_size=batch_size,
@@ -1,12 +1,15 @@
 import numpy as np
+import subprocess
 import datetime
 import torch
+import json
+import os
 
 from fvcore.common.timer import Timer
 
 from time_interval_machine.utils.metrics import accuracy, multitask_accuracy
 import time_interval_machine.utils.logging as logging
-import time_interval_machine.utils.misc as misc
+import time_interval_machine.utils.resources as resources
 
 logger = logging.get_logger(__name__)
 
@@ -27,12 +30,106 @@ class AverageMeter(object):
         self.count += n
         self.avg = self.sum / self.count
 
+class ThroughputMeter(object):
+    """Windows, queries and feature tokens per second and the fraction of
+    time spent waiting for data. Rates are tracked as exponential moving
+    averages of each iteration, and as totals since the last reset and
+    since the start of the run."""
+    def __init__(self, model_modality, momentum=0.9):
+        self.model_modality = model_modality
+        self.momentum = momentum
+        self.run = self.empty_totals()
+        self.reset()
+
+    @staticmethod
+    def empty_totals():
+        return {"iters": 0, "windows": 0, "queries": 0, "tokens": 0, "time": 0.0, "data_time": 0.0}
+
+    def reset(self):
+        self.epoch = self.empty_totals()
+        self.ema = {}
+
+    def update(self, inputs, num_queries, iter_time, data_time):
+        if iter_time <= 0.0:
+            return
+        num_windows = inputs[0].size(0)
+        num_tokens = 0
+        if "visual" in self.model_modality:
+            num_tokens += inputs[0].size(0) * inputs[0].size(1)
+        if "audio" in self.model_modality:
+            num_tokens += inputs[1].size(0) * inputs[1].size(1)
+
+        for totals in [self.epoch, self.run]:
+            totals["iters"] += 1
+            totals["windows"] += num_windows
+            totals["queries"] += int(num_queries)
+            totals["tokens"] += num_tokens
+            totals["time"] += iter_time
+            totals["data_time"] += data_time
+
+        rates = self.get_rates({
+                    "windows": num_windows,
+                    "queries": num_queries,
+                    "tokens": num_tokens,
+                    "time": iter_time,
+                    "data_time": data_time
+                })
+        for k, v in rates.items():
+            self.ema[k] = v if k not in self.ema else self.momentum * self.ema[k] + (1 - self.momentum) * v
+
+    @staticmethod
+    def get_rates(totals):
+        time = max(totals["time"], 1e-8)
+        return {
+            "windows_per_sec": totals["windows"] / time,
+            "queries_per_sec": totals["queries"] / time,
+            "tokens_per_sec": totals["tokens"] / time,
+            "data_wait": totals["data_time"] / time
+        }
+
+    def get_message(self):
+        if len(self.ema) == 0:
+            return ''
+        return (' Windows/s: {windows_per_sec:.1f} |'
+                ' Queries/s: {queries_per_sec:.0f} |'
+                ' Tokens/s: {tokens_per_sec:.0f} |'
+                ' Data Wait: {data_wait:.1%} |'.format(**self.ema))
+
+    def get_stats(self, prefix, epoch=False):
+        rates = self.get_rates(self.epoch) if epoch else self.ema
+        return {f"{prefix}/{k}": v for k, v in rates.items()}
+
+    def summary(self):
+        return {**self.run, **self.get_rates(self.run)}
+
+
+def write_throughput_summary(output_dir, meters):
+    """Save the run throughput of each meter, e.g. {"train": train_meter},
+    with the commit it was measured at to output_dir/throughput.json"""
+    try:
+        commit = subprocess.run(
+                        ["git", "rev-parse", "HEAD"],
+                        cwd=os.path.dirname(os.path.abspath(__file__)),
+                        capture_output=True,
+                        text=True
+                    ).stdout.strip()
+    except OSError:
+        commit = ""
+
+    summary = {"commit": commit}
+    summary.update({name: meter.throughput.summary() for name, meter in meters.items()})
+    file_path = os.path.join(output_dir, "throughput.json")
+    with open(file_path, 'w') as f:
+        json.dump(summary, f, indent=4)
+    logger.info(f"Saved throughput summary to {file_path}")
+
 class TrainMeter(object):
     """Tracks multiple metrics for TIM model during training"""
     def __init__(self, args, num_actions):
         self.iter_timer = Timer()
         self.data_timer = Timer()
         self.net_timer = Timer()
+        self.throughput = ThroughputMeter(args.model_modality)
 
         self.losses = AverageMeter()
         self.drloc_losses = AverageMeter()
@@ -72,6 +169,7 @@ class TrainMeter(object):
         self.reset()
 
     def reset(self):
+        self.throughput.reset()
         self.losses.reset()
         self.drloc_losses.reset()
         self.visual_verb_losses.reset()
@@ -110,6 +208,14 @@ class TrainMeter(object):
     def net_toc(self):
         self.net_timer.pause()
 
+    def update_throughput(self, inputs, num_queries):
+        self.throughput.update(
+                inputs,
+                num_queries,
+                self.iter_timer.seconds(),
+                self.data_timer.seconds()
+            )
+
     def iter_toc(self):
         """
         Stop to record time.
@@ -206,6 +312,7 @@ class TrainMeter(object):
                     }
                 )
 
+        stats_dict.update(self.throughput.get_stats("Train"))
         return stats_dict
 
     def get_train_message(self, epoch, i, dataloader_size, lr):
@@ -244,10 +351,11 @@ class TrainMeter(object):
                         ' RAM: {ram[0]:.2f}/{ram[1]:.2f}GB |'
                         ' GPU: {gpu[0]:.2f}/{gpu[1]:.2f}GB |'.format(
                                                 loss=self.losses,
-                                                ram=misc.cpu_mem_usage(),
-                                                gpu=misc.gpu_mem_usage()
+                                                ram=resources.cpu_mem_usage(),
+                                                gpu=resources.gpu_mem_usage()
                                             )
                         )
+        message_str += self.throughput.get_message()
         return message_str
 
     def update_epoch(self):
@@ -328,6 +436,7 @@ class TrainMeter(object):
                     }
                 )
 
+        stats_dict.update(self.throughput.get_stats("Train_Epoch", epoch=True))
         return stats_dict
 
     def get_train_epoch_message(self, epoch):
@@ -418,6 +527,7 @@ class InferenceMeter(object):
         self.iter_timer = Timer()
         self.data_timer = Timer()
         self.net_timer = Timer()
+        self.throughput = ThroughputMeter(args.model_modality)
         self.losses = AverageMeter()
 
         self.visual_verb_losses = AverageMeter()
@@ -447,6 +557,7 @@ class InferenceMeter(object):
         self.reset()
 
     def reset(self):
+        self.throughput.reset()
         self.losses.reset()
 
         self.visual_verb_losses.reset()
@@ -487,6 +598,14 @@ class InferenceMeter(object):
     def net_toc(self):
         self.net_timer.pause()
 
+    def update_throughput(self, inputs, num_queries):
+        self.throughput.update(
+                inputs,
+                num_queries,
+                self.iter_timer.seconds(),
+                self.data_timer.seconds()
+            )
+
     def update(
             self,
             verb_preds,
@@ -627,10 +746,11 @@ class InferenceMeter(object):
         message_str += (' RAM: {ram[0]:.2f}/{ram[1]:.2f}GB |'
                         ' GPU: {gpu[0]:.2f}/{gpu[1]:.2f}GB |'.format(
                                                 loss=self.losses,
-                                                ram=misc.cpu_mem_usage(),
-                                                gpu=misc.gpu_mem_usage()
+                                                ram=resources.cpu_mem_usage(),
+                                                gpu=resources.gpu_mem_usage()
                                             )
                         )
+        message_str += self.throughput.get_message()
         return message_str
 
     def get_val_epoch_message(self, epoch):
@@ -728,6 +848,7 @@ class InferenceMeter(object):
                     }
                 )
 
+        stats_dict.update(self.throughput.get_stats("Val", epoch=True))
         return stats_dict
 
     def state_dict(self):
@@ -746,6 +867,7 @@ class FeatureMeter(object):
         self.iter_timer = Timer()
         self.data_timer = Timer()
         self.net_timer = Timer()
+        self.throughput = ThroughputMeter(args.model_modality)
         self.total_time = 0
         self.peak_cpu_mem = 0.0
         self.peak_gpu_mem = 0.0
@@ -803,6 +925,14 @@ class FeatureMeter(object):
     def net_toc(self):
         self.net_timer.pause()
 
+    def update_throughput(self, inputs, num_queries):
+        self.throughput.update(
+                inputs,
+                num_queries,
+                self.iter_timer.seconds(),
+                self.data_timer.seconds()
+            )
+
 
     def update(self, features, metadata):
         """
@@ -815,11 +945,7 @@ class FeatureMeter(object):
             clip_ids (tensor): clip indexes of the current batch, dimension is
                 N.
         """
-        ram = misc.cpu_mem_usage()
-        gpu = misc.gpu_mem_usage()
-
-        self.peak_cpu_mem = max(ram[0], self.peak_cpu_mem)
-        self.peak_gpu_mem = max(gpu[0], self.peak_gpu_mem)
+        resources.track_mem_usage()
 
         if "visual" in self.modality:
             n_ids = metadata['v_narration_ids']
@@ -856,7 +982,7 @@ class FeatureMeter(object):
                 self.narration_ids[a_action_ids] = n_ids[audio_indices]
 
     def get_feat_message(self, iters, total_iters):
-        return ('| [{0}/{1}] | Features Extracted: {num_feats} |'
+        message_str = ('| [{0}/{1}] | Features Extracted: {num_feats} |'
                 ' Time: {batch_time:.3f} |'
                 ' Data: {data_time:.3f} |'
                 ' Net: {net_time:.3f} |'
@@ -868,10 +994,45 @@ class FeatureMeter(object):
                                             batch_time=self.iter_timer.seconds(),
                                             data_time=self.data_timer.seconds(),
                                             net_time=self.net_timer.seconds(),
-                                            ram=misc.cpu_mem_usage(),
-                                            gpu=misc.gpu_mem_usage()
+                                            ram=resources.cpu_mem_usage(),
+                                            gpu=resources.gpu_mem_usage()
                                         )
             )
+        message_str += self.throughput.get_message()
+        return message_str
+
+    def get_shard(self):
+        """Unnormalised sums for the actions seen by this process, which are
+        added into the full meter by merge_shard"""
+        action_ids = torch.where(self.seen_count > 0)[0]
+        shard = {
+                "action_ids": action_ids.numpy(),
+                "seen_count": self.seen_count[action_ids].numpy(),
+                "narration_ids": self.narration_ids[action_ids.numpy()],
+                "last_visual": int(self.last_visual),
+                "action": self.action_preds[action_ids].numpy(),
+                "audio": self.aud_preds[action_ids].numpy()
+            }
+        if self.include_verb_noun:
+            shard.update(
+                    {
+                        "verb": self.verb_preds[action_ids].numpy(),
+                        "noun": self.noun_preds[action_ids].numpy()
+                    }
+                )
+        return shard
+
+    def merge_shard(self, shard):
+        action_ids = torch.from_numpy(shard["action_ids"])
+        if self.include_verb_noun:
+            self.verb_preds.index_add_(0, action_ids, torch.from_numpy(shard["verb"]))
+            self.noun_preds.index_add_(0, action_ids, torch.from_numpy(shard["noun"]))
+
+        self.action_preds.index_add_(0, action_ids, torch.from_numpy(shard["action"]))
+        self.aud_preds.index_add_(0, action_ids, torch.from_numpy(shard["audio"]))
+        self.seen_count.index_add_(0, action_ids, torch.from_numpy(shard["seen_count"]))
+        self.narration_ids[shard["action_ids"]] = shard["narration_ids"]
+        self.last_visual = max(self.last_visual, shard["last_visual"])
 
     def finalize_metrics(self):
         missing = torch.where(self.seen_count == 0)[0]
@@ -903,6 +1064,7 @@ class FeatureMeter(object):
                         "noun": self.noun_preds.numpy()
                     }
                 )
+        self.peak_cpu_mem, self.peak_gpu_mem = resources.peak_mem_usage()
         time_taken = str(datetime.timedelta(seconds=int(self.total_time)))
         final_message = (f'| Features Extracted: {(self.seen_count > 0).sum()} |'
                          f' Time Elapsed: {time_taken} |'
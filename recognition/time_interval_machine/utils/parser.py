@@ -137,6 +137,25 @@ def parse_args():
     # ------------------------------ Misc ------------------------------------
     parser.add_argument('--output_dir', type=Path)
     parser.add_argument('--enable_wandb_log', action='store_true')
+    parser.add_argument('--profile',
+                        action='store_true',
+                        help='Profile a range of iterations and save a Chrome trace to output_dir/profile'
+                    )
+    parser.add_argument('--profile_start',
+                        default=10,
+                        type=int,
+                        help='First iteration to profile with --profile'
+                    )
+    parser.add_argument('--profile_steps',
+                        default=5,
+                        type=int,
+                        help='Number of iterations to profile with --profile'
+                    )
+    parser.add_argument('--resource_interval',
+                        default=1.0,
+                        type=float,
+                        help='Seconds between background samples of memory and CPU usage, 0 disables the sampler'
+                    )
     parser.add_argument('--seed', default=0, type=int, help='Random Seed')
     parser.add_argument('--print-freq', '-p',
                         default=100,
@@ -0,0 +1,182 @@
+"""Profiling of a range of iterations with the torch profiler."""
+
+import torch
+import os
+
+from torch import nn
+from torch.profiler import profile, record_function, ProfilerActivity
+
+import time_interval_machine.utils.distributed as du
+import time_interval_machine.utils.logging as logging
+
+logger = logging.get_logger(__name__)
+
+_PROFILER = None
+
+
+class StepProfiler(object):
+    """
+    Runs the torch profiler over iterations [start, start + num_steps) of a
+    loop. While it runs, every submodule of TIM and every encoder layer is
+    wrapped in a named range with forward hooks, and the loops add ranges
+    around the loss, backward and distributed code. Afterwards a Chrome
+    trace and a table of the time and memory of each range are saved.
+    Args:
+        model (nn.Module): TIM, optionally wrapped in DistributedDataParallel.
+        output_dir (str): folder to save the trace and the table to.
+        name (str): name of the profiled loop, e.g. train.
+        start (int): first profiled iteration.
+        num_steps (int): number of profiled iterations.
+    """
+    def __init__(self, model, output_dir, name, start=10, num_steps=5):
+        self.model = model.module if hasattr(model, "module") else model
+        self.output_dir = output_dir
+        self.name = name
+        self.start = start
+        self.end = start + num_steps
+        self.step_num = 0
+
+        self.prof = None
+        self.hooks = []
+        self.ranges = []
+        self.range_names = set()
+
+        if self.start == 0:
+            self.start_profile()
+
+    @property
+    def active(self):
+        return self.prof is not None
+
+    def push(self, name):
+        ctx = record_function(name)
+        ctx.__enter__()
+        self.ranges.append(ctx)
+        self.range_names.add(name)
+
+    def pop(self):
+        self.ranges.pop().__exit__(None, None, None)
+
+    def add_hooks(self):
+        # TIM itself is named after its forward_type, e.g. TIM.encoder
+        def push_forward(module, args):
+            self.push(f"TIM.{args[1]}" if len(args) > 1 else "TIM")
+
+        def push_module(name):
+            return lambda module, args: self.push(name)
+
+        def pop_module(module, args, output):
+            self.pop()
+
+        modules = [(None, self.model)]
+        for name, module in self.model.named_children():
+            modules.append((f"TIM.{name}", module))
+            # Break the transformer encoder down into its layers
+            if isinstance(getattr(module, "layers", None), nn.ModuleList):
+                for l, layer in enumerate(module.layers):
+                    modules.append((f"TIM.{name}.layers.{l}", layer))
+
+        for name, module in modules:
+            pre_hook = push_forward if name is None else push_module(name)
+            self.hooks.append(module.register_forward_pre_hook(pre_hook))
+            self.hooks.append(module.register_forward_hook(pop_module))
+
+    def start_profile(self):
+        activities = [ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(ProfilerActivity.CUDA)
+
+        logger.info(f"Profiling {self.name} iterations {self.start} to {self.end - 1}.")
+        self.add_hooks()
+        self.prof = profile(activities=activities, profile_memory=True)
+        self.prof.start()
+
+    def stop_profile(self):
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+        self.prof.stop()
+        for hook in self.hooks:
+            hook.remove()
+        self.hooks = []
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        prefix = os.path.join(self.output_dir, f"{self.name}_rank{du.get_rank()}")
+        self.prof.export_chrome_trace(f"{prefix}_trace.json")
+
+        events = self.prof.key_averages()
+        table = range_table(events, self.range_names, self.end - self.start)
+        with open(f"{prefix}_ranges.txt", 'w') as f:
+            f.write(table + "\n\n")
+            f.write(events.table(sort_by="self_cpu_time_total", row_limit=50))
+
+        logger.info(f"Profile of {self.name} iterations {self.start} to {self.end - 1}:\n{table}")
+        logger.info(f"Saved Chrome trace to {prefix}_trace.json")
+        self.prof = None
+
+    def step(self):
+        """Returns True once the profiled iterations are done"""
+        self.step_num += 1
+        if self.step_num == self.start:
+            self.start_profile()
+        elif self.step_num == self.end:
+            self.stop_profile()
+            return True
+        return False
+
+
+def range_table(events, names, num_steps):
+    """Time and memory of the named ranges per profiled iteration, slowest
+    first. Memory is the net amount allocated inside each range."""
+    def device_time(e):
+        return getattr(e, "device_time_total", getattr(e, "cuda_time_total", 0))
+
+    def device_memory(e):
+        return getattr(e, "device_memory_usage", getattr(e, "cuda_memory_usage", 0))
+
+    rows = [e for e in events if e.key in names]
+    rows = sorted(rows, key=lambda e: max(device_time(e), e.cpu_time_total), reverse=True)
+
+    width = max([len(e.key) for e in rows] + [len("Range")])
+    lines = [
+        f"{'Range':<{width}} {'Calls':>7} {'CPU (ms)':>10} {'Device (ms)':>12} {'CPU Mem (MB)':>13} {'Device Mem (MB)':>16}"
+    ]
+    for e in rows:
+        lines.append(
+            f"{e.key:<{width}} {e.count / num_steps:>7.1f}"
+            f" {e.cpu_time_total / num_steps / 1e3:>10.3f}"
+            f" {device_time(e) / num_steps / 1e3:>12.3f}"
+            f" {e.cpu_memory_usage / num_steps / 1024 ** 2:>13.2f}"
+            f" {device_memory(e) / num_steps / 1024 ** 2:>16.2f}"
+        )
+    return "\n".join(lines)
+
+
+def start_profiler(args, model, name):
+    """Profile the loop called name if --profile is set"""
+    global _PROFILER
+    if args.profile:
+        _PROFILER = StepProfiler(
+                        model,
+                        os.path.join(args.output_dir, "profile"),
+                        name,
+                        start=args.profile_start,
+                        num_steps=args.profile_steps
+                    )
+    return _PROFILER
+
+
+def step(name):
+    """Mark the end of an iteration of the loop called name"""
+    global _PROFILER
+    if _PROFILER is not None and _PROFILER.name == name and _PROFILER.step():
+        _PROFILER = None
+
+
+def range_push(name):
+    if _PROFILER is not None and _PROFILER.active:
+        _PROFILER.push(name)
+
+
+def range_pop():
+    if _PROFILER is not None and _PROFILER.active:
+        _PROFILER.pop()
@@ -0,0 +1,92 @@
+import argparse
+import pickle
+import json
+import os
+
+from types import SimpleNamespace
+
+import time_interval_machine.utils.logging as logging
+
+from time_interval_machine.utils.meters import FeatureMeter
+
+logger = logging.get_logger(__name__)
+
+EXT = ".pkl"
+
+
+def shard_path(file_path, rank, world_size):
+    return file_path.replace(EXT, f".rank{rank}-of-{world_size}{EXT}")
+
+
+def manifest_path(file_path):
+    return file_path.replace(EXT, ".manifest.json")
+
+
+def write_shard(shard, file_path, rank, world_size):
+    """Save the per action sums of one process next to the final output file"""
+    path = shard_path(file_path, rank, world_size)
+    logger.info(f"Saving shard to file path: {path}")
+    pickle.dump(shard, open(path, 'wb'))
+    return path
+
+
+def write_manifest(file_path, world_size, num_actions, args):
+    """List the shards to merge into file_path, with the arguments needed to
+    rebuild the FeatureMeter that merges them"""
+    path = manifest_path(file_path)
+    manifest = {
+            "output": os.path.basename(file_path),
+            "world_size": world_size,
+            "shards": [
+                os.path.basename(shard_path(file_path, r, world_size))
+                for r in range(world_size)
+            ],
+            "num_actions": int(num_actions),
+            "data_modality": args.data_modality,
+            "model_modality": args.model_modality,
+            "include_verb_noun": args.include_verb_noun,
+            "num_class": args.num_class
+        }
+    with open(path, 'w') as f:
+        json.dump(manifest, f, indent=4)
+    return path
+
+
+def merge_shards(path, remove_shards=True):
+    """
+    Merge the shards listed in a manifest into a single output file.
+    Windows on either side of a process boundary share actions, so the sums
+    are added by action id before averaging over all the windows each action
+    was seen in.
+    """
+    root = os.path.dirname(path)
+    with open(path, 'r') as f:
+        manifest = json.load(f)
+
+    args = SimpleNamespace(
+                data_modality=manifest["data_modality"],
+                model_modality=manifest["model_modality"],
+                include_verb_noun=manifest["include_verb_noun"],
+                num_class=manifest["num_class"]
+            )
+    feat_meter = FeatureMeter(num_actions=manifest["num_actions"], args=args)
+    for s in manifest["shards"]:
+        feat_meter.merge_shard(pickle.load(open(os.path.join(root, s), 'rb')))
+    data = feat_meter.finalize_metrics()
+
+    file_path = os.path.join(root, manifest["output"])
+    logger.info(f"Saving merged shards to file path: {file_path}")
+    pickle.dump(data, open(file_path, 'wb'))
+
+    if remove_shards:
+        for s in manifest["shards"]:
+            os.remove(os.path.join(root, s))
+    return file_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merge the shards of a distributed extraction")
+    parser.add_argument("manifest", type=str, help="Path to the .manifest.json of the extraction")
+    parser.add_argument("--keep_shards", action='store_true', help="Do not delete the shards after merging")
+    args = parser.parse_args()
+    merge_shards(args.manifest, remove_shards=not args.keep_shards)